@@ -4,85 +4,183 @@ import pygame
 
 from roadblock.yosys import run_yosys_flow
 from roadblock.dim import Dim
-from roadblock.placer import AnnealingPlacer
-
-from roadblock.router import route
-from roadblock.grid import GatesGrid
+from roadblock.placer import Placer, AnnealingPlacer
+from roadblock.parallel_placer import ParallelTemperingPlacer
+from roadblock.analytic_placer import place_quadratic
+from roadblock.multilevel_placer import place_multilevel
+from roadblock.detailed_placer import place_detailed
+from roadblock.port_placer import assign_ports
+
+from roadblock.router import route, route_negotiated
+from roadblock.global_router import route_global_detailed
+from roadblock.layer_router import route_layer_assigned
+from roadblock.parallel_router import route_parallel
+from roadblock.grid import GatesGrid, CongestionParams
 
 from roadblock import visual
 from roadblock import hud
 from roadblock import log
 
 
-log.enable_debug()
-
 #  python3 -m roadblock roadblock_cells.lib test.v adder 16
+#  python3 -m roadblock roadblock_cells.lib test.v adder 16 --headless
+#  python3 -m roadblock roadblock_cells.lib test.v adder 16 --headless --analytic
+#  python3 -m roadblock roadblock_cells.lib test.v adder 16 --headless --multilevel
+#  python3 -m roadblock roadblock_cells.lib test.v adder 16 --headless --detailed
+#  python3 -m roadblock roadblock_cells.lib test.v adder 16 --headless --assign-ports
+#  python3 -m roadblock roadblock_cells.lib test.v adder 16 --headless --congestion
+#  python3 -m roadblock roadblock_cells.lib test.v adder 16 --headless --negotiated
+#  python3 -m roadblock roadblock_cells.lib test.v adder 16 --headless --global-route
+#  python3 -m roadblock roadblock_cells.lib test.v adder 16 --headless --layer-assign
+#  python3 -m roadblock roadblock_cells.lib test.v adder 16 --headless --debug
+#  python3 -m roadblock roadblock_cells.lib test.v adder 16 --headless --stream
+#  python3 -m roadblock roadblock_cells.lib test.v adder 16 --headless --parallel-place
+#  python3 -m roadblock roadblock_cells.lib test.v adder 16 --headless --parallel-route
+
+
+# Workers of the parallel placer and router are spawned and import this module
+# again, so nothing may run on import
+def main() -> None:
+    lib_file = sys.argv[1]
+    verilog_file = sys.argv[2]
+    module = sys.argv[3]
+    grid_dim = Dim(int(sys.argv[4]), int(sys.argv[4]))
+    headless = "--headless" in sys.argv[5:]
+    debug = "--debug" in sys.argv[5:]
+    stream = "--stream" in sys.argv[5:]
+    analytic = "--analytic" in sys.argv[5:]
+    multilevel = "--multilevel" in sys.argv[5:]
+    detailed = "--detailed" in sys.argv[5:]
+    assign = "--assign-ports" in sys.argv[5:]
+    negotiated = "--negotiated" in sys.argv[5:]
+    global_route = "--global-route" in sys.argv[5:]
+    layer_assign = "--layer-assign" in sys.argv[5:]
+    parallel_place = "--parallel-place" in sys.argv[5:]
+    parallel_route = "--parallel-route" in sys.argv[5:]
+    congestion = (
+        CongestionParams(weight=1.0) if "--congestion" in sys.argv[5:] else None
+    )
+    screen_dim = Dim(1024, 1024)
+    scale = screen_dim // grid_dim
+
+    # Debug logs a line for every move, headless runs only want it when asked for
+    if debug or not headless:
+        log.enable_debug()
+
+    if headless:
+        gates, netlist = run_yosys_flow(verilog_file, lib_file, module, stream=stream)
+        headless_grid = GatesGrid(grid_dim, gates, netlist, congestion=congestion)
+        log.info(f"{headless_grid.num_filled} of {grid_dim.x*grid_dim.y} cells filled")
+
+        # An analytical seed only needs annealing at a low temperature to refine
+        if analytic:
+            place_quadratic(headless_grid)
+
+        if multilevel:
+            place_multilevel(headless_grid)
+        else:
+            if parallel_place:
+                headless_placer: Placer = ParallelTemperingPlacer(
+                    num_replicas=4,
+                    min_temp=0.1,
+                    max_temp=1 if analytic else 10,
+                    max_steps=20000,
+                    steps_per_exchange=500,
+                )
+            else:
+                headless_placer = AnnealingPlacer(
+                    init_temp=1 if analytic else 10, min_temp=0, max_steps=5000
+                )
+
+            headless_placer.run(
+                headless_grid,
+                callback=lambda placer: log.info(placer.hud_string),
+                callback_every=1000,
+            )
 
-lib_file = sys.argv[1]
-verilog_file = sys.argv[2]
-module = sys.argv[3]
-grid_dim = Dim(int(sys.argv[4]), int(sys.argv[4]))
-screen_dim = Dim(1024, 1024)
-scale = screen_dim // grid_dim
-
-pygame.init()
-pygame.display.set_caption("Roadblock")
-display = pygame.display.set_mode((screen_dim.x, screen_dim.y))
-
-running = True
-error = False
-placement_complete = False  # TODO: Use an enum
-routing_complete = False
-placer = None
-grid = None
-
-while running:
-    if error:
-        hud.draw_logs(display, screen_dim)
-        pygame.display.update()
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-
-        continue
+        if assign:
+            assign_ports(headless_grid)
 
-    try:
-        if placer is None:
-            gates, netlist = run_yosys_flow(verilog_file, lib_file, module)
-            placer = AnnealingPlacer(
-                init_temp=10,
-                min_temp=0,
-                max_steps=5000,
-            )
-            # placer = RandomPlacer(max_steps=2000)
+        if detailed:
+            place_detailed(headless_grid)
 
-            grid = GatesGrid(grid_dim, gates, netlist)
-            log.info(
-                f"{grid.num_filled} of {grid_dim.x*grid_dim.y} cells filled",
-            )
+        if negotiated:
+            route_negotiated(headless_grid, 30)
+        elif global_route:
+            route_global_detailed(headless_grid, 30)
+        elif layer_assign:
+            route_layer_assigned(headless_grid, 30)
+        elif parallel_route:
+            route_parallel(headless_grid, 30)
         else:
-            if not placement_complete:
+            route(headless_grid, 30)
+
+        return
+
+    pygame.init()
+    pygame.display.set_caption("Roadblock")
+    display = pygame.display.set_mode((screen_dim.x, screen_dim.y))
+
+    running = True
+    error = False
+    placement_complete = False  # TODO: Use an enum
+    routing_complete = False
+    placer = None
+    grid: GatesGrid | None = None
+
+    while running:
+        if error:
+            hud.draw_logs(display, screen_dim)
+            pygame.display.update()
+
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+
+            continue
+
+        try:
+            if placer is None:
+                gates, netlist = run_yosys_flow(
+                    verilog_file, lib_file, module, stream=stream
+                )
+                placer = AnnealingPlacer(
+                    init_temp=10,
+                    min_temp=0,
+                    max_steps=5000,
+                )
+                # placer = RandomPlacer(max_steps=2000)
+
+                grid = GatesGrid(grid_dim, gates, netlist)
+                log.info(
+                    f"{grid.num_filled} of {grid_dim.x*grid_dim.y} cells filled",
+                )
+            elif not placement_complete and grid is not None:
                 placement_complete = placer.update(grid)
 
-        if placement_complete and not routing_complete and grid is not None:
-            route(grid, 30)
-            routing_complete = True
+            if placement_complete and not routing_complete and grid is not None:
+                route(grid, 30)
+                routing_complete = True
+
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
 
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
+                if event.type == pygame.MOUSEMOTION and grid is not None:
+                    pos = Dim(event.pos[0], event.pos[1])
+                    hud.update(grid, scale, pos)
 
-            if event.type == pygame.MOUSEMOTION:
-                pos = Dim(event.pos[0], event.pos[1])
-                hud.update(grid, scale, pos)
+            if grid is not None:
+                visual.draw_grid(display, grid, scale)
+                hud.draw_hud(grid, display, placer, screen_dim, scale)
 
-        visual.draw_grid(display, grid, scale)
-        hud.draw_hud(grid, display, placer, screen_dim, scale)
+        except (ValueError, KeyError):
+            error = True
+            raise
+
+        hud.draw_logs(display, screen_dim)
+        pygame.display.update()
 
-    except (ValueError, KeyError):
-        error = True
-        raise
 
-    hud.draw_logs(display, screen_dim)
-    pygame.display.update()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import numpy as np
+
+from roadblock.grid import GatesGrid
+from roadblock.netlist import Netlist
+
+from roadblock import log
+
+
+CLIQUE_MAX_GATES = 5
+ANCHOR_WEIGHT = 1e-3
+
+
+def get_net_gate_groups(netlist: Netlist) -> tuple[np.ndarray, np.ndarray]:
+    # Distinct gates of every net, grouped by net, with the offset of each group
+    gate_ids = np.repeat(
+        np.arange(netlist.num_gates, dtype=np.int32),
+        np.diff(netlist.gate_net_offsets),
+    )
+    order = np.argsort(netlist.gate_net_indices, kind="stable")
+    counts = np.bincount(netlist.gate_net_indices, minlength=netlist.num_nets)
+
+    offsets = np.zeros(netlist.num_nets + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    return gate_ids[order], offsets
+
+
+def get_net_model_edges(
+    netlist: Netlist,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    # Small nets are modelled as cliques, large nets as stars around an extra
+    # node so the number of edges stays linear in the number of pins
+    net_gates, offsets = get_net_gate_groups(netlist)
+    num_net_gates = np.diff(offsets)
+
+    lhs: list[np.ndarray] = []
+    rhs: list[np.ndarray] = []
+    weights: list[np.ndarray] = []
+
+    for num in range(2, CLIQUE_MAX_GATES + 1):
+        nets = np.flatnonzero(num_net_gates == num)
+
+        if len(nets) == 0:
+            continue
+
+        groups = net_gates[offsets[nets][:, None] + np.arange(num)[None, :]]
+        pair_lhs, pair_rhs = np.triu_indices(num, 1)
+
+        lhs.append(groups[:, pair_lhs].reshape(-1))
+        rhs.append(groups[:, pair_rhs].reshape(-1))
+        weights.append(np.full(len(nets) * len(pair_lhs), 1 / (num - 1)))
+
+    star_nets = np.flatnonzero(num_net_gates > CLIQUE_MAX_GATES)
+    star_counts = num_net_gates[star_nets]
+
+    star_starts = np.repeat(offsets[star_nets], star_counts)
+    star_pins = np.arange(star_counts.sum()) - np.repeat(
+        np.cumsum(star_counts) - star_counts, star_counts
+    )
+
+    lhs.append(net_gates[star_starts + star_pins])
+    rhs.append(netlist.num_gates + np.repeat(np.arange(len(star_nets)), star_counts))
+    weights.append(np.repeat(star_counts / (star_counts - 1), star_counts))
+
+    return (
+        np.concatenate(lhs).astype(np.int64),
+        np.concatenate(rhs).astype(np.int64),
+        np.concatenate(weights),
+        netlist.num_gates + len(star_nets),
+    )
+
+
+def solve_conjugate_gradient(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    values: np.ndarray,
+    diag: np.ndarray,
+    b: np.ndarray,
+    x: np.ndarray,
+    max_iters: int,
+    tol: float,
+) -> np.ndarray:
+    # Jacobi preconditioned CG for a symmetric positive definite matrix given as
+    # its diagonal plus off diagonal entries in coordinate form
+    def matvec(v: np.ndarray) -> np.ndarray:
+        return diag * v + np.bincount(rows, weights=values * v[cols], minlength=len(v))
+
+    residual = b - matvec(x)
+    z = residual / diag
+    direction = z.copy()
+    rz = residual @ z
+    b_norm = np.linalg.norm(b) or 1.0
+
+    for _ in range(max_iters):
+        if np.linalg.norm(residual) < tol * b_norm:
+            break
+
+        a_direction = matvec(direction)
+        step = rz / (direction @ a_direction)
+
+        x = x + step * direction
+        residual = residual - step * a_direction
+
+        z = residual / diag
+        rz_next = residual @ z
+        direction = z + (rz_next / rz) * direction
+        rz = rz_next
+
+    return x
+
+
+def solve_quadratic_placement(
+    netlist: Netlist,
+    is_fixed: np.ndarray,
+    fixed_x: np.ndarray,
+    fixed_y: np.ndarray,
+    center: tuple[float, float],
+    max_iters: int = 500,
+    tol: float = 1e-6,
+) -> tuple[np.ndarray, np.ndarray]:
+    lhs, rhs, weights, num_nodes = get_net_model_edges(netlist)
+
+    # Star nodes are always movable
+    node_fixed = np.zeros(num_nodes, dtype=bool)
+    node_fixed[: netlist.num_gates] = is_fixed
+
+    node_x = np.zeros(num_nodes)
+    node_y = np.zeros(num_nodes)
+    node_x[: netlist.num_gates] = fixed_x
+    node_y[: netlist.num_gates] = fixed_y
+
+    movable = np.flatnonzero(~node_fixed)
+    var_index = np.full(num_nodes, -1, dtype=np.int64)
+    var_index[movable] = np.arange(len(movable))
+
+    # A weak pull to the center keeps gates without a path to a port solvable
+    diag = np.full(len(movable), ANCHOR_WEIGHT)
+    b_x = np.full(len(movable), ANCHOR_WEIGHT * center[0])
+    b_y = np.full(len(movable), ANCHOR_WEIGHT * center[1])
+
+    rows: list[np.ndarray] = []
+    cols: list[np.ndarray] = []
+    values: list[np.ndarray] = []
+
+    for this, other in ((lhs, rhs), (rhs, lhs)):
+        this_var = var_index[this]
+        other_var = var_index[other]
+        is_var = this_var != -1
+
+        diag += np.bincount(this_var[is_var], weights[is_var], len(movable))
+
+        to_var = is_var & (other_var != -1)
+        rows.append(this_var[to_var])
+        cols.append(other_var[to_var])
+        values.append(-weights[to_var])
+
+        to_fixed = is_var & (other_var == -1)
+        b_x += np.bincount(
+            this_var[to_fixed],
+            weights[to_fixed] * node_x[other[to_fixed]],
+            len(movable),
+        )
+        b_y += np.bincount(
+            this_var[to_fixed],
+            weights[to_fixed] * node_y[other[to_fixed]],
+            len(movable),
+        )
+
+    args = (np.concatenate(rows), np.concatenate(cols), np.concatenate(values), diag)
+    x0 = np.full(len(movable), center[0])
+    y0 = np.full(len(movable), center[1])
+
+    node_x[movable] = solve_conjugate_gradient(*args, b_x, x0, max_iters, tol)
+    node_y[movable] = solve_conjugate_gradient(*args, b_y, y0, max_iters, tol)
+
+    return node_x[: netlist.num_gates], node_y[: netlist.num_gates]
+
+
+def spread_by_area(
+    pos: np.ndarray, area: np.ndarray, low: float, high: float
+) -> np.ndarray:
+    # Quadratic solutions pile up in the middle, spread gates over [low, high]
+    # keeping their order so the cumulative area grows linearly along the axis
+    order = np.argsort(pos, kind="stable")
+    cum_area = np.cumsum(area[order]) - area[order] / 2
+
+    spread = np.empty(len(pos))
+    spread[order] = low + (high - low) * cum_area / max(area.sum(), 1)
+
+    return spread
+
+
+def place_quadratic(grid: GatesGrid) -> None:
+    log.info("Running quadratic placement")
+
+    gate_pos_x, gate_pos_y = grid.placement
+    is_port = np.array([gate.is_port for gate in grid.gates], dtype=bool)
+    center = ((grid.dim.x - 1) / 2, (grid.dim.y - 1) / 2)
+
+    pos_x, pos_y = solve_quadratic_placement(
+        grid.netlist, is_port, gate_pos_x, gate_pos_y, center
+    )
+
+    movable = np.flatnonzero(~is_port)
+    area = np.array([gate.dim.x * gate.dim.y for gate in grid.gates], dtype=float)
+    max_dim_x = max((grid.gates[gate_id].dim.x for gate_id in movable), default=1)
+    max_dim_y = max((grid.gates[gate_id].dim.y for gate_id in movable), default=1)
+
+    pos_x[movable] = spread_by_area(
+        pos_x[movable], area[movable], 1, grid.dim.x - 1 - max_dim_x
+    )
+    pos_y[movable] = spread_by_area(
+        pos_y[movable], area[movable], 1, grid.dim.y - 1 - max_dim_y
+    )
+
+    grid.legalize(pos_x, pos_y)
+    log.info(f"Quadratic placement cost={grid.cost}")
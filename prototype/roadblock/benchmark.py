@@ -0,0 +1,65 @@
+import sys
+import time
+import resource
+import multiprocessing
+from multiprocessing.queues import Queue
+
+from roadblock.yosys import read_yosys_netlist_json
+
+from roadblock import log
+
+#  python3 -m roadblock.benchmark yosys test.v.json adder
+
+
+def run_yosys_read(
+    yosys_netlist_json_file_name: str,
+    module: str,
+    stream: bool,
+    results: Queue,
+) -> None:
+    start = time.perf_counter()
+    gates, _ = read_yosys_netlist_json(yosys_netlist_json_file_name, module, stream)
+    wall_time = time.perf_counter() - start
+
+    # ru_maxrss is in KiB on linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((len(gates), wall_time, peak_rss))
+
+
+def benchmark_yosys_read(
+    yosys_netlist_json_file_name: str, module: str, stream: bool
+) -> tuple[int, float, int]:
+    # Every mode runs in a fresh process so peak RSS is not shared between them
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+
+    process = context.Process(
+        target=run_yosys_read,
+        args=(yosys_netlist_json_file_name, module, stream, results),
+    )
+    process.start()
+    num_gates, wall_time, peak_rss = results.get()
+    process.join()
+
+    return num_gates, wall_time, peak_rss
+
+
+def benchmark_yosys(yosys_netlist_json_file_name: str, module: str) -> None:
+    for stream in (False, True):
+        num_gates, wall_time, peak_rss = benchmark_yosys_read(
+            yosys_netlist_json_file_name, module, stream
+        )
+
+        mode = "stream" if stream else "json.load"
+        log.info(
+            f"{mode}: {num_gates} gates in {round(wall_time, 3)}s"
+            + f" peak_rss={peak_rss // 1024}MiB"
+        )
+
+
+if __name__ == "__main__":
+    if sys.argv[1] == "yosys":
+        benchmark_yosys(sys.argv[2], sys.argv[3])
+    else:
+        log.error(f"Unknown benchmark {sys.argv[1]}")
+        raise ValueError
@@ -0,0 +1,182 @@
+from itertools import permutations
+
+import numpy as np
+
+from roadblock.dim import Dim
+from roadblock.grid import GatesGrid, get_flat_ranges
+
+from roadblock import log
+
+
+MEDIAN_BATCH_SIZE = 256
+MEDIAN_MAX_NET_PINS = 64
+REORDER_GROUP_SIZE = 3
+REORDER_WINDOW = 8
+MIN_PASS_IMPROVEMENT = 1e-3
+
+
+def get_group_medians(
+    values: np.ndarray, groups: np.ndarray, num_groups: int
+) -> np.ndarray:
+    order = np.lexsort((values, groups))
+    counts = np.bincount(groups, minlength=num_groups)
+    starts = np.cumsum(counts) - counts
+
+    # Groups without values get nan
+    low = starts + np.maximum(counts - 1, 0) // 2
+    high = starts + counts // 2
+    sorted_values = np.append(values[order], np.nan)
+
+    low[counts == 0] = high[counts == 0] = len(values)
+    return (sorted_values[low] + sorted_values[high]) / 2
+
+
+def get_median_targets(grid: GatesGrid) -> tuple[np.ndarray, np.ndarray]:
+    # The median of the other pins on a gate's nets minimizes its wire length.
+    # Large nets barely move with one gate and are left out to bound the work
+    netlist = grid.netlist
+    pos_x, pos_y = grid.placement
+
+    pair_gates = np.repeat(
+        np.arange(netlist.num_gates), np.diff(netlist.gate_net_offsets)
+    )
+    pair_nets = netlist.gate_net_indices
+
+    net_sizes = np.diff(netlist.net_pin_offsets)
+    keep = net_sizes[pair_nets] <= MEDIAN_MAX_NET_PINS
+    pair_gates, pair_nets = pair_gates[keep], pair_nets[keep]
+
+    starts = netlist.net_pin_offsets[pair_nets]
+    lengths = net_sizes[pair_nets]
+    other_gates = netlist.pin_gate_ids[get_flat_ranges(starts, lengths)]
+    pin_gates = np.repeat(pair_gates, lengths)
+
+    keep = other_gates != pin_gates
+    other_gates, pin_gates = other_gates[keep], pin_gates[keep]
+
+    target_x = get_group_medians(pos_x[other_gates], pin_gates, netlist.num_gates)
+    target_y = get_group_medians(pos_y[other_gates], pin_gates, netlist.num_gates)
+
+    # Gates without other pins stay where they are
+    no_target = np.isnan(target_x)
+    target_x[no_target] = pos_x[no_target]
+    target_y[no_target] = pos_y[no_target]
+
+    return target_x, target_y
+
+
+def improve_median_moves(grid: GatesGrid) -> int:
+    # Moves every gate to the free anchor closest to its median target if that
+    # lowers the cost, in batches of gates that share no nets
+    target_x, target_y = get_median_targets(grid)
+    pos_x, pos_y = grid.placement
+
+    gate_ids = np.flatnonzero(
+        (np.rint(target_x) != pos_x) | (np.rint(target_y) != pos_y)
+    )
+    gate_ids = gate_ids[[not grid.gates[gate_id].is_port for gate_id in gate_ids]]
+    np.random.shuffle(gate_ids)
+
+    num_moved = 0
+
+    for start in range(0, len(gate_ids), MEDIAN_BATCH_SIZE):
+        batch_ids: list[int] = []
+        to_x: list[int] = []
+        to_y: list[int] = []
+
+        end = start + MEDIAN_BATCH_SIZE
+
+        for gate_id in gate_ids[start:end].tolist():
+            target = Dim(int(round(target_x[gate_id])), int(round(target_y[gate_id])))
+            pos = grid.get_nearest_free_pos(gate_id, target)
+
+            if pos is None:
+                continue
+
+            batch_ids.append(gate_id)
+            to_x.append(pos.x)
+            to_y.append(pos.y)
+
+        if len(batch_ids) == 0:
+            continue
+
+        moves = grid.get_disjoint_moves(
+            np.array(batch_ids),
+            np.array(to_x, dtype=np.int32),
+            np.array(to_y, dtype=np.int32),
+        )
+        accepted = grid.get_moves_delta_cost(moves) < 0
+        grid.apply_moves(moves, accepted)
+
+        num_moved += int(accepted.sum())
+
+    return num_moved
+
+
+def get_reorder_groups(grid: GatesGrid, group_size: int) -> list[np.ndarray]:
+    # Runs of gates with the same footprint that follow each other closely along
+    # a row, so any order of their positions is legal
+    pos_x, pos_y = grid.placement
+    groups: list[np.ndarray] = []
+
+    shapes: dict[tuple[int, int], list[int]] = {}
+
+    for gate_id, gate in enumerate(grid.gates):
+        if not gate.is_port:
+            shapes.setdefault((gate.dim.x, gate.dim.y), []).append(gate_id)
+
+    for gate_ids in shapes.values():
+        shape_ids = np.array(gate_ids)
+        shape_ids = shape_ids[np.lexsort((pos_x[shape_ids], pos_y[shape_ids]))]
+
+        for start in range(0, len(shape_ids) - group_size + 1):
+            end = start + group_size
+            group = shape_ids[start:end]
+
+            same_row = (pos_y[group] == pos_y[group[0]]).all()
+            span = pos_x[group[-1]] - pos_x[group[0]]
+
+            if same_row and span <= REORDER_WINDOW:
+                groups.append(group)
+
+    return groups
+
+
+def improve_reordering(grid: GatesGrid, group_size: int) -> int:
+    # Tries every order of the positions of each group and keeps the cheapest
+    orders = np.array(list(permutations(range(group_size))))
+    num_reordered = 0
+
+    for group in get_reorder_groups(grid, group_size):
+        pos_x, pos_y = grid.get_gate_positions(group)
+        costs = grid.get_group_costs(group, pos_x[orders], pos_y[orders])
+        best = int(np.argmin(costs))
+
+        # The first order is the identity, only strictly better orders are taken
+        if costs[best] < costs[0]:
+            grid.move_group(group, pos_x[orders[best]], pos_y[orders[best]])
+            num_reordered += 1
+
+    return num_reordered
+
+
+def place_detailed(
+    grid: GatesGrid,
+    max_passes: int = 10,
+    group_size: int = REORDER_GROUP_SIZE,
+) -> None:
+    log.info("Running detailed placement")
+
+    for detailed_pass in range(max_passes):
+        pass_cost = grid.cost
+
+        num_moved = improve_median_moves(grid)
+        num_reordered = improve_reordering(grid, group_size)
+
+        log.info(
+            f"Detailed placement pass {detailed_pass} moved={num_moved}"
+            + f" reordered={num_reordered} cost={grid.cost}"
+        )
+
+        if pass_cost - grid.cost <= MIN_PASS_IMPROVEMENT * pass_cost:
+            break
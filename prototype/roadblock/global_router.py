@@ -0,0 +1,197 @@
+from math import ceil
+from dataclasses import dataclass
+
+import numpy as np
+
+from roadblock.dim import Dim
+from roadblock.grid import GatesGrid
+from roadblock.router import (
+    HISTORY_FACTOR,
+    NegotiationState,
+    NegotiationStats,
+    SearchBuffers,
+    construct_routes,
+    create_router_grid,
+    get_pin_mask,
+    get_pin_sharers,
+    negotiate_routes,
+    route_with_rip_up,
+    search_route_window,
+)
+from roadblock.steiner import order_routes
+from roadblock import log
+
+
+GCELL_SIZE = 8
+GCELL_CAPACITY_FACTOR = 0.5
+GCELL_CORRIDOR_MARGIN = 1
+GLOBAL_MAX_ITERATIONS = 20
+
+
+@dataclass
+class GlobalRoutes:
+    tile_size: int
+    tile_dim: Dim
+    route_tiles: dict[int, np.ndarray]
+    usage: np.ndarray
+    capacity: int
+    stats: list[NegotiationStats]
+
+    @property
+    def overflow(self) -> np.ndarray:
+        return np.maximum(self.usage - self.capacity, 0)
+
+
+def get_tile_capacity(tile_size: int, max_layers: int) -> int:
+    # Nets that fit through a tile, every layer above the pins can carry about
+    # one wire per row of the tile but not all of them are usable
+    return max(int(tile_size * (max_layers - 1) * GCELL_CAPACITY_FACTOR), 1)
+
+
+def get_tile_points(points: list[Dim], tile_size: int) -> list[Dim]:
+    tile_points: list[Dim] = []
+
+    for point in points:
+        tile_point = Dim(point.x // tile_size, point.y // tile_size)
+
+        if tile_point not in tile_points:
+            tile_points.append(tile_point)
+
+    return tile_points
+
+
+def route_global(
+    routes: dict[int, list[Dim]],
+    dim: Dim,
+    max_layers: int,
+    tile_size: int = GCELL_SIZE,
+    max_iterations: int = GLOBAL_MAX_ITERATIONS,
+) -> GlobalRoutes:
+    # Negotiated routing of every net on a grid of tile_size x tile_size tiles,
+    # tiles fit as many nets as their capacity before they count as overused
+    tile_dim = Dim(ceil(dim.x / tile_size), ceil(dim.y / tile_size))
+    tile_grid = create_router_grid(tile_dim, 1)
+    capacity = get_tile_capacity(tile_size, max_layers)
+
+    negotiation = NegotiationState(tile_grid.size, HISTORY_FACTOR)
+    negotiation.capacity[:] = capacity
+
+    tile_routes = {
+        route_id: get_tile_points(points, tile_size)
+        for route_id, points in routes.items()
+    }
+
+    log.info(
+        f"Global routing {len(routes)} routes on {tile_dim.x}x{tile_dim.y} tiles"
+        + f" with capacity {capacity}"
+    )
+
+    route_tiles, stats = negotiate_routes(
+        tile_grid, tile_routes, negotiation, max_iterations
+    )
+
+    return GlobalRoutes(
+        tile_size=tile_size,
+        tile_dim=tile_dim,
+        route_tiles=route_tiles,
+        usage=negotiation.occupancy.reshape(tile_dim.x, tile_dim.y).copy(),
+        capacity=capacity,
+        stats=stats,
+    )
+
+
+def get_corridor(
+    tiles: np.ndarray, global_routes: GlobalRoutes, dim: Dim, margin: int
+) -> tuple[tuple[int, int, int, int], np.ndarray]:
+    # Window of the tiles a net was globally routed through grown by margin tiles,
+    # and the columns of the window that are inside those tiles
+    tile_size = global_routes.tile_size
+    tile_dim = global_routes.tile_dim
+    tile_mask = np.zeros((tile_dim.x, tile_dim.y), dtype=bool)
+
+    for tile_x, tile_y in zip(*np.unravel_index(tiles, (tile_dim.x, tile_dim.y))):
+        min_tile_x, min_tile_y = max(tile_x - margin, 0), max(tile_y - margin, 0)
+        max_tile_x, max_tile_y = tile_x + margin + 1, tile_y + margin + 1
+        tile_mask[min_tile_x:max_tile_x, min_tile_y:max_tile_y] = True
+
+    tile_xs, tile_ys = np.nonzero(tile_mask)
+    min_tile_x, max_tile_x = tile_xs.min(), tile_xs.max() + 1
+    min_tile_y, max_tile_y = tile_ys.min(), tile_ys.max() + 1
+
+    window = (
+        int(min_tile_x * tile_size),
+        int(min(max_tile_x * tile_size, dim.x)),
+        int(min_tile_y * tile_size),
+        int(min(max_tile_y * tile_size, dim.y)),
+    )
+    min_x, max_x, min_y, max_y = window
+
+    region = np.repeat(
+        np.repeat(
+            tile_mask[min_tile_x:max_tile_x, min_tile_y:max_tile_y], tile_size, 0
+        ),
+        tile_size,
+        1,
+    )
+
+    return window, region[: max_x - min_x, : max_y - min_y]
+
+
+def route_global_detailed(
+    grid: GatesGrid,
+    max_layers: int,
+    tile_size: int = GCELL_SIZE,
+    margin: int = GCELL_CORRIDOR_MARGIN,
+) -> GlobalRoutes:
+    # Every net is routed on the tile grid first, detailed routing then only
+    # searches the corridor of tiles the net was assigned. Nets that do not fit
+    # their corridor are routed with rip-up on the full grid at the end
+    router_grid = create_router_grid(grid.dim, max_layers)
+    buffers = SearchBuffers(router_grid.size)
+
+    routes = order_routes(construct_routes(grid))
+    pin_mask = get_pin_mask(routes, router_grid.shape)
+    pin_sharers = get_pin_sharers(routes, router_grid.shape)
+
+    global_routes = route_global(routes, grid.dim, max_layers, tile_size)
+    overflow = global_routes.overflow
+
+    log.info(
+        f"Global routing overflow={int(overflow.sum())}"
+        + f" in {int((overflow > 0).sum())} tiles"
+    )
+
+    route_cells: dict[int, np.ndarray] = {}
+    failed_ids: list[int] = []
+
+    for route_id, points in routes.items():
+        window, region = get_corridor(
+            global_routes.route_tiles[route_id], global_routes, grid.dim, margin
+        )
+
+        cells = search_route_window(
+            router_grid,
+            points,
+            window,
+            buffers,
+            pin_mask=pin_mask,
+            shared_ids=pin_sharers[route_id],
+            region=region,
+            ordered=True,
+        )
+
+        if cells is None:
+            failed_ids.append(route_id)
+            continue
+
+        route_cells[route_id] = cells
+        router_grid.reshape(-1)[cells] = route_id
+        log.info(f"Created route {route_id}")
+
+    log.info(f"Routing {len(failed_ids)} routes that did not fit their corridor")
+
+    route_with_rip_up(
+        router_grid, routes, failed_ids, pin_mask, pin_sharers, route_cells
+    )
+
+    return global_routes
@@ -1,10 +1,11 @@
 from random import randrange
-from typing import Iterator, ItemsView
+from typing import Iterator
+from dataclasses import dataclass
 
 import numpy as np
 
 from roadblock.dim import Dim
-from roadblock.netlist import MinecraftGate, construct_reverse_netlist
+from roadblock.netlist import MinecraftGate, Netlist
 
 from roadblock import log
 
@@ -30,55 +31,536 @@ def is_pin_coords(pos: Dim, dim: Dim) -> bool:
     return pos.x == 0 or pos.y == 0 or pos.x == dim.x - 1 or pos.y == dim.y - 1
 
 
-def get_half_perim(gates_pos: list[Dim | None]) -> float:
-    x_pos = [dim.x for dim in gates_pos if dim is not None]
-    y_pos = [dim.y for dim in gates_pos if dim is not None]
+def get_bbox(x_pos: list[int], y_pos: list[int]) -> tuple[list[int], list[int]]:
+    # Edges are x_min, x_max, y_min, y_max, with the number of pins on each edge
+    edges = [min(x_pos), max(x_pos), min(y_pos), max(y_pos)]
+    counts = [
+        x_pos.count(edges[0]),
+        x_pos.count(edges[1]),
+        y_pos.count(edges[2]),
+        y_pos.count(edges[3]),
+    ]
 
-    x_max, x_min = max(x_pos), min(x_pos)
-    y_max, y_min = max(y_pos), min(y_pos)
+    return edges, counts
 
-    half_perim = ((x_max - x_min) + (y_max - y_min)) / 2
-    return half_perim
 
+def get_segments_bbox(
+    pin_x: np.ndarray, pin_y: np.ndarray, segment_lengths: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    # Bounding box of consecutive runs of pins, every run must be non empty
+    segment_starts = np.zeros(len(segment_lengths), dtype=np.int64)
+    np.cumsum(segment_lengths[:-1], out=segment_starts[1:])
+    pin_segments = np.repeat(np.arange(len(segment_lengths)), segment_lengths)
 
-def get_affected_nets(
-    gate_id: int,
-    reverse_netlist: dict[int, set[int]],
-) -> set[int]:
-    return reverse_netlist[gate_id]
+    bbox = np.empty((len(segment_lengths), 4), dtype=np.int32)
+    bbox_counts = np.empty((len(segment_lengths), 4), dtype=np.int32)
+
+    for axis, pin_pos in enumerate((pin_x, pin_y)):
+        for side, reduce in enumerate((np.minimum, np.maximum)):
+            edge = 2 * axis + side
+            bbox[:, edge] = reduce.reduceat(pin_pos, segment_starts)
+            on_edge = (pin_pos == bbox[pin_segments, edge]).astype(np.int32)
+            bbox_counts[:, edge] = np.add.reduceat(on_edge, segment_starts)
+
+    return bbox, bbox_counts
+
+
+def get_nets_bbox(
+    netlist: Netlist, gate_pos_x: np.ndarray, gate_pos_y: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    return get_segments_bbox(
+        gate_pos_x[netlist.pin_gate_ids],
+        gate_pos_y[netlist.pin_gate_ids],
+        np.diff(netlist.net_pin_offsets),
+    )
+
+
+def get_flat_ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    # Concatenation of range(start, start + length) for every start and length
+    offsets = np.repeat(np.cumsum(lengths) - lengths - starts, lengths)
+    return np.arange(lengths.sum()) - offsets
+
+
+def get_bbox_half_perim(bbox: list[int]) -> float:
+    return ((bbox[1] - bbox[0]) + (bbox[3] - bbox[2])) / 2
+
+
+def move_pins_in_bbox_inplace(
+    bbox: list[int],
+    bbox_counts: list[int],
+    old_pos: tuple[int, int],
+    new_pos: tuple[int, int],
+    num_pins: int,
+) -> bool:
+    # Returns False if an edge lost all its pins and the bbox must be recomputed
+    for edge in range(4):
+        old, new = old_pos[edge // 2], new_pos[edge // 2]
+        is_min = edge % 2 == 0
+
+        if old == bbox[edge]:
+            bbox_counts[edge] -= num_pins
+
+        if new == bbox[edge]:
+            bbox_counts[edge] += num_pins
+        elif (new < bbox[edge]) if is_min else (new > bbox[edge]):
+            bbox[edge] = new
+            bbox_counts[edge] = num_pins
+
+        if bbox_counts[edge] == 0:
+            return False
+
+    return True
+
+
+def get_gate_net_pin_counts(netlist: Netlist) -> np.ndarray:
+    # Number of pins a gate has on each of its nets, aligned with gate_net_indices
+    gate_net_keys = (
+        netlist.pin_gate_ids.astype(np.int64) * netlist.num_nets
+        + netlist.pin_net_indices
+    )
+    _, counts = np.unique(gate_net_keys, return_counts=True)
+
+    return counts.astype(np.int32)
+
+
+@dataclass
+class GateMoves:
+    gate_ids: np.ndarray
+    from_x: np.ndarray
+    from_y: np.ndarray
+    to_x: np.ndarray
+    to_y: np.ndarray
+
+    @property
+    def num_moves(self) -> int:
+        return len(self.gate_ids)
+
+
+def get_affected_nets(gate_id: int, netlist: Netlist) -> np.ndarray:
+    return netlist.nets_of_gate(gate_id)
+
+
+def get_legal_anchor_mask(occupied: np.ndarray, gate_dim: Dim) -> np.ndarray:
+    # 2D prefix sum of occupied cells, an anchor is legal if its footprint sums to 0
+    prefix = np.zeros((occupied.shape[0] + 1, occupied.shape[1] + 1), dtype=np.int32)
+    prefix[1:, 1:] = occupied.cumsum(axis=0).cumsum(axis=1)
+
+    legal = np.zeros(occupied.shape, dtype=bool)
+
+    # Anchors whose footprint stays clear of the pin coords on the border
+    max_x = occupied.shape[0] - 1 - gate_dim.x
+    max_y = occupied.shape[1] - 1 - gate_dim.y
+
+    if max_x < 1 or max_y < 1:
+        return legal
+
+    xs = np.arange(1, max_x + 1)[:, None]
+    ys = np.arange(1, max_y + 1)[None, :]
+
+    footprint_sum = (
+        prefix[xs + gate_dim.x, ys + gate_dim.y]
+        - prefix[xs, ys + gate_dim.y]
+        - prefix[xs + gate_dim.x, ys]
+        + prefix[xs, ys]
+    )
+    anchors = (slice(1, max_x + 1), slice(1, max_y + 1))
+    legal[anchors] = footprint_sum == 0
+
+    return legal
+
+
+class FreePosIndex:
+    # Set of legal anchor positions for one gate footprint, with O(1) add, remove
+    # and uniform sampling. Positions are flattened as x * dim.y + y
+    WINDOW_RETRY_COUNT = 16
+
+    def __init__(self, dim: Dim, gate_dim: Dim, occupied: np.ndarray) -> None:
+        self._dim = dim
+        self._gate_dim = gate_dim
+
+        legal_positions = np.flatnonzero(get_legal_anchor_mask(occupied, gate_dim))
+        self._size = len(legal_positions)
+
+        self._positions = np.zeros(dim.x * dim.y, dtype=np.int64)
+        self._positions[: len(legal_positions)] = legal_positions
+
+        self._slots = np.full(dim.x * dim.y, -1, dtype=np.int64)
+        self._slots[legal_positions] = np.arange(self._size)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def sample(self) -> Dim | None:
+        if self._size == 0:
+            return None
+
+        pos = int(self._positions[randrange(0, self._size)])
+        return Dim(pos // self._dim.y, pos % self._dim.y)
+
+    def contains(self, pos: Dim) -> bool:
+        if pos.x < 0 or pos.y < 0 or pos.x >= self._dim.x or pos.y >= self._dim.y:
+            return False
+
+        return self._slots.item(pos.x * self._dim.y + pos.y) != -1
+
+    def contains_batch(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        inside = (x >= 0) & (y >= 0) & (x < self._dim.x) & (y < self._dim.y)
+
+        contains = np.zeros(len(x), dtype=bool)
+        contains[inside] = self._slots[x[inside] * self._dim.y + y[inside]] != -1
+
+        return contains
+
+    def sample_near(self, center: Dim, window: int) -> Dim | None:
+        for _ in range(FreePosIndex.WINDOW_RETRY_COUNT):
+            pos = Dim(
+                randrange(center.x - window, center.x + window + 1),
+                randrange(center.y - window, center.y + window + 1),
+            )
+
+            if self.contains(pos):
+                return pos
+
+        return None
+
+    def nearest(self, center: Dim) -> Dim | None:
+        # Search square windows of doubling size around center for any anchor. The
+        # closest one may lie outside that window but is never further away than
+        # the first anchor found, so the window of that distance is searched once
+        window = 1
+
+        while self._size > 0:
+            closest = self._nearest_in_window(center, window)
+
+            if closest is not None:
+                dist = abs(closest.x - center.x) + abs(closest.y - center.y)
+
+                if dist > window:
+                    closest = self._nearest_in_window(center, dist)
+
+                return closest
+
+            window *= 2
+
+        return None
+
+    def _nearest_in_window(self, center: Dim, window: int) -> Dim | None:
+        slots = self._slots.reshape(self._dim.x, self._dim.y)
+
+        min_x, min_y = max(center.x - window, 0), max(center.y - window, 0)
+        max_x = min(center.x + window + 1, self._dim.x)
+        max_y = min(center.y + window + 1, self._dim.y)
+
+        xs, ys = np.nonzero(slots[min_x:max_x, min_y:max_y] != -1)
+
+        if len(xs) == 0:
+            return None
+
+        dist = np.abs(xs + min_x - center.x) + np.abs(ys + min_y - center.y)
+        closest = int(np.argmin(dist))
+
+        return Dim(int(xs[closest]) + min_x, int(ys[closest]) + min_y)
+
+    def sample_batch(self, count: int) -> tuple[np.ndarray, np.ndarray]:
+        pos = self._positions[np.random.randint(0, self._size, count)]
+        return (pos // self._dim.y).astype(np.int32), (pos % self._dim.y).astype(
+            np.int32
+        )
+
+    def occupy(self, pos: Dim, dim: Dim) -> None:
+        x_range, y_range = self._get_overlapping_anchor_ranges(pos, dim)
+
+        for anchor_x in x_range:
+            for anchor_y in y_range:
+                self._remove(anchor_x * self._dim.y + anchor_y)
+
+    def release(self, pos: Dim, dim: Dim, grid: np.ndarray) -> None:
+        x_range, y_range = self._get_overlapping_anchor_ranges(pos, dim)
+
+        for anchor_x in x_range:
+            for anchor_y in y_range:
+                if self._is_free(anchor_x, anchor_y, grid):
+                    self._add(anchor_x * self._dim.y + anchor_y)
+
+    def _get_overlapping_anchor_ranges(self, pos: Dim, dim: Dim) -> tuple[range, range]:
+        # Anchors whose footprint overlaps the region and stays clear of the border
+        min_x = max(pos.x - self._gate_dim.x + 1, 1)
+        min_y = max(pos.y - self._gate_dim.y + 1, 1)
+        max_x = min(pos.x + dim.x - 1, self._dim.x - 1 - self._gate_dim.x)
+        max_y = min(pos.y + dim.y - 1, self._dim.y - 1 - self._gate_dim.y)
+
+        return range(min_x, max_x + 1), range(min_y, max_y + 1)
+
+    def _is_free(self, anchor_x: int, anchor_y: int, grid: np.ndarray) -> bool:
+        for dy in range(self._gate_dim.y):
+            for dx in range(self._gate_dim.x):
+                if grid.item(anchor_x + dx, anchor_y + dy) != -1:
+                    return False
+
+        return True
+
+    def _add(self, pos: int) -> None:
+        if self._slots.item(pos) != -1:
+            return
+
+        self._positions[self._size] = pos
+        self._slots[pos] = self._size
+        self._size += 1
+
+    def _remove(self, pos: int) -> None:
+        slot = self._slots.item(pos)
+
+        if slot == -1:
+            return
+
+        last_pos = self._positions.item(self._size - 1)
+        self._positions[slot] = last_pos
+        self._slots[last_pos] = slot
+
+        self._slots[pos] = -1
+        self._size -= 1
+
+
+@dataclass
+class CongestionParams:
+    weight: float
+    bin_size: int = 4
+    capacity: float = 1.0
+
+
+def get_rudy_density(net_bbox: np.ndarray) -> np.ndarray:
+    # Wire length of each net spread uniformly over the cells of its bbox
+    width = net_bbox[..., 1] - net_bbox[..., 0] + 1
+    height = net_bbox[..., 3] - net_bbox[..., 2] + 1
+
+    return (width + height - 2) / (width * height)
+
+
+class CongestionMap:
+    # RUDY routing demand summed into square bins of cells. The cost is the total
+    # demand above the capacity of the bins
+    def __init__(self, dim: Dim, bin_size: int, capacity: float) -> None:
+        self._dim = dim
+        self._bin_size = bin_size
+
+        starts_x = np.arange(0, dim.x, bin_size)
+        starts_y = np.arange(0, dim.y, bin_size)
+        cells_x = np.minimum(bin_size, dim.x - starts_x)
+        cells_y = np.minimum(bin_size, dim.y - starts_y)
+
+        self._capacity = capacity * np.outer(cells_x, cells_y)
+        self._demand = np.zeros(self._capacity.shape)
+        self._overflow = 0.0
+
+    @property
+    def demand(self) -> np.ndarray:
+        return self._demand.copy()
+
+    @property
+    def overflow(self) -> float:
+        return self._overflow
+
+    def rebuild(self, net_bbox: np.ndarray) -> None:
+        # Every bbox adds its density to a 2D difference array of cells, the
+        # prefix sums give the demand of each cell
+        dim = self._dim
+        min_x, max_x, min_y, max_y = net_bbox.T
+        density = get_rudy_density(net_bbox)
+
+        diff = np.zeros((dim.x + 1, dim.y + 1))
+        np.add.at(diff, (min_x, min_y), density)
+        np.add.at(diff, (max_x + 1, min_y), -density)
+        np.add.at(diff, (min_x, max_y + 1), -density)
+        np.add.at(diff, (max_x + 1, max_y + 1), density)
+
+        cell_demand = diff.cumsum(axis=0).cumsum(axis=1)[: dim.x, : dim.y]
+
+        num_bins_x, num_bins_y = self._capacity.shape
+        size = self._bin_size
+        padded = np.zeros((num_bins_x * size, num_bins_y * size))
+        padded[: dim.x, : dim.y] = cell_demand
+
+        self._demand = padded.reshape(num_bins_x, size, num_bins_y, size).sum(
+            axis=(1, 3)
+        )
+        self._overflow = float(np.maximum(self._demand - self._capacity, 0).sum())
+
+    def get_move_delta(self, old_bbox: list[int], new_bbox: list[int]) -> float:
+        return self._move_net(old_bbox, new_bbox, apply=False)
+
+    def move_net(self, old_bbox: list[int], new_bbox: list[int]) -> None:
+        if old_bbox != new_bbox:
+            self._overflow += self._move_net(old_bbox, new_bbox, apply=True)
+
+    def _get_net_demand(self, bbox: list[int]) -> tuple[int, int, np.ndarray]:
+        # Demand of one net on the bins its bbox overlaps, with the first bin
+        min_x, max_x, min_y, max_y = bbox
+        size = self._bin_size
+
+        bins_x = np.arange(min_x // size, max_x // size + 1)
+        bins_y = np.arange(min_y // size, max_y // size + 1)
+        overlap_x = np.minimum(max_x + 1, (bins_x + 1) * size) - np.maximum(
+            min_x, bins_x * size
+        )
+        overlap_y = np.minimum(max_y + 1, (bins_y + 1) * size) - np.maximum(
+            min_y, bins_y * size
+        )
+
+        density = get_rudy_density(np.array(bbox))
+        return min_x // size, min_y // size, density * np.outer(overlap_x, overlap_y)
+
+    def _move_net(self, old_bbox: list[int], new_bbox: list[int], apply: bool) -> float:
+        # Overflow change on the bins covered by either bbox
+        old_x, old_y, old_demand = self._get_net_demand(old_bbox)
+        new_x, new_y, new_demand = self._get_net_demand(new_bbox)
+
+        start_x, start_y = min(old_x, new_x), min(old_y, new_y)
+        end_x = max(old_x + old_demand.shape[0], new_x + new_demand.shape[0])
+        end_y = max(old_y + old_demand.shape[1], new_y + new_demand.shape[1])
+
+        region = (slice(start_x, end_x), slice(start_y, end_y))
+        demand = self._demand[region].copy()
+        capacity = self._capacity[region]
+
+        for bin_x, bin_y, net_demand, sign in (
+            (old_x, old_y, old_demand, -1),
+            (new_x, new_y, new_demand, 1),
+        ):
+            offset_x, offset_y = bin_x - start_x, bin_y - start_y
+            end_x, end_y = (
+                offset_x + net_demand.shape[0],
+                offset_y + net_demand.shape[1],
+            )
+            demand[offset_x:end_x, offset_y:end_y] += sign * net_demand
+
+        delta = (
+            np.maximum(demand - capacity, 0).sum()
+            - np.maximum(self._demand[region] - capacity, 0).sum()
+        )
+
+        if apply:
+            self._demand[region] = demand
+
+        return float(delta)
 
 
 class GatesGrid:
-    PLACE_RETRY_COUNT = 1000
+    PROPOSE_RETRY_FACTOR = 4
 
     def __init__(
         self,
         dim: Dim,
         gates: list[MinecraftGate],
-        netlist: dict[int, set[int]],
+        netlist: Netlist,
+        placement: tuple[np.ndarray, np.ndarray] | None = None,
+        congestion: CongestionParams | None = None,
     ):
         self._dim = dim
         self._netlist = netlist
-        self._reverse_netlist = construct_reverse_netlist(netlist)
         self._gates = gates
+        self._congestion = congestion
 
         self._grid = np.full((dim.x, dim.y), -1)
-        self._gate_pos_map: list[Dim | None] = [None] * self.num_gates
+        self._gate_pos_x = np.full(self.num_gates, -1, dtype=np.int32)
+        self._gate_pos_y = np.full(self.num_gates, -1, dtype=np.int32)
 
-        pins = dim_pin_iterator(dim)
+        self._gate_dim_x = np.array([gate.dim.x for gate in gates], dtype=np.int32)
+        self._gate_dim_y = np.array([gate.dim.y for gate in gates], dtype=np.int32)
+        self._gate_is_port = np.array([gate.is_port for gate in gates], dtype=bool)
 
-        for gate_id, gate in enumerate(gates):
-            if gate.is_port:
-                pos = next(pins)
-                self._fill(gate_id, pos)
-            else:
-                self._place(gate_id)
+        # One free position index per footprint of the movable gates
+        self._free_pos_indices: dict[tuple[int, int], FreePosIndex] = {}
+
+        for gate in gates:
+            shape = (gate.dim.x, gate.dim.y)
+
+            if gate.is_port or shape in self._free_pos_indices:
+                continue
+
+            self._free_pos_indices[shape] = FreePosIndex(
+                dim, gate.dim, self._grid != -1
+            )
+
+        if placement is not None:
+            self._fill_placement(*placement)
+        else:
+            self._place_initial()
 
-        self._cost_cache = GatesGridCostCache(netlist, self._gate_pos_map)
+        congestion_map = None
+
+        if congestion is not None:
+            congestion_map = CongestionMap(
+                dim, congestion.bin_size, congestion.capacity
+            )
+
+        self._cost_cache = GatesGridCostCache(
+            netlist,
+            self._gate_pos_x,
+            self._gate_pos_y,
+            congestion_map,
+            congestion.weight if congestion is not None else 0.0,
+        )
+        self._congestion_map = congestion_map
+
+    @property
+    def netlist(self) -> Netlist:
+        return self._netlist
 
     @property
-    def netlist(self) -> ItemsView[int, set[int]]:
-        return self._netlist.items()
+    def gates(self) -> list[MinecraftGate]:
+        return self._gates
+
+    @property
+    def congestion(self) -> CongestionParams | None:
+        return self._congestion
+
+    @property
+    def congestion_demand(self) -> np.ndarray | None:
+        if self._congestion_map is None:
+            return None
+
+        return self._congestion_map.demand
+
+    @property
+    def placement(self) -> tuple[np.ndarray, np.ndarray]:
+        return self._gate_pos_x.copy(), self._gate_pos_y.copy()
+
+    def set_placement(self, gate_pos_x: np.ndarray, gate_pos_y: np.ndarray) -> None:
+        for gate_id in range(self.num_gates):
+            self._free(gate_id)
+
+        self._fill_placement(gate_pos_x, gate_pos_y)
+        self._cost_cache.recalculate()
+
+    def legalize(self, target_x: np.ndarray, target_y: np.ndarray) -> None:
+        # Moves every gate that is not a port to the free position closest to its
+        # target, larger footprints and gates closer to the center go first
+        gate_ids = np.flatnonzero(~self._gate_is_port)
+
+        for gate_id in gate_ids.tolist():
+            self._free(gate_id)
+
+        center_dist = np.abs(target_x - self._dim.x / 2) + np.abs(
+            target_y - self._dim.y / 2
+        )
+        area = self._gate_dim_x * self._gate_dim_y
+        order = np.lexsort((center_dist[gate_ids], -area[gate_ids]))
+
+        for gate_id in gate_ids[order].tolist():
+            gate = self._gates[gate_id]
+            target = Dim(
+                int(round(float(target_x[gate_id]))),
+                int(round(float(target_y[gate_id]))),
+            )
+            pos = self._free_pos_indices[(gate.dim.x, gate.dim.y)].nearest(target)
+
+            if pos is None:
+                log.error(f"Unable to find legal placement for gate {gate_id}")
+                raise ValueError
+
+            self._fill(gate_id, pos)
+
+        self._cost_cache.recalculate()
 
     @property
     def num_gates(self) -> int:
@@ -89,10 +571,13 @@ class GatesGrid:
         return self._dim
 
     def get_pos(self, gate_id: int) -> Dim | None:
-        return self._gate_pos_map[gate_id]
+        if self._gate_pos_x[gate_id] == -1:
+            return None
+
+        return Dim(int(self._gate_pos_x[gate_id]), int(self._gate_pos_y[gate_id]))
 
     def get_pos_expect(self, gate_id: int) -> Dim:
-        pos = self._gate_pos_map[gate_id]
+        pos = self.get_pos(gate_id)
 
         if pos is None:
             log.error(f"Gate {gate_id} has not been placed yey")
@@ -100,6 +585,26 @@ class GatesGrid:
 
         return pos
 
+    def get_gate_positions(self, gate_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return self._gate_pos_x[gate_ids], self._gate_pos_y[gate_ids]
+
+    def get_nearest_free_pos(self, gate_id: int, target: Dim) -> Dim | None:
+        # Closest free anchor to target, None if it is not closer than the gate is
+        gate = self._gates[gate_id]
+        pos = self._free_pos_indices[(gate.dim.x, gate.dim.y)].nearest(target)
+        current = self.get_pos_expect(gate_id)
+
+        if pos is None:
+            return None
+
+        new_dist = abs(pos.x - target.x) + abs(pos.y - target.y)
+        current_dist = abs(current.x - target.x) + abs(current.y - target.y)
+
+        if new_dist >= current_dist:
+            return None
+
+        return pos
+
     def get_gate_from_id(self, gate_id: int) -> MinecraftGate:
         return self._gates[gate_id]
 
@@ -125,41 +630,43 @@ class GatesGrid:
     def num_filled(self) -> int:
         return np.count_nonzero(self._grid != -1)
 
-    def mutate(self) -> tuple[int, Dim, int, Dim]:
+    def mutate(self, window: int | None = None) -> tuple[int, Dim, int, Dim]:
         gate_a_id = randrange(0, len(self._gates))
         gate_b_id = randrange(0, len(self._gates))
 
         if self._gates[gate_a_id].is_port or self._gates[gate_b_id].is_port:
-            return self.mutate()
+            return self.mutate(window)
 
         if gate_a_id == gate_b_id:
-            return self.mutate()
+            return self.mutate(window)
 
-        gate_a_pos = self._gate_pos_map[gate_a_id]
-        gate_b_pos = self._gate_pos_map[gate_b_id]
+        gate_a_pos = self.get_pos(gate_a_id)
+        gate_b_pos = self.get_pos(gate_b_id)
 
         if gate_a_pos is None or gate_b_pos is None:
             log.error("Corrupt state found while trying to mutate grid")
             raise ValueError
 
-        self._cost_cache.being_mutation([gate_a_id, gate_b_id], self._reverse_netlist)
+        self._cost_cache.being_mutation([gate_a_id, gate_b_id])
 
-        self._move_gate(gate_a_id)
-        self._move_gate(gate_b_id)
+        self._move_gate(gate_a_id, gate_a_pos, window)
+        self._move_gate(gate_b_id, gate_b_pos, window)
 
         self._cost_cache.end_mutation_and_update_cache()
 
         return gate_a_id, gate_a_pos, gate_b_id, gate_b_pos
 
-    def _move_gate(self, gate_id: int) -> None:
-        self._cost_cache.begin_gate_move(gate_id, self._reverse_netlist)
+    def _move_gate(self, gate_id: int, pos: Dim, window: int | None) -> None:
+        self._cost_cache.begin_gate_move(gate_id)
 
         self._free(gate_id)
-        self._place(gate_id)
 
-        self._cost_cache.end_gate_move(
-            gate_id, self._reverse_netlist, self._netlist, self._gate_pos_map
-        )
+        if window is None:
+            self._place(gate_id)
+        else:
+            self._place_near(gate_id, pos, window)
+
+        self._cost_cache.end_gate_move(gate_id)
 
     def undo_mutate(
         self, gate_a_id: int, gate_a_pos: Dim, gate_b_id: int, gate_b_pos: Dim
@@ -172,115 +679,308 @@ class GatesGrid:
 
         self._cost_cache.undo_mutation_and_update_cache()
 
+    def propose_moves(self, count: int, window: int | None = None) -> GateMoves:
+        num_candidates = count * GatesGrid.PROPOSE_RETRY_FACTOR
+
+        gate_ids = np.unique(np.random.randint(0, self.num_gates, num_candidates))
+        gate_ids = gate_ids[~self._gate_is_port[gate_ids]]
+        np.random.shuffle(gate_ids)
+
+        to_x = np.zeros(len(gate_ids), dtype=np.int32)
+        to_y = np.zeros(len(gate_ids), dtype=np.int32)
+
+        has_free_pos = np.ones(len(gate_ids), dtype=bool)
+
+        if window is not None:
+            to_x = self._gate_pos_x[gate_ids] + np.random.randint(
+                -window, window + 1, len(gate_ids)
+            ).astype(np.int32)
+            to_y = self._gate_pos_y[gate_ids] + np.random.randint(
+                -window, window + 1, len(gate_ids)
+            ).astype(np.int32)
+
+        for (dim_x, dim_y), free_pos_index in self._free_pos_indices.items():
+            same_shape = (self._gate_dim_x[gate_ids] == dim_x) & (
+                self._gate_dim_y[gate_ids] == dim_y
+            )
+
+            if window is not None:
+                has_free_pos &= ~same_shape | free_pos_index.contains_batch(to_x, to_y)
+                continue
+
+            if len(free_pos_index) == 0:
+                has_free_pos &= ~same_shape
+                continue
+
+            to_x[same_shape], to_y[same_shape] = free_pos_index.sample_batch(
+                int(same_shape.sum())
+            )
+
+        gate_ids, to_x, to_y = (
+            gate_ids[has_free_pos],
+            to_x[has_free_pos],
+            to_y[has_free_pos],
+        )
+
+        moves = self.get_disjoint_moves(gate_ids, to_x, to_y)
+        keep = slice(0, count)
+
+        return GateMoves(
+            gate_ids=moves.gate_ids[keep],
+            from_x=moves.from_x[keep],
+            from_y=moves.from_y[keep],
+            to_x=moves.to_x[keep],
+            to_y=moves.to_y[keep],
+        )
+
+    def get_disjoint_moves(
+        self, gate_ids: np.ndarray, to_x: np.ndarray, to_y: np.ndarray
+    ) -> GateMoves:
+        # Targets must be free anchors, earlier candidates win any conflict.
+        # Gates in one batch never share a net, so their cost deltas are independent
+        keep = self._get_net_disjoint_mask(gate_ids)
+        gate_ids, to_x, to_y = gate_ids[keep], to_x[keep], to_y[keep]
+
+        keep = self._get_cell_disjoint_mask(gate_ids, to_x, to_y)
+        gate_ids, to_x, to_y = gate_ids[keep], to_x[keep], to_y[keep]
+
+        return GateMoves(
+            gate_ids=gate_ids,
+            from_x=self._gate_pos_x[gate_ids],
+            from_y=self._gate_pos_y[gate_ids],
+            to_x=to_x,
+            to_y=to_y,
+        )
+
+    def _get_footprint_offsets(self) -> Iterator[tuple[int, int]]:
+        for y in range(int(self._gate_dim_y.max())):
+            for x in range(int(self._gate_dim_x.max())):
+                yield x, y
+
+    def _get_net_disjoint_mask(self, gate_ids: np.ndarray) -> np.ndarray:
+        # Candidate i survives if it has the lowest index on every one of its nets
+        starts = self._netlist.gate_net_offsets[gate_ids]
+        lengths = self._netlist.gate_net_offsets[gate_ids + 1] - starts
+        nets = self._netlist.gate_net_indices[get_flat_ranges(starts, lengths)]
+        candidates = np.repeat(np.arange(len(gate_ids)), lengths)
+
+        net_winner = np.full(self._netlist.num_nets, len(gate_ids))
+        np.minimum.at(net_winner, nets, candidates)
+
+        lost = candidates[net_winner[nets] != candidates]
+        return np.bincount(lost, minlength=len(gate_ids)) == 0
+
+    def _get_cell_disjoint_mask(
+        self, gate_ids: np.ndarray, x: np.ndarray, y: np.ndarray
+    ) -> np.ndarray:
+        cells: list[np.ndarray] = []
+        candidates: list[np.ndarray] = []
+
+        for dx, dy in self._get_footprint_offsets():
+            in_footprint = (dx < self._gate_dim_x[gate_ids]) & (
+                dy < self._gate_dim_y[gate_ids]
+            )
+            cells.append(((x + dx) * self._dim.y + y + dy)[in_footprint])
+            candidates.append(np.flatnonzero(in_footprint))
+
+        all_cells = np.concatenate(cells)
+        all_candidates = np.concatenate(candidates)
+
+        cell_winner = np.full(self._dim.x * self._dim.y, len(gate_ids))
+        np.minimum.at(cell_winner, all_cells, all_candidates)
+
+        lost = all_candidates[cell_winner[all_cells] != all_candidates]
+        return np.bincount(lost, minlength=len(gate_ids)) == 0
+
+    def get_moves_delta_cost(self, moves: GateMoves) -> np.ndarray:
+        return self._cost_cache.get_moves_delta_cost(moves)
+
+    def apply_moves(self, moves: GateMoves, accepted: np.ndarray) -> None:
+        gate_ids = moves.gate_ids[accepted].tolist()
+
+        for gate_id in gate_ids:
+            self._free(gate_id)
+
+        for gate_id, x, y in zip(
+            gate_ids, moves.to_x[accepted].tolist(), moves.to_y[accepted].tolist()
+        ):
+            self._fill(gate_id, Dim(x, y))
+
+        self._cost_cache.apply_moves_and_update_cache(accepted)
+
+    def get_group_costs(
+        self, gate_ids: np.ndarray, to_x: np.ndarray, to_y: np.ndarray
+    ) -> np.ndarray:
+        # Cost of the nets of a group of gates for every candidate row of positions
+        return self._cost_cache.get_group_costs(gate_ids, to_x, to_y)
+
+    def move_group(
+        self, gate_ids: np.ndarray, to_x: np.ndarray, to_y: np.ndarray
+    ) -> None:
+        # Gates may take each other's positions, every one is freed before filling
+        for gate_id in gate_ids.tolist():
+            self._free(gate_id)
+
+        for gate_id, x, y in zip(gate_ids.tolist(), to_x.tolist(), to_y.tolist()):
+            self._fill(gate_id, Dim(x, y))
+
+        self._cost_cache.update_group_nets(gate_ids)
+
     def _set(self, pos: Dim, dim: Dim, value: int) -> None:
         for y in range(dim.y):
             for x in range(dim.x):
                 self._grid[pos.x + x][pos.y + y] = value
 
-    def _is_free(self, gate_id: int, pos: Dim) -> bool:
-        gate = self._gates[gate_id]
-
-        for y in range(gate.dim.y):
-            for x in range(gate.dim.x):
-                if is_pin_coords(Dim(pos.x + x, pos.y + y), self._dim):
-                    return False
-
-                try:
-                    if self._grid[pos.x + x][pos.y + y] != -1:
-                        return False
-                except IndexError:
-                    return False
-
-        return True
+        for free_pos_index in self._free_pos_indices.values():
+            if value == -1:
+                free_pos_index.release(pos, dim, self._grid)
+            else:
+                free_pos_index.occupy(pos, dim)
 
     def _free(self, gate_id: int) -> None:
         gate = self._gates[gate_id]
-        pos = self._gate_pos_map[gate_id]
+        pos = self.get_pos(gate_id)
 
-        log.debug(f"Remove gate {gate_id} at {pos}")
+        if log.debug_enabled:
+            log.debug(f"Remove gate {gate_id} at {pos}")
 
         if pos is None:
             return
 
-        self._gate_pos_map[gate_id] = None
+        self._gate_pos_x[gate_id] = -1
+        self._gate_pos_y[gate_id] = -1
         self._set(pos, gate.dim, -1)
 
     def _fill(self, gate_id: int, pos: Dim) -> None:
         gate = self._gates[gate_id]
-        self._gate_pos_map[gate_id] = pos
+        self._gate_pos_x[gate_id] = pos.x
+        self._gate_pos_y[gate_id] = pos.y
         self._set(pos, gate.dim, gate_id)
 
+    def _place_initial(self) -> None:
+        pins = dim_pin_iterator(self._dim)
+
+        for gate_id, gate in enumerate(self._gates):
+            if gate.is_port:
+                pos = next(pins)
+                self._fill(gate_id, pos)
+
+        # Larger footprints go first so small gates fill the holes they leave
+        gate_ids = sorted(
+            (gate_id for gate_id, gate in enumerate(self._gates) if not gate.is_port),
+            key=lambda gate_id: -self._gates[gate_id].dim.x
+            * self._gates[gate_id].dim.y,
+        )
+
+        for gate_id in gate_ids:
+            self._place(gate_id)
+
+    def _fill_placement(self, gate_pos_x: np.ndarray, gate_pos_y: np.ndarray) -> None:
+        for gate_id, (x, y) in enumerate(zip(gate_pos_x.tolist(), gate_pos_y.tolist())):
+            self._fill(gate_id, Dim(x, y))
+
     def _place(self, gate_id: int) -> None:
-        count = 0
+        gate = self._gates[gate_id]
+        pos = self._free_pos_indices[(gate.dim.x, gate.dim.y)].sample()
 
-        while True:
-            if count == GatesGrid.PLACE_RETRY_COUNT:
-                log.error(f"Unable to find placement for gate {gate_id}")
-                raise ValueError
+        if pos is None:
+            log.error(f"Unable to find placement for gate {gate_id}")
+            raise ValueError
 
-            pos = Dim(randrange(0, self._dim.x), randrange(0, self._dim.y))
+        self._fill(gate_id, pos)
+        if log.debug_enabled:
+            log.debug(f"Place gate {gate_id} at {pos}")
 
-            if self._is_free(gate_id, pos):
-                self._fill(gate_id, pos)
-                log.debug(f"Place gate {gate_id} at {pos}")
-                break
+    def _place_near(self, gate_id: int, center: Dim, window: int) -> None:
+        gate = self._gates[gate_id]
+        free_pos_index = self._free_pos_indices[(gate.dim.x, gate.dim.y)]
+        pos = free_pos_index.sample_near(center, window)
 
-            count += 1
+        # The gate was just freed from center, so center is always legal again
+        if pos is None:
+            pos = center
+
+        self._fill(gate_id, pos)
+        if log.debug_enabled:
+            log.debug(f"Place gate {gate_id} at {pos}")
 
 
 class GatesGridCostCache:
     def __init__(
-        self, netlist: dict[int, set[int]], gate_pos_map: list[Dim | None]
+        self,
+        netlist: Netlist,
+        gate_pos_x: np.ndarray,
+        gate_pos_y: np.ndarray,
+        congestion_map: CongestionMap | None = None,
+        congestion_weight: float = 0.0,
     ) -> None:
-        self._half_perim_cache_map: dict[int, float] = {}
+        self._netlist = netlist
+        self._gate_pos_x = gate_pos_x
+        self._gate_pos_y = gate_pos_y
+        self._gate_net_pin_counts = get_gate_net_pin_counts(netlist)
+
+        self._congestion_map = congestion_map
+        self._congestion_weight = congestion_weight
 
-        self._undo_half_perim_map: dict[int, float] = {}
+        self._net_bbox = np.zeros((netlist.num_nets, 4), dtype=np.int32)
+        self._net_bbox_counts = np.zeros((netlist.num_nets, 4), dtype=np.int32)
+        self._half_perim_cache = np.zeros(netlist.num_nets)
+
+        self._move_from_pos = (-1, -1)
+
+        self._pending_moves: tuple[np.ndarray, ...] = ()
+        self._pending_delta_cost: np.ndarray = np.zeros(0)
+
+        self._undo_net_map: dict[int, tuple[list[int], list[int], float]] = {}
         self._undo_cost_old = 0.0
         self._undo_cost_new = 0.0
 
-        self._cost_cache: float = self.cost_clean(netlist, gate_pos_map)
+        # Wire length part of the cost, the congestion part lives in the map
+        self._cost_cache: float = 0.0
+        self.recalculate()
 
-    def cost_clean(
-        self, netlist: dict[int, set[int]], gate_pos_map: list[Dim | None]
-    ) -> float:
+    def cost_clean(self) -> float:
         log.info("Calculating clean grid cost")
 
-        cost = 0.0
+        self._net_bbox, self._net_bbox_counts = get_nets_bbox(
+            self._netlist, self._gate_pos_x, self._gate_pos_y
+        )
+        self._half_perim_cache = (
+            (self._net_bbox[:, 1] - self._net_bbox[:, 0])
+            + (self._net_bbox[:, 3] - self._net_bbox[:, 2])
+        ) / 2
 
-        for net_id in netlist:
-            cost += self._get_and_cache_net_half_perim(net_id, netlist, gate_pos_map)
+        if self._congestion_map is not None:
+            self._congestion_map.rebuild(self._net_bbox)
 
-        return cost
+        return float(self._half_perim_cache.sum()) + self._get_congestion_cost()
 
     def cached_cost(self) -> float:
-        return self._cost_cache
+        return self._cost_cache + self._get_congestion_cost()
 
-    def being_mutation(
-        self, gate_ids: list[int], reverse_netlist: dict[int, set[int]]
-    ) -> None:
+    def recalculate(self) -> None:
+        self.cost_clean()
+        self._cost_cache = float(self._half_perim_cache.sum())
+
+    def being_mutation(self, gate_ids: list[int]) -> None:
         self._undo_cost_old = 0.0
         self._undo_cost_new = 0.0
-        self._undo_half_perim_map.clear()
+        self._undo_net_map.clear()
 
         for gate_id in gate_ids:
-            self._save_affected_half_perims(gate_id, reverse_netlist)
+            self._save_affected_nets(gate_id)
+
+    def begin_gate_move(self, gate_id: int) -> None:
+        self._move_from_pos = (
+            int(self._gate_pos_x[gate_id]),
+            int(self._gate_pos_y[gate_id]),
+        )
 
-    def begin_gate_move(
-        self, gate_id: int, reverse_netlist: dict[int, set[int]]
-    ) -> None:
         if self._cost_cache is not None:
-            self._undo_cost_old += self._get_cached_part_cost(gate_id, reverse_netlist)
+            self._undo_cost_old += self._get_cached_part_cost(gate_id)
 
-    def end_gate_move(
-        self,
-        gate_id: int,
-        reverse_netlist: dict[int, set[int]],
-        netlist: dict[int, set[int]],
-        gate_pos_map_after: list[Dim | None],
-    ) -> None:
-        self._undo_cost_new += self._get_part_cost(
-            gate_id, reverse_netlist, netlist, gate_pos_map_after
-        )
+    def end_gate_move(self, gate_id: int) -> None:
+        self._undo_cost_new += self._get_part_cost(gate_id)
 
     def end_mutation_and_update_cache(self) -> None:
         self._cost_cache -= self._undo_cost_old
@@ -290,56 +990,279 @@ class GatesGridCostCache:
         self._cost_cache -= self._undo_cost_new
         self._cost_cache += self._undo_cost_old
 
-        self._restore_half_perims()
+        self._restore_nets()
+
+    def get_moves_delta_cost(self, moves: GateMoves) -> np.ndarray:
+        netlist = self._netlist
+
+        starts = netlist.gate_net_offsets[moves.gate_ids]
+        lengths = netlist.gate_net_offsets[moves.gate_ids + 1] - starts
+        entries = get_flat_ranges(starts, lengths)
+
+        move_index = np.repeat(np.arange(moves.num_moves), lengths)
+        nets = netlist.gate_net_indices[entries]
+        num_pins = self._gate_net_pin_counts[entries][:, None]
+
+        old_pos = np.stack(
+            [moves.from_x, moves.from_x, moves.from_y, moves.from_y], axis=1
+        )[move_index]
+        new_pos = np.stack([moves.to_x, moves.to_x, moves.to_y, moves.to_y], axis=1)[
+            move_index
+        ]
+
+        # Same edge update as move_pins_in_bbox_inplace, for every (move, net) pair
+        bbox = self._net_bbox[nets]
+        bbox_counts = self._net_bbox_counts[nets] - np.where(
+            old_pos == bbox, num_pins, 0
+        )
+
+        is_min_edge = np.array([True, False, True, False])
+        extends = np.where(is_min_edge, new_pos < bbox, new_pos > bbox)
+
+        bbox_counts = np.where(
+            extends,
+            num_pins,
+            np.where(new_pos == bbox, bbox_counts + num_pins, bbox_counts),
+        )
+        bbox = np.where(extends, new_pos, bbox)
+
+        stale = np.flatnonzero((bbox_counts == 0).any(axis=1))
+
+        if len(stale) != 0:
+            bbox[stale], bbox_counts[stale] = self._get_moved_nets_bbox(
+                nets[stale], moves, move_index[stale]
+            )
+
+        half_perim = ((bbox[:, 1] - bbox[:, 0]) + (bbox[:, 3] - bbox[:, 2])) / 2
+        delta_cost = np.bincount(
+            move_index,
+            weights=half_perim - self._half_perim_cache[nets],
+            minlength=moves.num_moves,
+        )
+
+        self._pending_moves = (move_index, nets, bbox, bbox_counts, half_perim)
+        self._pending_delta_cost = delta_cost
+
+        if self._congestion_map is None:
+            return delta_cost
+
+        # Congestion deltas take every net alone, the map is updated exactly
+        # when the moves are applied
+        changed = np.flatnonzero((bbox != self._net_bbox[nets]).any(axis=1))
+        congestion_delta = [
+            self._congestion_map.get_move_delta(old_bbox, new_bbox)
+            for old_bbox, new_bbox in zip(
+                self._net_bbox[nets[changed]].tolist(), bbox[changed].tolist()
+            )
+        ]
+
+        return delta_cost + self._congestion_weight * np.bincount(
+            move_index[changed], weights=congestion_delta, minlength=moves.num_moves
+        )
+
+    def apply_moves_and_update_cache(self, accepted: np.ndarray) -> None:
+        move_index, nets, bbox, bbox_counts, half_perim = self._pending_moves
+        applied = accepted[move_index]
+
+        self._move_nets_demand(nets[applied], bbox[applied])
+        self._net_bbox[nets[applied]] = bbox[applied]
+        self._net_bbox_counts[nets[applied]] = bbox_counts[applied]
+        self._half_perim_cache[nets[applied]] = half_perim[applied]
+
+        self._cost_cache += float(self._pending_delta_cost[accepted].sum())
+        self._pending_moves = ()
+
+    def get_group_costs(
+        self, gate_ids: np.ndarray, to_x: np.ndarray, to_y: np.ndarray
+    ) -> np.ndarray:
+        starts = self._netlist.gate_net_offsets[gate_ids]
+        lengths = self._netlist.gate_net_offsets[gate_ids + 1] - starts
+        incidences = get_flat_ranges(starts, lengths)
+
+        nets, inc_nets = np.unique(
+            self._netlist.gate_net_indices[incidences], return_inverse=True
+        )
+        inc_nets = inc_nets.reshape(-1)
+        inc_members = np.repeat(np.arange(len(gate_ids)), lengths)
+        inc_pins = self._gate_net_pin_counts[incidences]
+
+        # The cached bbox without the group is the bbox of the pins outside it,
+        # unless the group held every pin on one of its edges
+        bbox = self._net_bbox[nets].astype(float)
+        edge_pos = (
+            self._gate_pos_x,
+            self._gate_pos_x,
+            self._gate_pos_y,
+            self._gate_pos_y,
+        )
+        exhausted = np.zeros(len(nets), dtype=bool)
+
+        for edge, gate_pos in enumerate(edge_pos):
+            on_edge = gate_pos[gate_ids[inc_members]] == bbox[inc_nets, edge]
+            group_count = np.bincount(inc_nets, on_edge * inc_pins, len(nets))
+            exhausted |= group_count >= self._net_bbox_counts[nets, edge]
+
+        if exhausted.any():
+            bbox[exhausted] = self._get_nets_bbox_without(nets[exhausted], gate_ids)
+
+        # Every candidate extends the fixed bbox with the positions of the group
+        num_candidates = len(to_x)
+        candidate_rows = np.arange(num_candidates)[:, None]
+        candidate_edges = []
+
+        for edge, to_pos in enumerate((to_x, to_x, to_y, to_y)):
+            reduce = np.minimum if edge % 2 == 0 else np.maximum
+            candidate_edge = np.tile(bbox[:, edge], (num_candidates, 1))
+            reduce.at(
+                candidate_edge,
+                (candidate_rows, inc_nets[None, :]),
+                to_pos[:, inc_members],
+            )
+            candidate_edges.append(candidate_edge)
+
+        min_x, max_x, min_y, max_y = candidate_edges
+        return ((max_x - min_x) + (max_y - min_y)).sum(axis=1) / 2
+
+    def _get_nets_bbox_without(
+        self, nets: np.ndarray, gate_ids: np.ndarray
+    ) -> np.ndarray:
+        # Bounding box of the pins of each net outside gate_ids, empty boxes are
+        # inverted to infinity so any candidate position replaces them
+        starts = self._netlist.net_pin_offsets[nets]
+        lengths = self._netlist.net_pin_offsets[nets + 1] - starts
+        pin_gate_ids = self._netlist.pin_gate_ids[get_flat_ranges(starts, lengths)]
+        pin_nets = np.repeat(np.arange(len(nets)), lengths)
+
+        outside = ~np.isin(pin_gate_ids, gate_ids)
+        pin_nets, pin_gate_ids = pin_nets[outside], pin_gate_ids[outside]
+
+        bbox = np.tile([np.inf, -np.inf, np.inf, -np.inf], (len(nets), 1))
+
+        for edge, gate_pos in enumerate(
+            (self._gate_pos_x, self._gate_pos_x, self._gate_pos_y, self._gate_pos_y)
+        ):
+            reduce = np.minimum if edge % 2 == 0 else np.maximum
+            reduce.at(bbox[:, edge], pin_nets, gate_pos[pin_gate_ids])
+
+        return bbox
+
+    def update_group_nets(self, gate_ids: np.ndarray) -> None:
+        nets = self._get_group_nets(gate_ids)
+        starts = self._netlist.net_pin_offsets[nets]
+        lengths = self._netlist.net_pin_offsets[nets + 1] - starts
+        pin_gate_ids = self._netlist.pin_gate_ids[get_flat_ranges(starts, lengths)]
+
+        bbox, bbox_counts = get_segments_bbox(
+            self._gate_pos_x[pin_gate_ids], self._gate_pos_y[pin_gate_ids], lengths
+        )
+        half_perim = ((bbox[:, 1] - bbox[:, 0]) + (bbox[:, 3] - bbox[:, 2])) / 2
+
+        self._cost_cache += float((half_perim - self._half_perim_cache[nets]).sum())
+
+        self._move_nets_demand(nets, bbox)
+        self._net_bbox[nets] = bbox
+        self._net_bbox_counts[nets] = bbox_counts
+        self._half_perim_cache[nets] = half_perim
+
+    def _get_group_nets(self, gate_ids: np.ndarray) -> np.ndarray:
+        starts = self._netlist.gate_net_offsets[gate_ids]
+        lengths = self._netlist.gate_net_offsets[gate_ids + 1] - starts
+
+        return np.unique(
+            self._netlist.gate_net_indices[get_flat_ranges(starts, lengths)]
+        )
+
+    def _get_moved_nets_bbox(
+        self, nets: np.ndarray, moves: GateMoves, move_index: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        starts = self._netlist.net_pin_offsets[nets]
+        lengths = self._netlist.net_pin_offsets[nets + 1] - starts
+        pin_gate_ids = self._netlist.pin_gate_ids[get_flat_ranges(starts, lengths)]
+
+        pin_x = self._gate_pos_x[pin_gate_ids]
+        pin_y = self._gate_pos_y[pin_gate_ids]
+
+        pin_move_index = np.repeat(move_index, lengths)
+        moved = pin_gate_ids == moves.gate_ids[pin_move_index]
+        pin_x[moved] = moves.to_x[pin_move_index[moved]]
+        pin_y[moved] = moves.to_y[pin_move_index[moved]]
+
+        return get_segments_bbox(pin_x, pin_y, lengths)
 
     def _get_and_cache_net_half_perim(
-        self,
-        net_id: int,
-        netlist: dict[int, set[int]],
-        gate_pos_map: list[Dim | None],
+        self, net: int, move_to_pos: tuple[int, int], num_pins: int
     ) -> float:
-        gates_ids = netlist[net_id]
+        bbox = self._net_bbox[net].tolist()
+        bbox_counts = self._net_bbox_counts[net].tolist()
 
-        gates_pos_list = [gate_pos_map[gate_id] for gate_id in gates_ids]
+        if not move_pins_in_bbox_inplace(
+            bbox, bbox_counts, self._move_from_pos, move_to_pos, num_pins
+        ):
+            gate_ids = self._netlist.gates_of_net(net)
+            bbox, bbox_counts = get_bbox(
+                self._gate_pos_x[gate_ids].tolist(),
+                self._gate_pos_y[gate_ids].tolist(),
+            )
 
-        half_perim = get_half_perim(gates_pos_list)
-        self._half_perim_cache_map[net_id] = half_perim
+        half_perim = get_bbox_half_perim(bbox)
+
+        if self._congestion_map is not None:
+            self._congestion_map.move_net(self._net_bbox[net].tolist(), bbox)
+
+        self._net_bbox[net] = bbox
+        self._net_bbox_counts[net] = bbox_counts
+        self._half_perim_cache[net] = half_perim
 
         return half_perim
 
-    def _get_cached_part_cost(
-        self,
-        gate_id: int,
-        reverse_netlist: dict[int, set[int]],
-    ) -> float:
-        net_ids = get_affected_nets(gate_id, reverse_netlist)
-        return sum([self._half_perim_cache_map[net_id] for net_id in net_ids])
+    def _get_cached_part_cost(self, gate_id: int) -> float:
+        nets = get_affected_nets(gate_id, self._netlist)
+        return float(self._half_perim_cache[nets].sum())
+
+    def _get_part_cost(self, gate_id: int) -> float:
+        nets = get_affected_nets(gate_id, self._netlist)
+
+        start = self._netlist.gate_net_offsets[gate_id]
+        end = self._netlist.gate_net_offsets[gate_id + 1]
+        pin_counts = self._gate_net_pin_counts[start:end]
+
+        move_to_pos = (int(self._gate_pos_x[gate_id]), int(self._gate_pos_y[gate_id]))
 
-    def _get_part_cost(
-        self,
-        gate_id: int,
-        reverse_netlist: dict[int, set[int]],
-        netlist: dict[int, set[int]],
-        gate_pos_map: list[Dim | None],
-    ) -> float:
-        net_ids = get_affected_nets(gate_id, reverse_netlist)
         return sum(
             [
-                self._get_and_cache_net_half_perim(net_id, netlist, gate_pos_map)
-                for net_id in net_ids
+                self._get_and_cache_net_half_perim(net, move_to_pos, num_pins)
+                for net, num_pins in zip(nets.tolist(), pin_counts.tolist())
             ]
         )
 
-    def _save_affected_half_perims(
-        self,
-        gate_id: int,
-        reverse_netlist: dict[int, set[int]],
-    ) -> None:
-        net_ids = get_affected_nets(gate_id, reverse_netlist)
+    def _save_affected_nets(self, gate_id: int) -> None:
+        nets = get_affected_nets(gate_id, self._netlist)
+
+        for net in nets.tolist():
+            self._undo_net_map[net] = (
+                self._net_bbox[net].tolist(),
+                self._net_bbox_counts[net].tolist(),
+                float(self._half_perim_cache[net]),
+            )
+
+    def _restore_nets(self) -> None:
+        for net, (bbox, bbox_counts, half_perim) in self._undo_net_map.items():
+            if self._congestion_map is not None:
+                self._congestion_map.move_net(self._net_bbox[net].tolist(), bbox)
+
+            self._net_bbox[net] = bbox
+            self._net_bbox_counts[net] = bbox_counts
+            self._half_perim_cache[net] = half_perim
+
+    def _move_nets_demand(self, nets: np.ndarray, bbox: np.ndarray) -> None:
+        if self._congestion_map is None:
+            return
+
+        for old_bbox, new_bbox in zip(self._net_bbox[nets].tolist(), bbox.tolist()):
+            self._congestion_map.move_net(old_bbox, new_bbox)
 
-        for net_id in net_ids:
-            self._undo_half_perim_map[net_id] = self._half_perim_cache_map[net_id]
+    def _get_congestion_cost(self) -> float:
+        if self._congestion_map is None:
+            return 0.0
 
-    def _restore_half_perims(self) -> None:
-        for net_id, half_perim in self._undo_half_perim_map.items():
-            self._half_perim_cache_map[net_id] = half_perim
+        return self._congestion_weight * self._congestion_map.overflow
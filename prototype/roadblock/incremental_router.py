@@ -0,0 +1,125 @@
+import numpy as np
+
+from roadblock.dim import Dim
+from roadblock.grid import GatesGrid
+from roadblock.router import (
+    construct_routes,
+    create_router_grid,
+    get_flat_loc,
+    get_pin_access_cells,
+    get_pin_mask,
+    get_pin_sharers,
+    rip_route_inplace,
+    route_with_rip_up,
+)
+from roadblock.steiner import order_routes
+from roadblock import log
+
+
+class IncrementalRouter:
+    # Keeps the router grid and the cells of every route between calls, so after
+    # the placement changes only the routes that are no longer valid are ripped
+    # and routed again
+    def __init__(self, dim: Dim, max_layers: int) -> None:
+        self._router_grid = create_router_grid(dim, max_layers)
+        self._routes: dict[int, list[Dim]] = {}
+        self._route_cells: dict[int, np.ndarray] = {}
+        self._pin_sharers: dict[int, set[int]] = {}
+
+    @property
+    def router_grid(self) -> np.ndarray:
+        return self._router_grid
+
+    @property
+    def route_cells(self) -> dict[int, np.ndarray]:
+        return self._route_cells
+
+    def _get_stale_routes(
+        self,
+        routes: dict[int, list[Dim]],
+        pin_mask: np.ndarray,
+        pin_sharers: dict[int, set[int]],
+    ) -> set[int]:
+        # Routes whose pins moved, that now share pins with other routes, or that
+        # run over the pins of other routes or the cells kept to leave them
+        stale_ids: set[int] = set()
+        shape = self._router_grid.shape
+
+        for route_id, cells in self._route_cells.items():
+            points = routes.get(route_id)
+
+            if points is None:
+                stale_ids.add(route_id)
+                continue
+
+            old_points = set((point.x, point.y) for point in self._routes[route_id])
+
+            if set((point.x, point.y) for point in points) != old_points:
+                stale_ids.add(route_id)
+                continue
+
+            if pin_sharers[route_id] != self._pin_sharers[route_id]:
+                stale_ids.add(route_id)
+                continue
+
+            # Routes may run over the pins of routes they share a pin with
+            own_points = [
+                point
+                for other_id in {route_id} | pin_sharers[route_id]
+                for point in routes[other_id]
+            ]
+            own_pins = get_pin_access_cells(
+                [get_flat_loc(point.to_dim3(), shape) for point in own_points], shape
+            )
+            pin_cells = cells[pin_mask[cells]]
+
+            if not np.isin(pin_cells, own_pins).all():
+                stale_ids.add(route_id)
+
+        return stale_ids
+
+    def route(self, grid: GatesGrid) -> set[int]:
+        # Routes every route of the placement in grid that is not routed yet or was
+        # invalidated by it, returns the routes that were routed
+        if grid.dim != Dim(*self._router_grid.shape[1:]):
+            log.error("Incremental router grid does not match the gates grid")
+            raise ValueError
+
+        routes = order_routes(construct_routes(grid))
+        pin_mask = get_pin_mask(routes, self._router_grid.shape)
+        pin_sharers = get_pin_sharers(routes, self._router_grid.shape)
+
+        stale_ids = self._get_stale_routes(routes, pin_mask, pin_sharers)
+
+        for route_id in stale_ids:
+            rip_route_inplace(self._router_grid, route_id)
+            del self._route_cells[route_id]
+
+        # Ripped routes may have covered pins they shared with routes that stay
+        for route_id in set().union(*[self._pin_sharers[i] for i in stale_ids]):
+            if route_id in self._route_cells:
+                cells = self._route_cells[route_id]
+                self._router_grid.reshape(-1)[cells] = route_id
+
+        self._routes = routes
+        self._pin_sharers = pin_sharers
+
+        route_ids = [
+            route_id for route_id in routes.keys() if route_id not in self._route_cells
+        ]
+
+        log.info(
+            f"Routing {len(route_ids)} of {len(routes)} routes"
+            + f" with {len(stale_ids)} ripped"
+        )
+
+        route_with_rip_up(
+            self._router_grid,
+            routes,
+            route_ids,
+            pin_mask,
+            pin_sharers,
+            self._route_cells,
+        )
+
+        return set(route_ids)
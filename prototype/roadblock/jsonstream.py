@@ -0,0 +1,147 @@
+import re
+import json
+from typing import Any, Iterator, TextIO
+
+from roadblock import log
+
+
+WHITESPACE_REGEX = re.compile(r"\s*")
+NUMBER_REGEX = re.compile(r"[-+.0-9eE]*")
+
+
+def skip_whitespace(buf: str, pos: int) -> int:
+    match = WHITESPACE_REGEX.match(buf, pos)
+    return pos if match is None else match.end()
+
+
+class JsonStreamReader:
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, f: TextIO) -> None:
+        self._f = f
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+
+        chunk = self._f.read(JsonStreamReader.CHUNK_SIZE)
+
+        if chunk == "":
+            self._eof = True
+            return False
+
+        # Drop everything already consumed so the buffer stays around one chunk
+        consumed = self._pos
+        self._buf = self._buf[consumed:] + chunk
+        self._pos = 0
+
+        return True
+
+    def peek(self) -> str:
+        if self._pos < len(self._buf) and not self._buf[self._pos].isspace():
+            return self._buf[self._pos]
+
+        while True:
+            self._pos = skip_whitespace(self._buf, self._pos)
+
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            log.error(f"Expected '{char}' in json stream at offset {self._pos}")
+            raise ValueError
+
+        self._pos += 1
+
+    def read_value(self) -> Any:
+        self.peek()
+
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    log.error("Unexpected end of json stream")
+                    raise
+
+                continue
+
+            # A number running up to the buffer end may continue in the next chunk,
+            # its prefixes like "1." or "1e-" still decode to a shorter number
+            if self._is_number_cut():
+                self._fill()
+                continue
+
+            self._pos = end
+            return value
+
+    def _is_number_cut(self) -> bool:
+        if self._eof or self._buf[self._pos] not in "-0123456789":
+            return False
+
+        match = NUMBER_REGEX.match(self._buf, self._pos)
+        return match is not None and match.end() == len(self._buf)
+
+    def skip_value(self, depth: int = 1) -> None:
+        # Containers are walked member by member so only one small member is
+        # ever decoded at a time, anything deeper is decoded whole and dropped
+        char = self.peek()
+
+        if depth == 0 or char not in ("{", "["):
+            self.read_value()
+            return
+
+        members = self.iter_object() if char == "{" else self.iter_array()
+
+        for _ in members:
+            self.skip_value(depth - 1)
+
+    def iter_object(self) -> Iterator[str]:
+        # Yields each key, the caller must consume the value before resuming
+        self.expect("{")
+
+        if self.peek() == "}":
+            self._pos += 1
+            return
+
+        while True:
+            key = self.read_value()
+            self.expect(":")
+
+            yield key
+
+            if self.peek() == ",":
+                self._pos += 1
+                continue
+
+            self.expect("}")
+            return
+
+    def iter_array(self) -> Iterator[int]:
+        # Yields each index, the caller must consume the value before resuming
+        self.expect("[")
+
+        if self.peek() == "]":
+            self._pos += 1
+            return
+
+        index = 0
+
+        while True:
+            yield index
+            index += 1
+
+            if self.peek() == ",":
+                self._pos += 1
+                continue
+
+            self.expect("]")
+            return
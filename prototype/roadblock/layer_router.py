@@ -0,0 +1,223 @@
+import numpy as np
+
+from roadblock.dim import Dim
+from roadblock.grid import GatesGrid
+from roadblock.router import (
+    HISTORY_FACTOR,
+    VIA_COST,
+    NegotiationState,
+    NegotiationStats,
+    SearchBuffers,
+    construct_routes,
+    create_router_grid,
+    get_pin_mask,
+    get_pin_sharers,
+    negotiate_routes,
+    route_with_rip_up,
+    search_route_window,
+)
+from roadblock.parallel_router import WINDOW_MARGIN, get_route_window
+from roadblock.steiner import order_routes
+from roadblock import log
+
+
+PLANE_MAX_ITERATIONS = 20
+PIN_ESCAPE_COST = 12.0
+
+
+def route_plane(
+    routes: dict[int, list[Dim]],
+    dim: Dim,
+    max_layers: int,
+    max_iterations: int = PLANE_MAX_ITERATIONS,
+) -> tuple[dict[int, np.ndarray], list[NegotiationStats]]:
+    # Negotiated routing on a single layer where every cell fits as many nets as
+    # there are layers above the pins, pin cells fit one less for the layer kept
+    # to leave them. Returns flat cells of the plane
+    plane_grid = create_router_grid(dim, 1)
+    negotiation = NegotiationState(plane_grid.size, HISTORY_FACTOR)
+    negotiation.capacity[:] = max_layers - 1
+
+    for points in routes.values():
+        for point in points:
+            negotiation.capacity[point.x * dim.y + point.y] = max_layers - 2
+
+    return negotiate_routes(
+        plane_grid, routes, negotiation, max_iterations, ordered=True
+    )
+
+
+def get_plane_tree(
+    cells: np.ndarray, root: int, size_y: int
+) -> tuple[list[int], dict[int, int]]:
+    # Breadth first order of the plane cells of a net from root and the parent of
+    # every cell, cells of the net next to each other are connected
+    cell_set = set(cells.tolist())
+    parents = {root: -1}
+    order = [root]
+
+    for cell in order:
+        x, y = divmod(cell, size_y)
+
+        for next_x, next_y in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+            next_cell = next_x * size_y + next_y
+
+            if next_y < 0 or next_y >= size_y or next_cell not in cell_set:
+                continue
+
+            if next_cell not in parents:
+                parents[next_cell] = cell
+                order.append(next_cell)
+
+    return order, parents
+
+
+def assign_layers(
+    router_grid: np.ndarray,
+    route_id: int,
+    points: list[Dim],
+    plane_cells: np.ndarray,
+    pin_mask: np.ndarray,
+    shared_ids: set[int],
+) -> np.ndarray | None:
+    # Dynamic program over the tree of the plane route. Every cell takes a layer,
+    # its column is filled from the layer of its parent to its own one, down to the
+    # pin layer on pins. The cost of a cell and its subtree is found for every
+    # layer of the parent, so the layers with the fewest vias are picked top down
+    num_layers, _, size_y = router_grid.shape
+    layers = np.arange(num_layers)
+
+    pin_cells = set(point.x * size_y + point.y for point in points)
+    root = points[0].x * size_y + points[0].y
+    order, parents = get_plane_tree(plane_cells, root, size_y)
+
+    if len(order) != len(np.unique(plane_cells)):
+        return None
+
+    xs, ys = np.divmod(np.array(order, dtype=np.int64), size_y)
+    columns = router_grid[:, xs, ys]
+    blocked = (columns != -1) & (columns != route_id)
+    blocked &= ~np.isin(columns, list(shared_ids))
+    blocked |= pin_mask.reshape(router_grid.shape)[:, xs, ys] & (columns == -1)
+
+    is_pin = np.array([cell in pin_cells for cell in order])
+    blocked[:2, is_pin] = False
+
+    # Pins boxed in by other pins can only be left through the layer above their
+    # access cells, crossing other pins there is allowed at a cost
+    escapes = np.zeros(blocked.shape)
+
+    if num_layers > 2:
+        escapes[2] = pin_mask.reshape(router_grid.shape)[0, xs, ys] & ~is_pin
+        escapes *= PIN_ESCAPE_COST
+
+    # Blocked cells and escape costs of a column in any layer range by difference
+    # of prefix sums
+    num_blocked = np.vstack([np.zeros(len(order), dtype=np.int64), blocked.cumsum(0)])
+    escape_costs = np.vstack([np.zeros(len(order)), escapes.cumsum(0)])
+
+    low = np.minimum(layers[:, None], layers[None, :])
+    high = np.maximum(layers[:, None], layers[None, :])
+
+    index = {cell: i for i, cell in enumerate(order)}
+    subtree_costs = np.zeros((len(order), num_layers))
+    cell_costs = np.zeros((len(order), num_layers))
+    best_layers = np.zeros((len(order), num_layers), dtype=np.int64)
+
+    for i in reversed(range(len(order))):
+        cell_low = np.zeros_like(low) if is_pin[i] else low
+        spans_blocked = num_blocked[high + 1, i] - num_blocked[cell_low, i]
+        spans_escape = escape_costs[high + 1, i] - escape_costs[cell_low, i]
+
+        # Rows are layers of the cell, columns layers of the parent
+        costs = VIA_COST * (high - cell_low) + spans_escape + subtree_costs[i][:, None]
+        costs[spans_blocked != 0] = np.inf
+
+        best_layers[i] = np.argmin(costs, axis=0)
+        cell_costs[i] = costs[best_layers[i], layers]
+
+        if parents[order[i]] != -1:
+            subtree_costs[index[parents[order[i]]]] += cell_costs[i]
+
+    # The root has no parent so its column only spans its own layer
+    cell_layers = np.zeros(len(order), dtype=np.int64)
+    cell_layers[0] = np.argmin(np.diagonal(costs))
+
+    if not np.isfinite(costs[cell_layers[0], cell_layers[0]]):
+        return None
+
+    for i in range(1, len(order)):
+        cell_layers[i] = best_layers[i, cell_layers[index[parents[order[i]]]]]
+
+    cells: list[int] = []
+
+    for i, cell in enumerate(order):
+        span_layers = [cell_layers[i]]
+
+        if i != 0:
+            span_layers.append(cell_layers[index[parents[cell]]])
+
+        span_low = 0 if is_pin[i] else min(span_layers)
+
+        for z in range(span_low, max(span_layers) + 1):
+            cells.append((z * router_grid.shape[1] + xs[i]) * size_y + ys[i])
+
+    return np.array(cells, dtype=np.int64)
+
+
+def route_layer_assigned(
+    grid: GatesGrid, max_layers: int, max_iterations: int = PLANE_MAX_ITERATIONS
+) -> list[NegotiationStats]:
+    # Nets are routed on a single plane with overlaps first, then every net gets
+    # its layers in routing order around the nets already in the grid. Nets that
+    # do not fit in any window are routed with rip-up on the full grid at the end
+    router_grid = create_router_grid(grid.dim, max_layers)
+    buffers = SearchBuffers(router_grid.size)
+    routes = order_routes(construct_routes(grid))
+    pin_mask = get_pin_mask(routes, router_grid.shape)
+    pin_sharers = get_pin_sharers(routes, router_grid.shape)
+
+    log.info(f"Routing {len(routes)} routes on a plane")
+
+    plane_cells, stats = route_plane(routes, grid.dim, max_layers, max_iterations)
+
+    route_cells: dict[int, np.ndarray] = {}
+    failed_ids: list[int] = []
+
+    for route_id, points in routes.items():
+        cells = assign_layers(
+            router_grid,
+            route_id,
+            points,
+            plane_cells[route_id],
+            pin_mask,
+            pin_sharers[route_id],
+        )
+
+        # Nets that do not fit the layers are searched in 3D near their pins
+        if cells is None:
+            cells = search_route_window(
+                router_grid,
+                points,
+                get_route_window(points, grid.dim, WINDOW_MARGIN),
+                buffers,
+                pin_mask=pin_mask,
+                shared_ids=pin_sharers[route_id],
+                ordered=True,
+            )
+
+        if cells is None:
+            failed_ids.append(route_id)
+            continue
+
+        route_cells[route_id] = cells
+        router_grid.reshape(-1)[cells] = route_id
+        log.info(f"Created route {route_id}")
+
+    log.info(f"Routing {len(failed_ids)} routes that did not fit their window")
+
+    route_with_rip_up(
+        router_grid, routes, failed_ids, pin_mask, pin_sharers, route_cells
+    )
+
+    return stats
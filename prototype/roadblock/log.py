@@ -16,6 +16,7 @@ class Log:
 
 
 debug_enabled = False
+info_enabled = True
 
 logs: list[Log] = []
 
@@ -44,6 +45,9 @@ def print_log(log: Log) -> None:
 
 
 def info(message: str) -> None:
+    if not info_enabled:
+        return
+
     log = Log(now(), LogLevel.INFO, message)
     print_log(log)
     logs.append(log)
@@ -73,3 +77,8 @@ def debug(message: str) -> None:
 def enable_debug() -> None:
     global debug_enabled
     debug_enabled = True
+
+
+def disable_info() -> None:
+    global info_enabled
+    info_enabled = False
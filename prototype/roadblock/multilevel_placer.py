@@ -0,0 +1,354 @@
+from dataclasses import dataclass
+from itertools import islice
+from math import ceil, sqrt
+
+import numpy as np
+
+from roadblock.dim import Dim
+from roadblock.grid import GatesGrid, dim_pin_iterator
+from roadblock.netlist import (
+    GateType,
+    MinecraftGate,
+    Netlist,
+    construct_netlist_from_pins,
+)
+from roadblock.placer import AnnealingPlacer, AdaptiveAnnealingPlacer
+from roadblock.analytic_placer import get_net_model_edges
+
+from roadblock import log
+
+
+COARSEST_GATES = 200
+MIN_COARSEN_RATIO = 1.1
+MATCHING_ROUNDS = 4
+MAX_CLUSTER_AREA_FACTOR = 4
+
+
+@dataclass
+class PlacementLevel:
+    gates: list[MinecraftGate]
+    netlist: Netlist
+    area: np.ndarray
+
+    # Gate id in the real grid of every port, -1 for every other gate
+    port_ids: np.ndarray
+
+    # Cluster in the next coarser level of every gate in this level
+    cluster_of: np.ndarray | None = None
+
+
+def get_clique_edges(
+    netlist: Netlist, is_port: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Gate to gate edges of the net model in both directions, with the weights
+    # of parallel edges summed. Star nodes are replaced by the first gate of their
+    # net so large nets still pull gates together. Ports never get clustered
+    lhs, rhs, weights, _ = get_net_model_edges(netlist)
+    num_gates = netlist.num_gates
+
+    is_star = rhs >= num_gates
+    stars, first = np.unique(rhs[is_star], return_index=True)
+
+    hub = np.zeros(len(stars), dtype=np.int64)
+    hub[stars - num_gates] = lhs[is_star][first]
+    rhs[is_star] = hub[rhs[is_star] - num_gates]
+
+    keep = (lhs != rhs) & ~is_port[lhs] & ~is_port[rhs]
+    lhs, rhs, weights = lhs[keep], rhs[keep], weights[keep]
+
+    keys, inverse = np.unique(
+        np.minimum(lhs, rhs) * num_gates + np.maximum(lhs, rhs), return_inverse=True
+    )
+    weights = np.bincount(inverse.reshape(-1), weights)
+    lhs, rhs = keys // max(num_gates, 1), keys % max(num_gates, 1)
+
+    return (
+        np.concatenate((lhs, rhs)),
+        np.concatenate((rhs, lhs)),
+        np.concatenate((weights, weights)),
+    )
+
+
+def get_group_cumsum(values: np.ndarray, groups: np.ndarray) -> np.ndarray:
+    # Running sum of values restarting at every new group, groups must be sorted
+    cum_values = np.cumsum(values)
+
+    starts = np.flatnonzero(np.diff(groups, prepend=np.nan) != 0)
+    lengths = np.diff(np.append(starts, len(values)))
+
+    return cum_values - np.repeat(cum_values[starts] - values[starts], lengths)
+
+
+def get_heavy_edge_matching(
+    netlist: Netlist, area: np.ndarray, is_port: np.ndarray
+) -> tuple[np.ndarray, int]:
+    # Every gate proposes to its heaviest unmatched neighbour and mutual proposals
+    # are matched, edge weights are divided by the area so clusters stay balanced
+    lhs, rhs, weights = get_clique_edges(netlist, is_port)
+    score = weights / (area[lhs] * area[rhs]) * (1 + 1e-6 * np.random.rand(len(lhs)))
+
+    match = np.full(netlist.num_gates, -1, dtype=np.int64)
+
+    for _ in range(MATCHING_ROUNDS):
+        alive = (match[lhs] == -1) & (match[rhs] == -1)
+
+        if not alive.any():
+            break
+
+        alive_lhs, alive_rhs = lhs[alive], rhs[alive]
+        order = np.lexsort((-score[alive], alive_lhs))
+        gates, first = np.unique(alive_lhs[order], return_index=True)
+
+        best = np.full(netlist.num_gates, -1, dtype=np.int64)
+        best[gates] = alive_rhs[order][first]
+
+        mutual = gates[(best[best[gates]] == gates) & (gates < best[gates])]
+        match[mutual] = best[mutual]
+        match[best[mutual]] = mutual
+
+    representative = np.arange(netlist.num_gates)
+    matched = match != -1
+    representative[matched] = np.minimum(representative[matched], match[matched])
+
+    # Gates left over around high fanout nets join the cluster of their heaviest
+    # neighbour, the heaviest joiners first until the cluster reaches its area cap
+    unmatched = ~matched[lhs]
+    order = np.lexsort((-score[unmatched], lhs[unmatched]))
+    gates, first = np.unique(lhs[unmatched][order], return_index=True)
+    best = rhs[unmatched][order][first]
+    gate_scores = score[unmatched][order][first]
+
+    joins = matched[best]
+    join_gates = gates[joins]
+    targets = representative[best[joins]]
+
+    order = np.lexsort((-gate_scores[joins], targets))
+    join_gates, targets = join_gates[order], targets[order]
+
+    max_area = MAX_CLUSTER_AREA_FACTOR * area[~is_port].mean()
+    cluster_area = np.bincount(representative, area, netlist.num_gates)
+    fits = (
+        cluster_area[targets] + get_group_cumsum(area[join_gates], targets) <= max_area
+    )
+    representative[join_gates[fits]] = targets[fits]
+
+    # The rest are paired with another leftover gate sharing the same neighbour
+    left = np.ones(len(gates), dtype=bool)
+    left[np.flatnonzero(joins)[order[fits]]] = False
+
+    order = np.argsort(best[left], kind="stable")
+    left_gates, left_best = gates[left][order], best[left][order]
+
+    rank = get_group_cumsum(np.ones(len(left_gates)), left_best) - 1
+    pair_second = np.flatnonzero(rank % 2 == 1)
+    representative[left_gates[pair_second]] = left_gates[pair_second - 1]
+
+    _, cluster_of = np.unique(representative, return_inverse=True)
+    cluster_of = cluster_of.reshape(-1)
+
+    return cluster_of, int(cluster_of.max(initial=-1)) + 1
+
+
+def coarsen_level(level: PlacementLevel) -> PlacementLevel:
+    is_port = np.array([gate.is_port for gate in level.gates], dtype=bool)
+    cluster_of, num_clusters = get_heavy_edge_matching(
+        level.netlist, level.area, is_port
+    )
+
+    # Ports are never matched so they map to their own cluster and are kept as is
+    gates = [
+        MinecraftGate(f"cluster{cluster}", GateType.BUFF, set(), set(), set())
+        for cluster in range(num_clusters)
+    ]
+
+    port_ids = np.full(num_clusters, -1, dtype=np.int64)
+
+    for gate_id in np.flatnonzero(is_port).tolist():
+        gates[cluster_of[gate_id]] = level.gates[gate_id]
+        port_ids[cluster_of[gate_id]] = level.port_ids[gate_id]
+
+    netlist = level.netlist
+    coarse_netlist = construct_netlist_from_pins(
+        netlist.pin_net_indices,
+        cluster_of[netlist.pin_gate_ids],
+        netlist.pin_roles,
+        num_clusters,
+    )
+
+    level.cluster_of = cluster_of
+
+    return PlacementLevel(
+        gates=gates,
+        netlist=coarse_netlist,
+        area=np.bincount(cluster_of, level.area, num_clusters),
+        port_ids=port_ids,
+    )
+
+
+def get_coarse_dim(
+    dim: Dim, movable_area: float, num_movable: int, num_ports: int
+) -> Dim:
+    # Clusters are 1x1 on a shrunk grid with the same utilization as the real one
+    ratio = sqrt(num_movable / max(movable_area, 1))
+    coarse_x = ceil((dim.x - 2) * ratio) + 2
+    coarse_y = ceil((dim.y - 2) * ratio) + 2
+
+    while (coarse_x - 2) * (coarse_y - 2) < num_movable or (
+        2 * (coarse_x - 2) + 2 * (coarse_y - 2) < num_ports
+    ):
+        coarse_x += 1
+        coarse_y += 1
+
+    return Dim(coarse_x, coarse_y)
+
+
+def scale_coords(pos: np.ndarray, from_size: int, to_size: int) -> np.ndarray:
+    # Maps cell centers of the interior of one grid onto the interior of another
+    return 1 + (pos - 0.5) * (to_size - 2) / max(from_size - 2, 1) - 0.5
+
+
+def get_coarse_port_positions(
+    dim: Dim, coarse_dim: Dim, port_x: np.ndarray, port_y: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    num_slots = 2 * (coarse_dim.x - 2) + 2 * (coarse_dim.y - 2)
+    slots = list(islice(dim_pin_iterator(coarse_dim), num_slots))
+    slot_index = {(slot.x, slot.y): index for index, slot in enumerate(slots)}
+    taken = np.zeros(num_slots, dtype=bool)
+
+    x = np.clip(np.rint(scale_coords(port_x, dim.x, coarse_dim.x)), 1, coarse_dim.x - 2)
+    y = np.clip(np.rint(scale_coords(port_y, dim.y, coarse_dim.y)), 1, coarse_dim.y - 2)
+
+    x[port_x == 0] = 0
+    x[port_x == dim.x - 1] = coarse_dim.x - 1
+    y[port_y == 0] = 0
+    y[port_y == dim.y - 1] = coarse_dim.y - 1
+
+    coarse_x = np.zeros(len(port_x), dtype=np.int32)
+    coarse_y = np.zeros(len(port_y), dtype=np.int32)
+
+    # Ports that land on the same slot walk along the perimeter to the next free one
+    for port, (slot_x, slot_y) in enumerate(zip(x.tolist(), y.tolist())):
+        index = slot_index.get((int(slot_x), int(slot_y)), 0)
+
+        while taken[index]:
+            index = (index + 1) % num_slots
+
+        taken[index] = True
+        coarse_x[port], coarse_y[port] = slots[index].x, slots[index].y
+
+    return coarse_x, coarse_y
+
+
+def create_coarse_grid(
+    grid: GatesGrid, level: PlacementLevel, coarse_dim: Dim
+) -> GatesGrid:
+    ports = np.flatnonzero(level.port_ids != -1)
+    movable = np.flatnonzero(level.port_ids == -1)
+
+    real_x, real_y = grid.placement
+    port_x, port_y = get_coarse_port_positions(
+        grid.dim,
+        coarse_dim,
+        real_x[level.port_ids[ports]],
+        real_y[level.port_ids[ports]],
+    )
+
+    pos_x = np.zeros(len(level.gates), dtype=np.int32)
+    pos_y = np.zeros(len(level.gates), dtype=np.int32)
+    pos_x[ports], pos_y[ports] = port_x, port_y
+
+    cells = np.random.choice(
+        (coarse_dim.x - 2) * (coarse_dim.y - 2), len(movable), replace=False
+    )
+    pos_x[movable] = 1 + cells // (coarse_dim.y - 2)
+    pos_y[movable] = 1 + cells % (coarse_dim.y - 2)
+
+    return GatesGrid(coarse_dim, level.gates, level.netlist, placement=(pos_x, pos_y))
+
+
+def place_multilevel(
+    grid: GatesGrid,
+    refine_temp: float = 1.0,
+    refine_steps_per_gate: int = 10,
+    coarse_moves_per_temp_factor: float = 0.25,
+    batch_size: int = 64,
+) -> None:
+    log.info("Running multilevel placement")
+
+    area = np.array([gate.dim.x * gate.dim.y for gate in grid.gates], dtype=float)
+    is_port = np.array([gate.is_port for gate in grid.gates], dtype=bool)
+    movable_area = float(area[~is_port].sum())
+    num_ports = int(is_port.sum())
+
+    port_ids = np.where(is_port, np.arange(len(grid.gates)), -1)
+    levels = [PlacementLevel(grid.gates, grid.netlist, area, port_ids)]
+
+    while True:
+        num_movable = len(levels[-1].gates) - num_ports
+
+        if num_movable <= COARSEST_GATES:
+            break
+
+        level = coarsen_level(levels[-1])
+
+        if num_movable < MIN_COARSEN_RATIO * (len(level.gates) - num_ports):
+            levels[-1].cluster_of = None
+            break
+
+        levels.append(level)
+
+    log.info(
+        f"Coarsened {len(grid.gates)} gates over {len(levels)} levels"
+        + f" down to {len(levels[-1].gates)}"
+    )
+
+    # The coarsest level is annealed globally, every finer level starts from the
+    # placement of its clusters and only refines it at a low temperature
+    parent_grid = grid
+
+    for depth in range(len(levels) - 1, -1, -1):
+        level = levels[depth]
+        num_movable = len(level.gates) - num_ports
+
+        if depth == 0:
+            level_grid = grid
+        else:
+            level_dim = get_coarse_dim(grid.dim, movable_area, num_movable, num_ports)
+            level_grid = create_coarse_grid(grid, level, level_dim)
+
+        if depth == len(levels) - 1:
+            AdaptiveAnnealingPlacer(
+                moves_per_temp_factor=coarse_moves_per_temp_factor,
+                batch_size=batch_size,
+                range_limit=True,
+            ).run(level_grid)
+            parent_grid = level_grid
+            continue
+
+        if level.cluster_of is None:
+            log.error("Multilevel placement is missing a cluster map")
+            raise ValueError
+
+        parent_x, parent_y = parent_grid.placement
+        target_x = scale_coords(
+            parent_x[level.cluster_of], parent_grid.dim.x, level_grid.dim.x
+        )
+        target_y = scale_coords(
+            parent_y[level.cluster_of], parent_grid.dim.y, level_grid.dim.y
+        )
+        level_grid.legalize(target_x, target_y)
+
+        AnnealingPlacer(
+            init_temp=refine_temp,
+            min_temp=0,
+            max_steps=refine_steps_per_gate * num_movable,
+            batch_size=batch_size,
+            range_limit=True,
+        ).run(level_grid)
+
+        log.info(
+            f"Refined level {depth} with {num_movable} gates cost={level_grid.cost}"
+        )
+        parent_grid = level_grid
+
+    log.info(f"Multilevel placement cost={grid.cost}")
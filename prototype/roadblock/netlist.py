@@ -1,6 +1,8 @@
-from typing import Any
+from typing import Any, Iterable, Iterator
 from dataclasses import dataclass
-from enum import Enum
+from enum import Enum, IntEnum
+
+import numpy as np
 
 from roadblock.dim import Dim
 
@@ -9,6 +11,8 @@ from roadblock import log
 
 GateType = Enum("GateType", ["BUFF", "NOT", "DFF", "IN", "OUT"])
 
+PinRole = IntEnum("PinRole", ["INPUT", "OUTPUT", "CLK"])
+
 
 @dataclass
 class MinecraftGate:
@@ -52,6 +56,15 @@ class MinecraftGate:
     def clk_coords(self) -> Dim:
         raise ValueError(f"Expected clk coords for {self.gate_type}")
 
+    def pin_coords(self, role: PinRole) -> Dim:
+        if role == PinRole.INPUT:
+            return self.in_coords
+
+        if role == PinRole.OUTPUT:
+            return self.out_coords
+
+        return self.clk_coords
+
     @property
     def is_port(self) -> bool:
         return self.gate_type == GateType.IN or self.gate_type == GateType.OUT
@@ -77,10 +90,41 @@ def get_gate_type(yosys_type: str) -> GateType:
     raise KeyError
 
 
-def construct_nor_inputs_equals_list(
+def find_net_root(parents: dict[int, int], net_id: int) -> int:
+    while parents[net_id] != net_id:
+        # Path halving, point every other node on the path to its grandparent
+        parents[net_id] = parents[parents[net_id]]
+        net_id = parents[net_id]
+
+    return net_id
+
+
+def union_nets(
+    parents: dict[int, int], sizes: dict[int, int], lhs: int, rhs: int
+) -> None:
+    for net_id in (lhs, rhs):
+        if net_id not in parents:
+            parents[net_id] = net_id
+            sizes[net_id] = 1
+
+    lhs_root = find_net_root(parents, lhs)
+    rhs_root = find_net_root(parents, rhs)
+
+    if lhs_root == rhs_root:
+        return
+
+    if sizes[lhs_root] < sizes[rhs_root]:
+        lhs_root, rhs_root = rhs_root, lhs_root
+
+    parents[rhs_root] = lhs_root
+    sizes[lhs_root] += sizes[rhs_root]
+
+
+def construct_nor_inputs_disjoint_set(
     data: dict[str, Any], module: str
-) -> list[list[int]]:
-    equals_list: list[list[int]] = []
+) -> dict[int, int]:
+    parents: dict[int, int] = {}
+    sizes: dict[int, int] = {}
 
     for yosys_gate in data["modules"][module]["cells"].values():
         yosys_type = yosys_gate["type"]
@@ -89,37 +133,27 @@ def construct_nor_inputs_equals_list(
         if yosys_type != "NOR":
             continue
 
-        lhs = yosys_connection["A"][0]
-        rhs = yosys_connection["B"][0]
-
-        already_exists = False
-
-        for existing_entry in equals_list:
-            if lhs in existing_entry or rhs in existing_entry:
-                existing_entry.append(lhs)
-                existing_entry.append(rhs)
-                already_exists = True
+        union_nets(parents, sizes, yosys_connection["A"][0], yosys_connection["B"][0])
 
-        if not already_exists:
-            equals_list.append([lhs, rhs])
-
-    return equals_list
+    return parents
 
 
 def construct_nor_inputs_rename_map(
     data: dict[str, Any], module: str
 ) -> dict[int, int]:
-    equals_list = construct_nor_inputs_equals_list(data, module)
+    parents = construct_nor_inputs_disjoint_set(data, module)
+    return construct_rename_map_from_disjoint_set(parents)
 
-    rename_map: dict[int, int] = {}
 
-    for equals_entry in equals_list:
-        rename_to = min(equals_entry)
+def construct_rename_map_from_disjoint_set(parents: dict[int, int]) -> dict[int, int]:
+    # Every net in a group is renamed to the smallest net id of the group
+    rename_to_map: dict[int, int] = {}
 
-        for rename_from in equals_entry:
-            rename_map[rename_from] = rename_to
+    for net_id in parents:
+        root = find_net_root(parents, net_id)
+        rename_to_map[root] = min(rename_to_map.get(root, net_id), net_id)
 
-    return rename_map
+    return {net_id: rename_to_map[find_net_root(parents, net_id)] for net_id in parents}
 
 
 def net_id_list_to_renamed_set(nets: list[int], rename_map: dict[int, int]) -> set[int]:
@@ -159,87 +193,242 @@ def extract_nets_from_yosys_cell(
     )
 
 
+@dataclass
+class Netlist:
+    # Yosys net id of every net index
+    net_ids: np.ndarray
+
+    # Pins of net i are net_pin_offsets[i] to net_pin_offsets[i + 1]
+    net_pin_offsets: np.ndarray
+    pin_gate_ids: np.ndarray
+    pin_roles: np.ndarray
+
+    # Nets of gate i are gate_net_offsets[i] to gate_net_offsets[i + 1]
+    gate_net_offsets: np.ndarray
+    gate_net_indices: np.ndarray
+
+    @property
+    def num_nets(self) -> int:
+        return len(self.net_ids)
+
+    @property
+    def num_gates(self) -> int:
+        return len(self.gate_net_offsets) - 1
+
+    @property
+    def num_pins(self) -> int:
+        return len(self.pin_gate_ids)
+
+    @property
+    def pin_net_indices(self) -> np.ndarray:
+        return np.repeat(
+            np.arange(self.num_nets, dtype=np.int32), np.diff(self.net_pin_offsets)
+        )
+
+    def gates_of_net(self, net: int) -> np.ndarray:
+        start, end = self.net_pin_offsets[net], self.net_pin_offsets[net + 1]
+        return self.pin_gate_ids[start:end]
+
+    def roles_of_net(self, net: int) -> np.ndarray:
+        start, end = self.net_pin_offsets[net], self.net_pin_offsets[net + 1]
+        return self.pin_roles[start:end]
+
+    def nets_of_gate(self, gate_id: int) -> np.ndarray:
+        start, end = self.gate_net_offsets[gate_id], self.gate_net_offsets[gate_id + 1]
+        return self.gate_net_indices[start:end]
+
+    def pins(self, net: int) -> Iterator[tuple[int, PinRole]]:
+        for gate_id, role in zip(self.gates_of_net(net), self.roles_of_net(net)):
+            yield int(gate_id), PinRole(role)
+
+
+def offsets_from_counts(counts: np.ndarray) -> np.ndarray:
+    offsets = np.zeros(len(counts) + 1, dtype=np.int32)
+    np.cumsum(counts, out=offsets[1:])
+
+    return offsets
+
+
+def construct_netlist_from_pins(
+    pin_net_ids: np.ndarray,
+    pin_gate_ids: np.ndarray,
+    pin_roles: np.ndarray,
+    num_gates: int,
+) -> Netlist:
+    net_ids, pin_nets = np.unique(pin_net_ids, return_inverse=True)
+    pin_nets = pin_nets.reshape(-1)
+    num_nets = len(net_ids)
+
+    pin_order = np.argsort(pin_nets, kind="stable")
+    net_pin_offsets = offsets_from_counts(np.bincount(pin_nets, minlength=num_nets))
+
+    gate_net_keys = np.unique(pin_gate_ids.astype(np.int64) * num_nets + pin_nets)
+    gate_net_gates = gate_net_keys // max(num_nets, 1)
+    gate_net_offsets = offsets_from_counts(
+        np.bincount(gate_net_gates, minlength=num_gates)
+    )
+
+    return Netlist(
+        net_ids=net_ids.astype(np.int64),
+        net_pin_offsets=net_pin_offsets,
+        pin_gate_ids=pin_gate_ids[pin_order].astype(np.int32),
+        pin_roles=pin_roles[pin_order].astype(np.int8),
+        gate_net_offsets=gate_net_offsets,
+        gate_net_indices=(gate_net_keys % max(num_nets, 1)).astype(np.int32),
+    )
+
+
+def construct_netlist(gates: list[MinecraftGate]) -> Netlist:
+    pin_net_ids: list[int] = []
+    pin_gate_ids: list[int] = []
+    pin_roles: list[int] = []
+
+    for gate_id, gate in enumerate(gates):
+        for role, nets in (
+            (PinRole.INPUT, gate.inputs),
+            (PinRole.OUTPUT, gate.outputs),
+            (PinRole.CLK, gate.clk_inputs),
+        ):
+            for net_id in nets:
+                pin_net_ids.append(net_id)
+                pin_gate_ids.append(gate_id)
+                pin_roles.append(role)
+
+    return construct_netlist_from_pins(
+        np.array(pin_net_ids, dtype=np.int64),
+        np.array(pin_gate_ids, dtype=np.int32),
+        np.array(pin_roles, dtype=np.int8),
+        len(gates),
+    )
+
+
+def construct_gates_from_netlist(
+    names: list[str], gate_types: list[GateType], netlist: Netlist
+) -> list[MinecraftGate]:
+    gates = [
+        MinecraftGate(
+            name=name,
+            gate_type=gate_type,
+            inputs=set(),
+            outputs=set(),
+            clk_inputs=set(),
+        )
+        for name, gate_type in zip(names, gate_types)
+    ]
+
+    pin_net_ids = netlist.net_ids[netlist.pin_net_indices]
+
+    for net_id, gate_id, role in zip(
+        pin_net_ids.tolist(),
+        netlist.pin_gate_ids.tolist(),
+        netlist.pin_roles.tolist(),
+    ):
+        gate = gates[gate_id]
+
+        if role == PinRole.INPUT:
+            gate.inputs.add(net_id)
+        elif role == PinRole.OUTPUT:
+            gate.outputs.add(net_id)
+        else:
+            gate.clk_inputs.add(net_id)
+
+    return gates
+
+
+def yosys_cell_to_minecraft_gate(
+    yosys_name: str, yosys_gate: dict[str, Any], rename_map: dict[int, int]
+) -> MinecraftGate:
+    yosys_type = yosys_gate["type"]
+    yosys_connection = yosys_gate["connections"]
+
+    input_nets, clk_nets, output_nets = extract_nets_from_yosys_cell(
+        yosys_type, yosys_connection, rename_map
+    )
+
+    return MinecraftGate(
+        name=yosys_name.split("$")[-1],
+        gate_type=get_gate_type(yosys_type),
+        inputs=input_nets,
+        outputs=output_nets,
+        clk_inputs=clk_nets,
+    )
+
+
+def yosys_port_to_minecraft_gate(
+    port_name: str, yosys_port: dict[str, Any], rename_map: dict[int, int]
+) -> MinecraftGate:
+    gate_type = get_gate_type(yosys_port["direction"])
+    gate_nets = net_id_list_to_renamed_set(yosys_port["bits"], rename_map)
+
+    if gate_type == GateType.IN:
+        return MinecraftGate(
+            name=port_name,
+            gate_type=gate_type,
+            inputs=set(),
+            outputs=gate_nets,
+            clk_inputs=set(),
+        )
+
+    return MinecraftGate(
+        name=port_name,
+        gate_type=gate_type,
+        inputs=gate_nets,
+        outputs=set(),
+        clk_inputs=set(),
+    )
+
+
+def rename_gate_nets_inplace(
+    gates: list[MinecraftGate], rename_map: dict[int, int]
+) -> None:
+    for gate in gates:
+        gate.inputs = net_id_list_to_renamed_set(list(gate.inputs), rename_map)
+        gate.outputs = net_id_list_to_renamed_set(list(gate.outputs), rename_map)
+        gate.clk_inputs = net_id_list_to_renamed_set(list(gate.clk_inputs), rename_map)
+
+
 def yosys_to_minecraft_gates(
     data: dict[str, Any],
     module: str,
-) -> tuple[list[MinecraftGate], dict[int, set[int]]]:
+) -> tuple[list[MinecraftGate], Netlist]:
     gates: list[MinecraftGate] = []
 
-    # Given a net id, what gates take this net as input or clk or output
-    net_list: dict[int, set[int]] = {}
     rename_map = construct_nor_inputs_rename_map(data, module)
 
-    def append_to_netlist(nets: set[int], gate_id: int) -> None:
-        for net_id in nets:
-            try:
-                net_list[net_id].add(gate_id)
-            except KeyError:
-                net_list[net_id] = set([gate_id])
-
     for yosys_name, yosys_gate in data["modules"][module]["cells"].items():
-        gate_id = len(gates)
+        gates.append(yosys_cell_to_minecraft_gate(yosys_name, yosys_gate, rename_map))
 
-        yosys_type = yosys_gate["type"]
-        yosys_connection = yosys_gate["connections"]
+    for port_name, yosys_port in data["modules"][module]["ports"].items():
+        gates.append(yosys_port_to_minecraft_gate(port_name, yosys_port, rename_map))
 
-        input_nets, clk_nets, output_nets = extract_nets_from_yosys_cell(
-            yosys_type, yosys_connection, rename_map
-        )
+    return gates, construct_netlist(gates)
 
-        append_to_netlist(input_nets, gate_id)
-        append_to_netlist(clk_nets, gate_id)
-        append_to_netlist(output_nets, gate_id)
-
-        gates.append(
-            MinecraftGate(
-                name=yosys_name.split("$")[-1],
-                gate_type=get_gate_type(yosys_type),
-                inputs=input_nets,
-                outputs=output_nets,
-                clk_inputs=clk_nets,
-            )
-        )
 
-    for port_name, yosys_port in data["modules"][module]["ports"].items():
-        gate_id = len(gates)
-
-        gate_type = get_gate_type(yosys_port["direction"])
-        gate_nets = net_id_list_to_renamed_set(yosys_port["bits"], rename_map)
-
-        append_to_netlist(gate_nets, gate_id)
-
-        if gate_type == GateType.IN:
-            gates.append(
-                MinecraftGate(
-                    name=port_name,
-                    gate_type=gate_type,
-                    inputs=set(),
-                    outputs=gate_nets,
-                    clk_inputs=set(),
-                )
-            )
-        else:
-            gates.append(
-                MinecraftGate(
-                    name=port_name,
-                    gate_type=gate_type,
-                    inputs=gate_nets,
-                    outputs=set(),
-                    clk_inputs=set(),
-                )
-            )
-
-    return gates, net_list
-
-
-def construct_reverse_netlist(netlist: dict[int, set[int]]) -> dict[int, set[int]]:
-    reverse_netlist: dict[int, set[int]] = {}
-
-    for net_id, gate_ids in netlist.items():
-        for gate_id in gate_ids:
-            try:
-                reverse_netlist[gate_id].add(net_id)
-            except KeyError:
-                reverse_netlist[gate_id] = set([net_id])
-
-    return reverse_netlist
+def yosys_stream_to_minecraft_gates(
+    items: Iterable[tuple[str, str, dict[str, Any]]],
+) -> tuple[list[MinecraftGate], Netlist]:
+    gates: list[MinecraftGate] = []
+    ports: list[tuple[str, dict[str, Any]]] = []
+
+    parents: dict[int, int] = {}
+    sizes: dict[int, int] = {}
+
+    # Items arrive as ("ports" | "cells", name, value) in file order, NOR groups
+    # are only known once every cell is seen so nets are renamed at the end
+    for section, name, value in items:
+        if section == "ports":
+            ports.append((name, value))
+            continue
+
+        if value["type"] == "NOR":
+            connection = value["connections"]
+            union_nets(parents, sizes, connection["A"][0], connection["B"][0])
+
+        gates.append(yosys_cell_to_minecraft_gate(name, value, {}))
+
+    for port_name, yosys_port in ports:
+        gates.append(yosys_port_to_minecraft_gate(port_name, yosys_port, {}))
+
+    rename_gate_nets_inplace(gates, construct_rename_map_from_disjoint_set(parents))
+
+    return gates, construct_netlist(gates)
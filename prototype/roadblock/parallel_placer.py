@@ -0,0 +1,253 @@
+import os
+import random
+from math import exp
+from typing import Callable
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from roadblock.dim import Dim
+from roadblock.grid import GatesGrid, CongestionParams
+from roadblock.netlist import MinecraftGate, Netlist
+from roadblock.placer import Placer, AnnealingPlacer
+from roadblock import log
+
+
+worker_grid_args: (
+    tuple[Dim, list[MinecraftGate], Netlist, CongestionParams | None] | None
+) = None
+
+
+def init_worker(
+    dim: Dim,
+    gates: list[MinecraftGate],
+    netlist: Netlist,
+    congestion: CongestionParams | None,
+) -> None:
+    global worker_grid_args
+    worker_grid_args = (dim, gates, netlist, congestion)
+
+    log.disable_info()
+
+
+def anneal_replica(
+    gate_pos_x: np.ndarray,
+    gate_pos_y: np.ndarray,
+    temp: float,
+    steps: int,
+    batch_size: int,
+    seed: int,
+) -> tuple[np.ndarray, np.ndarray, float]:
+    if worker_grid_args is None:
+        log.error("Parallel placer worker was not initialized")
+        raise ValueError
+
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+
+    dim, gates, netlist, congestion = worker_grid_args
+    grid = GatesGrid(
+        dim,
+        gates,
+        netlist,
+        placement=(gate_pos_x, gate_pos_y),
+        congestion=congestion,
+    )
+
+    placer = AnnealingPlacer(
+        init_temp=temp,
+        min_temp=temp,
+        max_steps=steps + 1,
+        batch_size=batch_size,
+    )
+    placer.run(grid, callback_every=steps + 1)
+
+    return *grid.placement, grid.cost
+
+
+def get_temp_ladder(num_replicas: int, min_temp: float, max_temp: float) -> list[float]:
+    if num_replicas == 1:
+        return [min_temp]
+
+    ratio = max_temp / min_temp
+    return [min_temp * ratio ** (i / (num_replicas - 1)) for i in range(num_replicas)]
+
+
+class ParallelTemperingPlacer(Placer):
+    def __init__(
+        self,
+        num_replicas: int,
+        min_temp: float,
+        max_temp: float,
+        max_steps: int,
+        steps_per_exchange: int,
+        batch_size: int = 1,
+        exchange: bool = True,
+        num_workers: int | None = None,
+        seed: int | None = None,
+    ) -> None:
+        super().__init__()
+
+        if min_temp <= 0:
+            log.error("Parallel tempering needs a positive min temp")
+            raise ValueError
+
+        self._max_steps = max_steps
+        self._steps_per_exchange = steps_per_exchange
+        self._batch_size = batch_size
+        self._exchange = exchange
+        self._num_workers = num_workers or min(num_replicas, os.cpu_count() or 1)
+        self._seed = random.randrange(2**31) if seed is None else seed
+
+        self._temps = get_temp_ladder(num_replicas, min_temp, max_temp)
+        self._replicas: list[tuple[np.ndarray, np.ndarray]] = []
+        self._replica_costs: list[float] = []
+
+        self._executor: ProcessPoolExecutor | None = None
+        self._rounds = 0
+        self._exchanges = 0
+
+        self._graph_best_costs: list[float] = []
+        self._graph_replica_costs: list[list[float]] = []
+
+        log.info(f"Parallel tempering placer initialized with {num_replicas} replicas")
+
+    @property
+    def is_complete(self) -> bool:
+        return self._steps >= self._max_steps
+
+    def update(self, grid: GatesGrid) -> bool:
+        if self.is_complete:
+            log.info("Parallel tempering complete")
+            self.plot_graph()
+            return True
+
+        self._step(grid)
+        self.update_graph()
+
+        return False
+
+    def run(
+        self,
+        grid: GatesGrid,
+        max_steps: int | None = None,
+        time_budget: float | None = None,
+        callback: Callable[[Placer], None] | None = None,
+        callback_every: int = 1000,
+    ) -> None:
+        # Runs that end on max_steps, the time budget or an error still have to
+        # shut the workers down, a later run starts them again from the grid
+        try:
+            super().run(grid, max_steps, time_budget, callback, callback_every)
+        finally:
+            self._stop()
+
+    def _start(self, grid: GatesGrid) -> None:
+        self._executor = ProcessPoolExecutor(
+            max_workers=self._num_workers,
+            mp_context=get_context("spawn"),
+            initializer=init_worker,
+            initargs=(grid.dim, grid.gates, grid.netlist, grid.congestion),
+        )
+
+        self._replicas = [grid.placement for _ in self._temps]
+        self._replica_costs = [grid.cost for _ in self._temps]
+        self._cost = self._best_cost = grid.cost
+
+    def _stop(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _step(self, grid: GatesGrid) -> None:
+        if self._executor is None:
+            self._start(grid)
+
+        if self._executor is None:
+            return
+
+        futures = [
+            self._executor.submit(
+                anneal_replica,
+                gate_pos_x,
+                gate_pos_y,
+                temp,
+                self._steps_per_exchange,
+                self._batch_size,
+                self._seed + self._rounds * len(self._temps) + replica,
+            )
+            for replica, ((gate_pos_x, gate_pos_y), temp) in enumerate(
+                zip(self._replicas, self._temps)
+            )
+        ]
+
+        for replica, future in enumerate(futures):
+            gate_pos_x, gate_pos_y, cost = future.result()
+            self._replicas[replica] = (gate_pos_x, gate_pos_y)
+            self._replica_costs[replica] = cost
+
+        if self._exchange:
+            self._exchange_replicas()
+
+        self._rounds += 1
+        self._steps += self._steps_per_exchange * len(self._temps)
+
+        best_replica = int(np.argmin(self._replica_costs))
+        self._cost = self._replica_costs[best_replica]
+
+        # The grid always holds the best placement seen so far
+        if self._cost < self._best_cost:
+            self._best_cost = self._cost
+            grid.set_placement(*self._replicas[best_replica])
+
+        if self.is_complete:
+            self._stop()
+
+    def _exchange_replicas(self) -> None:
+        # Alternate between even and odd neighbour pairs every round
+        for low in range(self._rounds % 2, len(self._temps) - 1, 2):
+            high = low + 1
+
+            d_beta = 1 / self._temps[low] - 1 / self._temps[high]
+            d_cost = self._replica_costs[low] - self._replica_costs[high]
+
+            if d_beta * d_cost < 0 and random.random() >= exp(d_beta * d_cost):
+                continue
+
+            self._replicas[low], self._replicas[high] = (
+                self._replicas[high],
+                self._replicas[low],
+            )
+            self._replica_costs[low], self._replica_costs[high] = (
+                self._replica_costs[high],
+                self._replica_costs[low],
+            )
+            self._exchanges += 1
+
+    @property
+    def hud_string(self) -> str:
+        return (
+            f"cost={self._cost} best={self._best_cost} rounds={self._rounds}"
+            + f" steps={self._steps} exchanges={self._exchanges}"
+        )
+
+    def update_graph(self) -> None:
+        self._graph_best_costs.append(self._best_cost)
+        self._graph_replica_costs.append(list(self._replica_costs))
+
+    def plot_graph(self) -> None:
+        log.info("Plotting performance graph")
+
+        fig, [ax1, ax2] = plt.subplots(2, 1, sharex=True, figsize=(8, 4))
+
+        ax1.plot(self._graph_best_costs)
+        ax1.set(ylabel="Best cost")
+        ax1.grid(True)
+
+        ax2.plot(self._graph_replica_costs)
+        ax2.set(ylabel="Replica costs", xlabel="Rounds")
+        ax2.grid(True)
+
+        plt.show(block=False)
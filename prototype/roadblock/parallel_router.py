@@ -0,0 +1,174 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from roadblock.dim import Dim
+from roadblock.grid import GatesGrid
+from roadblock.router import (
+    SearchBuffers,
+    construct_routes,
+    create_router_grid,
+    get_pin_mask,
+    get_pin_sharers,
+    route_with_rip_up,
+    search_route_window,
+)
+from roadblock.steiner import order_routes
+from roadblock import log
+
+
+WINDOW_MARGIN = 4
+
+Window = tuple[int, int, int, int]
+
+worker_grid_args: tuple[SharedMemory, np.ndarray, np.ndarray] | None = None
+worker_buffers: SearchBuffers | None = None
+
+
+def init_worker(shm_name: str, shape: tuple[int, ...], pin_mask: np.ndarray) -> None:
+    global worker_grid_args, worker_buffers
+
+    # The shared memory has to stay referenced for as long as the grid is used
+    shm = SharedMemory(name=shm_name)
+    router_grid: np.ndarray = np.ndarray(shape, dtype=np.int32, buffer=shm.buf)
+    worker_grid_args = (shm, router_grid, pin_mask)
+    worker_buffers = SearchBuffers(router_grid.size)
+
+    log.disable_info()
+
+
+def get_route_window(points: list[Dim], dim: Dim, margin: int) -> Window:
+    min_x = max(min(point.x for point in points) - margin, 0)
+    min_y = max(min(point.y for point in points) - margin, 0)
+    max_x = min(max(point.x for point in points) + margin + 1, dim.x)
+    max_y = min(max(point.y for point in points) + margin + 1, dim.y)
+
+    return min_x, max_x, min_y, max_y
+
+
+def route_window(
+    points: list[Dim], window: Window, shared_ids: set[int]
+) -> np.ndarray | None:
+    # Nets only see their own window, so nets with disjoint windows can be routed
+    # at the same time
+    if worker_grid_args is None or worker_buffers is None:
+        log.error("Parallel router worker was not initialized")
+        raise ValueError
+
+    _, router_grid, pin_mask = worker_grid_args
+
+    return search_route_window(
+        router_grid,
+        points,
+        window,
+        worker_buffers,
+        pin_mask=pin_mask,
+        shared_ids=shared_ids,
+        ordered=True,
+    )
+
+
+def get_route_batches(
+    route_ids: list[int], windows: dict[int, Window], dim: Dim
+) -> list[list[int]]:
+    # Greedily fills every batch in route order with nets whose windows do not
+    # overlap any window already in it, the rest wait for a later batch
+    batches: list[list[int]] = []
+    pending = route_ids
+
+    while len(pending) != 0:
+        covered = np.zeros((dim.x, dim.y), dtype=bool)
+        batch: list[int] = []
+        deferred: list[int] = []
+
+        for route_id in pending:
+            min_x, max_x, min_y, max_y = windows[route_id]
+
+            if covered[min_x:max_x, min_y:max_y].any():
+                deferred.append(route_id)
+                continue
+
+            covered[min_x:max_x, min_y:max_y] = True
+            batch.append(route_id)
+
+        batches.append(batch)
+        pending = deferred
+
+    return batches
+
+
+def route_parallel(
+    grid: GatesGrid,
+    max_layers: int,
+    num_workers: int | None = None,
+    margin: int = WINDOW_MARGIN,
+) -> None:
+    # Nets in a batch have disjoint windows so they are routed concurrently into a
+    # shared router grid. Batches are committed in order, which makes the result
+    # independent of the number of workers. Nets that do not fit their window are
+    # routed with rip-up on the full grid at the end
+    router_grid = create_router_grid(grid.dim, max_layers)
+    routes = order_routes(construct_routes(grid))
+    pin_mask = get_pin_mask(routes, router_grid.shape)
+    pin_sharers = get_pin_sharers(routes, router_grid.shape)
+
+    windows = {
+        route_id: get_route_window(points, grid.dim, margin)
+        for route_id, points in routes.items()
+    }
+    batches = get_route_batches(list(routes.keys()), windows, grid.dim)
+    num_workers = num_workers or os.cpu_count() or 1
+
+    log.info(
+        f"Routing {len(routes)} routes in {len(batches)} batches"
+        + f" with {num_workers} workers"
+    )
+
+    route_cells: dict[int, np.ndarray] = {}
+    failed_ids: list[int] = []
+
+    shm = SharedMemory(create=True, size=router_grid.nbytes)
+
+    try:
+        shared_grid: np.ndarray = np.ndarray(
+            router_grid.shape, dtype=router_grid.dtype, buffer=shm.buf
+        )
+        shared_grid[:] = router_grid
+
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=get_context("spawn"),
+            initializer=init_worker,
+            initargs=(shm.name, router_grid.shape, pin_mask),
+        ) as executor:
+            for batch in batches:
+                results = executor.map(
+                    route_window,
+                    [routes[route_id] for route_id in batch],
+                    [windows[route_id] for route_id in batch],
+                    [pin_sharers[route_id] for route_id in batch],
+                    chunksize=max(len(batch) // (num_workers * 4), 1),
+                )
+
+                for route_id, cells in zip(batch, results):
+                    if cells is None:
+                        failed_ids.append(route_id)
+                        continue
+
+                    route_cells[route_id] = cells
+                    shared_grid.reshape(-1)[cells] = route_id
+
+        router_grid[:] = shared_grid
+        del shared_grid
+    finally:
+        shm.close()
+        shm.unlink()
+
+    log.info(f"Routing {len(failed_ids)} routes that did not fit their window")
+
+    route_with_rip_up(
+        router_grid, routes, failed_ids, pin_mask, pin_sharers, route_cells
+    )
@@ -1,7 +1,11 @@
+import sys
+import time
 from math import inf, exp
 from random import random
 from abc import ABC, abstractmethod
+from typing import Callable
 
+import numpy as np
 import matplotlib.pyplot as plt
 
 from roadblock.grid import GatesGrid
@@ -21,10 +25,75 @@ class Placer(ABC):
     def hud_string(self) -> str:
         pass
 
+    @property
+    @abstractmethod
+    def is_complete(self) -> bool:
+        pass
+
+    @property
+    def steps(self) -> int:
+        return self._steps
+
+    @property
+    def cost(self) -> float:
+        return self._cost
+
+    @property
+    def best_cost(self) -> float:
+        return self._best_cost
+
     @abstractmethod
     def update(self, grid: GatesGrid) -> bool:
         pass
 
+    @abstractmethod
+    def _step(self, grid: GatesGrid) -> None:
+        pass
+
+    @abstractmethod
+    def update_graph(self) -> None:
+        pass
+
+    def run(
+        self,
+        grid: GatesGrid,
+        max_steps: int | None = None,
+        time_budget: float | None = None,
+        callback: Callable[["Placer"], None] | None = None,
+        callback_every: int = 1000,
+    ) -> None:
+        # Graph, callback and time budget are only looked at every callback_every
+        # steps so the inner loop is just the placement moves
+        start_time = time.perf_counter()
+        end_steps = inf if max_steps is None else self._steps + max_steps
+        next_callback_steps = self._steps + callback_every
+
+        log.info("Running placer headless")
+
+        while not self.is_complete and self._steps < end_steps:
+            self._step(grid)
+
+            if self._steps < next_callback_steps:
+                continue
+
+            next_callback_steps = self._steps + callback_every
+            self.update_graph()
+
+            if callback is not None:
+                callback(self)
+
+            if (
+                time_budget is not None
+                and time.perf_counter() - start_time >= time_budget
+            ):
+                log.info("Placer time budget exhausted")
+                break
+
+        log.info(
+            f"Placer stopped after {self._steps} steps"
+            + f" in {round(time.perf_counter() - start_time, 3)}s"
+        )
+
     def _update_cost(
         self, new_cost: float, a: int, a_pos: Dim, b: int, b_pos: Dim
     ) -> None:
@@ -48,12 +117,22 @@ class RandomPlacer(Placer):
 
         log.info("Random placer initialized")
 
+    @property
+    def is_complete(self) -> bool:
+        return self._steps >= self._max_steps - 1
+
     def update(self, grid: GatesGrid) -> bool:
-        if self._steps >= self._max_steps - 1:
+        if self.is_complete:
             log.info("Random placement complete")
             self.plot_graph()
             return True
 
+        self._step(grid)
+        self.update_graph()
+
+        return False
+
+    def _step(self, grid: GatesGrid) -> None:
         a, a_pos, b, b_pos = grid.mutate()
         new_cost = grid.cost
 
@@ -64,10 +143,9 @@ class RandomPlacer(Placer):
 
         self._steps += 1
 
+    def update_graph(self) -> None:
         self._graph_costs.append(self._cost)
 
-        return False
-
     @property
     def hud_string(self) -> str:
         return f"cost={self._cost} swaps={self._swaps} steps={self._steps}"
@@ -85,14 +163,34 @@ class RandomPlacer(Placer):
 
 
 class AnnealingPlacer(Placer):
+    WINDOW_UPDATE_MOVES = 200
+
     def __init__(
         self,
         init_temp: float,
         min_temp: float,
         max_steps: int,
+        batch_size: int = 1,
+        range_limit: bool = False,
+        target_accept_rate: float = 0.44,
     ) -> None:
         super().__init__()
         self._max_steps = max_steps
+        self._batch_size = batch_size
+
+        # VPR style range limiter, moves stay within a window around the gate that
+        # shrinks or grows to keep the accept rate near the target
+        self._range_limit = range_limit
+        self._target_accept_rate = target_accept_rate
+        self._window: float | None = None
+        self._max_window = 0.0
+        self._window_moves = 0
+        self._window_accepts = 0
+
+        self._stage_moves = 0
+        self._stage_accepts = 0
+        self._stage_uphill_moves = 0
+        self._stage_uphill_accepts = 0
 
         self._temp = init_temp
         self._init_temp = init_temp
@@ -107,14 +205,88 @@ class AnnealingPlacer(Placer):
 
         log.info("Annealing placer initialized")
 
+    @property
+    def is_complete(self) -> bool:
+        return self._steps >= self._max_steps - 1 or self._temp < self._min_temp
+
     def update(self, grid: GatesGrid) -> bool:
-        if self._steps >= self._max_steps - 1 or self._temp < self._min_temp:
+        if self.is_complete:
             log.info("Annealing complete")
             self.plot_graph()
             return True
 
-        a, a_pos, b, b_pos = grid.mutate()
+        self._step(grid)
+        self.update_graph()
+
+        return False
+
+    def _step(self, grid: GatesGrid) -> None:
+        if self._batch_size > 1:
+            num_steps = self._update_batch(grid)
+        else:
+            num_steps = self._update_single(grid)
+
+        self._update_temp()
+
+        self._steps += num_steps
+
+    def _update_temp(self) -> None:
+        self._temp = self._min_temp + self._d_temp * (
+            ((self._max_steps - self._steps) / self._max_steps) ** 2
+        )
+
+    @property
+    def window(self) -> int | None:
+        if not self._range_limit or self._window is None:
+            return None
+
+        return round(self._window)
+
+    def _init_window(self, grid: GatesGrid) -> None:
+        if not self._range_limit or self._window is not None:
+            return
+
+        self._max_window = float(max(grid.dim.x, grid.dim.y))
+        self._window = self._max_window
+
+    def _record_moves(
+        self,
+        num_moves: int,
+        num_accepts: int,
+        num_uphill_moves: int,
+        num_uphill_accepts: int,
+    ) -> None:
+        self._stage_moves += num_moves
+        self._stage_accepts += num_accepts
+        self._stage_uphill_moves += num_uphill_moves
+        self._stage_uphill_accepts += num_uphill_accepts
+
+        self._update_window(num_moves, num_accepts)
+
+    def _update_window(self, num_moves: int, num_accepts: int) -> None:
+        if self._window is None:
+            return
+
+        self._window_moves += num_moves
+        self._window_accepts += num_accepts
+
+        if self._window_moves < AnnealingPlacer.WINDOW_UPDATE_MOVES:
+            return
+
+        accept_rate = self._window_accepts / self._window_moves
+        self._window *= 1 - self._target_accept_rate + accept_rate
+        self._window = min(max(self._window, 1.0), self._max_window)
+
+        self._window_moves = 0
+        self._window_accepts = 0
+
+    def _update_single(self, grid: GatesGrid) -> int:
+        self._init_window(grid)
+
+        a, a_pos, b, b_pos = grid.mutate(self.window)
         new_cost = grid.cost
+        accepted = True
+        uphill = new_cost > self._cost
 
         if new_cost < self._cost:
             self._update_cost(new_cost, a, a_pos, b, b_pos)
@@ -126,15 +298,41 @@ class AnnealingPlacer(Placer):
                 self._update_cost(new_cost, a, a_pos, b, b_pos)
             else:
                 grid.undo_mutate(a, a_pos, b, b_pos)
+                accepted = False
 
-        self._temp = self._min_temp + self._d_temp * (
-            ((self._max_steps - self._steps) / self._max_steps) ** 2
+        self._record_moves(1, int(accepted), int(uphill), int(uphill and accepted))
+
+        return 1
+
+    def _update_batch(self, grid: GatesGrid) -> int:
+        self._init_window(grid)
+
+        moves = grid.propose_moves(self._batch_size, self.window)
+        d_costs = grid.get_moves_delta_cost(moves)
+
+        # Moves in a batch are independent so each one gets its own Metropolis test
+        with np.errstate(over="ignore"):
+            accept_probs = np.exp(-np.maximum(d_costs, 0) / max(self._temp, 1e-9))
+
+        accepted = np.random.random(moves.num_moves) < accept_probs
+        grid.apply_moves(moves, accepted)
+
+        uphill = d_costs > 0
+        if uphill.any():
+            self._accept_prob = float(accept_probs[uphill].mean())
+
+        self._record_moves(
+            moves.num_moves,
+            int(accepted.sum()),
+            int(uphill.sum()),
+            int((uphill & accepted).sum()),
         )
 
-        self._steps += 1
+        self._swaps += int(accepted.sum())
+        self._cost = grid.cost
+        self._best_cost = min(self._best_cost, self._cost)
 
-        self.update_graph()
-        return False
+        return max(moves.num_moves, 1)
 
     @property
     def hud_string(self) -> str:
@@ -142,6 +340,7 @@ class AnnealingPlacer(Placer):
             f"cost={self._cost} best={self._best_cost} swaps={self._swaps}"
             + f" steps={self._steps} temp={round(self._temp, 3)}"
             + f" accept_prob={round(self._accept_prob*100)}%"
+            + ("" if self.window is None else f" window={self.window}")
         )
 
     def update_graph(self) -> None:
@@ -167,3 +366,142 @@ class AnnealingPlacer(Placer):
         ax3.grid(True)
 
         plt.show(block=False)
+
+
+class AdaptiveAnnealingPlacer(AnnealingPlacer):
+    INIT_TEMP_SAMPLES = 500
+    MAX_MOVES_PER_GATE = 10.0
+
+    def __init__(
+        self,
+        max_steps: int | None = None,
+        moves_per_temp_factor: float = 1.0,
+        max_moves_per_gate: float | None = MAX_MOVES_PER_GATE,
+        stagnation_temps: int = 5,
+        stagnation_tol: float = 1e-3,
+        batch_size: int = 1,
+        range_limit: bool = False,
+        target_accept_rate: float = 0.44,
+    ) -> None:
+        super().__init__(
+            init_temp=0.0,
+            min_temp=0.0,
+            max_steps=max_steps or sys.maxsize,
+            batch_size=batch_size,
+            range_limit=range_limit,
+            target_accept_rate=target_accept_rate,
+        )
+
+        self._moves_per_temp_factor = moves_per_temp_factor
+        self._max_moves_per_gate = max_moves_per_gate
+        self._stagnation_temps = stagnation_temps
+        self._stagnation_tol = stagnation_tol
+
+        self._temp_initialized = False
+        self._moves_per_temp = 1
+        self._num_nets = 1
+
+        self._stage_best_cost = inf
+        self._stagnant_temps = 0
+        self._num_temps = 0
+
+    @property
+    def is_complete(self) -> bool:
+        if self._steps >= self._max_steps - 1:
+            return True
+
+        if not self._temp_initialized:
+            return False
+
+        if self._stagnant_temps >= self._stagnation_temps:
+            return True
+
+        # VPR exit criterion, the temperature is small against the cost of one net
+        return self._temp < 0.005 * self._cost / self._num_nets
+
+    def _step(self, grid: GatesGrid) -> None:
+        if not self._temp_initialized:
+            self._sample_init_temp(grid)
+
+        super()._step(grid)
+
+    def _sample_init_temp(self, grid: GatesGrid) -> None:
+        # Initial temperature is 20 standard deviations of random move deltas
+        d_costs: list[float] = []
+        num_samples = min(
+            AdaptiveAnnealingPlacer.INIT_TEMP_SAMPLES, max(grid.num_gates, 2)
+        )
+
+        for _ in range(num_samples):
+            old_cost = grid.cost
+            a, a_pos, b, b_pos = grid.mutate()
+            d_costs.append(grid.cost - old_cost)
+            grid.undo_mutate(a, a_pos, b, b_pos)
+
+        self._temp = 20 * float(np.std(d_costs)) or 1.0
+        self._init_temp = self._temp
+
+        # Moves per temperature scale with num_gates^(4/3) as in VPR. The number of
+        # temperatures barely grows with the design, so large designs are capped to
+        # a number of moves per gate to keep the whole anneal linear in num_gates
+        moves_per_temp = self._moves_per_temp_factor * grid.num_gates ** (4 / 3)
+
+        if self._max_moves_per_gate is not None:
+            max_moves_per_temp = self._max_moves_per_gate * grid.num_gates
+
+            if moves_per_temp > max_moves_per_temp:
+                log.info(
+                    f"Moves per temp capped at {self._max_moves_per_gate} per gate"
+                )
+                moves_per_temp = max_moves_per_temp
+
+        self._moves_per_temp = max(1, int(moves_per_temp))
+        self._num_nets = max(grid.netlist.num_nets, 1)
+        self._temp_initialized = True
+
+        log.info(
+            f"Adaptive annealing from temp={round(self._temp, 3)}"
+            + f" with {self._moves_per_temp} moves per temp"
+        )
+
+    def _update_temp(self) -> None:
+        if self._stage_moves < self._moves_per_temp:
+            return
+
+        accept_rate = self._stage_accepts / self._stage_moves
+
+        # Cool slowly while the accept rate is in the useful range, quickly outside
+        if accept_rate > 0.96:
+            alpha = 0.5
+        elif accept_rate > 0.8:
+            alpha = 0.9
+        elif accept_rate > 0.15:
+            alpha = 0.95
+        else:
+            alpha = 0.8
+
+        self._temp *= alpha
+        self._num_temps += 1
+
+        # Only a cold search that stopped improving counts as stagnant, hot
+        # temperatures wander above the best cost by design. Moves that do not
+        # change the cost are always accepted so only uphill moves tell the two apart
+        improved = self._best_cost < self._stage_best_cost * (1 - self._stagnation_tol)
+        uphill_accept_rate = self._stage_uphill_accepts / max(
+            self._stage_uphill_moves, 1
+        )
+
+        if improved or uphill_accept_rate > 0.15:
+            self._stagnant_temps = 0
+        else:
+            self._stagnant_temps += 1
+
+        self._stage_best_cost = min(self._stage_best_cost, self._best_cost)
+        self._stage_moves = 0
+        self._stage_accepts = 0
+        self._stage_uphill_moves = 0
+        self._stage_uphill_accepts = 0
+
+    @property
+    def hud_string(self) -> str:
+        return super().hud_string + f" temps={self._num_temps}"
@@ -0,0 +1,155 @@
+import re
+from itertools import islice
+
+import numpy as np
+
+from roadblock.grid import GatesGrid, dim_pin_iterator
+
+from roadblock import log
+
+
+BUS_BIT_REGEX = re.compile(r"^(.*)\[(\d+)\]$")
+
+
+def solve_assignment(cost: np.ndarray) -> np.ndarray:
+    # Hungarian algorithm with potentials for n rows and m >= n columns, returns
+    # the column of every row. Index 0 of the column arrays is a virtual column
+    num_rows, num_cols = cost.shape
+
+    row_potential = np.zeros(num_rows + 1)
+    col_potential = np.zeros(num_cols + 1)
+    col_row = np.zeros(num_cols + 1, dtype=np.int64)
+    col_way = np.zeros(num_cols + 1, dtype=np.int64)
+
+    for row in range(1, num_rows + 1):
+        col_row[0] = row
+        col = 0
+        min_slack = np.full(num_cols + 1, np.inf)
+        used = np.zeros(num_cols + 1, dtype=bool)
+
+        # Grow a tree of tight edges until it reaches an unassigned column
+        while True:
+            used[col] = True
+            tree_row = col_row[col]
+
+            slack = cost[tree_row - 1] - row_potential[tree_row] - col_potential[1:]
+            free = ~used[1:]
+            better = free & (slack < min_slack[1:])
+            min_slack[1:][better] = slack[better]
+            col_way[1:][better] = col
+
+            free_slack = np.where(free, min_slack[1:], np.inf)
+            next_col = int(np.argmin(free_slack)) + 1
+            delta = free_slack[next_col - 1]
+
+            row_potential[col_row[used]] += delta
+            col_potential[used] -= delta
+            min_slack[1:][free] -= delta
+
+            col = next_col
+
+            if col_row[col] == 0:
+                break
+
+        # Flip the assignments along the augmenting path
+        while col != 0:
+            prev_col = col_way[col]
+            col_row[col] = col_row[prev_col]
+            col = prev_col
+
+    row_col = np.zeros(num_rows, dtype=np.int64)
+    assigned = np.flatnonzero(col_row[1:])
+    row_col[col_row[1:][assigned] - 1] = assigned
+
+    return row_col
+
+
+def get_port_slots(grid: GatesGrid) -> tuple[np.ndarray, np.ndarray]:
+    # Perimeter positions in the order dim_pin_iterator walks them
+    dim = grid.dim
+    num_slots = 2 * (dim.x - 2) + 2 * (dim.y - 2)
+    slots = list(islice(dim_pin_iterator(dim), num_slots))
+
+    return (
+        np.array([slot.x for slot in slots], dtype=np.int32),
+        np.array([slot.y for slot in slots], dtype=np.int32),
+    )
+
+
+def get_port_slot_costs(
+    grid: GatesGrid, port_ids: np.ndarray, slot_x: np.ndarray, slot_y: np.ndarray
+) -> np.ndarray:
+    # Wire length of the nets of every port for every slot, with the other pins of
+    # those nets where they are now
+    netlist = grid.netlist
+    pos_x, pos_y = grid.placement
+    costs = np.zeros((len(port_ids), len(slot_x)))
+
+    for row, port_id in enumerate(port_ids.tolist()):
+        for net in netlist.nets_of_gate(port_id).tolist():
+            others = netlist.gates_of_net(net)
+            others = others[others != port_id]
+
+            if len(others) == 0:
+                continue
+
+            min_x, max_x = pos_x[others].min(), pos_x[others].max()
+            min_y, max_y = pos_y[others].min(), pos_y[others].max()
+
+            costs[row] += (
+                (np.maximum(slot_x, max_x) - np.minimum(slot_x, min_x))
+                + (np.maximum(slot_y, max_y) - np.minimum(slot_y, min_y))
+            ) / 2
+
+    return costs
+
+
+def order_bus_slots_inplace(
+    grid: GatesGrid, port_ids: np.ndarray, port_slots: np.ndarray, costs: np.ndarray
+) -> None:
+    # Bits of a bus keep the slots they were given, but are laid along them in
+    # index order. Every rotation and direction of that order is tried
+    buses: dict[str, list[tuple[int, int]]] = {}
+
+    for row, port_id in enumerate(port_ids.tolist()):
+        match = BUS_BIT_REGEX.match(grid.gates[port_id].name)
+
+        if match is not None:
+            buses.setdefault(match.group(1), []).append((int(match.group(2)), row))
+
+    for bits in buses.values():
+        rows = np.array([row for _, row in sorted(bits)])
+        slots = np.sort(port_slots[rows])
+
+        orders = [np.roll(slots, -shift) for shift in range(len(slots))]
+        orders += [order[::-1] for order in orders]
+        order_costs = [costs[rows, order].sum() for order in orders]
+
+        port_slots[rows] = orders[int(np.argmin(order_costs))]
+
+
+def assign_ports(grid: GatesGrid) -> None:
+    port_ids = np.array(
+        [gate_id for gate_id, gate in enumerate(grid.gates) if gate.is_port],
+        dtype=np.int64,
+    )
+    slot_x, slot_y = get_port_slots(grid)
+
+    if len(port_ids) > len(slot_x):
+        log.error("Not enough pin space")
+        raise ValueError
+
+    old_cost = grid.cost
+    old_x, old_y = grid.get_gate_positions(port_ids)
+
+    costs = get_port_slot_costs(grid, port_ids, slot_x, slot_y)
+    port_slots = solve_assignment(costs)
+    order_bus_slots_inplace(grid, port_ids, port_slots, costs)
+
+    grid.move_group(port_ids, slot_x[port_slots], slot_y[port_slots])
+
+    # Ports sharing nets and bus ordering make the assignment cost approximate
+    if grid.cost > old_cost:
+        grid.move_group(port_ids, old_x, old_y)
+
+    log.info(f"Port assignment cost {old_cost} -> {grid.cost}")
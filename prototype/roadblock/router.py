@@ -1,23 +1,31 @@
-import random
+import time
+import heapq
 from enum import Enum
-from dataclasses import dataclass, field
-from queue import PriorityQueue, Queue
+from dataclasses import dataclass
 
 import numpy as np
 
 from roadblock.dim import Dim, Dim3
 from roadblock.grid import GatesGrid
+from roadblock.steiner import order_routes
 from roadblock import log
 
 
 Pred = Enum("Pred", ["ROOT", "NORTH", "SOUTH", "EAST", "WEST", "UP", "DOWN"])
 
+VIA_COST = 3
+BLOCKED_ID = -2
+HEURISTIC_MAX_TARGETS = 8
 
-@dataclass(order=True)
-class WavefrontCell:
-    loc: Dim3 = field(compare=False)
-    cost: int
-    pred: Pred = field(compare=False)
+NEGOTIATION_MAX_ITERATIONS = 50
+PRESENT_FACTOR_INIT = 0.5
+PRESENT_FACTOR_MULT = 1.5
+HISTORY_FACTOR = 1.0
+
+RIP_UP_COST = 100.0
+RIP_UP_PIN_OCCUPANCY = 1_000_000
+RIP_UP_MAX_FACTOR = 20
+RIP_UP_HISTORY_COST = 4.0
 
 
 def pred_to_dim3(pred: Pred) -> Dim3:
@@ -41,218 +49,680 @@ def pred_to_dim3(pred: Pred) -> Dim3:
 
 def pred_to_cost(pred: Pred) -> int:
     if pred == Pred.UP or pred == Pred.DOWN:
-        return 3
+        return VIA_COST
 
     return 1
 
 
 def construct_routes(grid: GatesGrid) -> dict[int, list[Dim]]:
     routes: dict[int, list[Dim]] = {}
+    netlist = grid.netlist
 
-    for net_id, gates_ids in grid.netlist:
+    for net in range(netlist.num_nets):
         points: list[Dim] = []
 
-        for gate_id in gates_ids:
+        for gate_id, role in netlist.pins(net):
             gate = grid.get_gate_from_id(gate_id)
             gate_pos = grid.get_pos_expect(gate_id)
 
-            if net_id in gate.inputs:
-                points.append(gate_pos + gate.in_coords)
+            points.append(gate_pos + gate.pin_coords(role))
 
-            if net_id in gate.outputs:
-                points.append(gate_pos + gate.out_coords)
+        routes[int(netlist.net_ids[net])] = points
 
-            if net_id in gate.clk_inputs:
-                points.append(gate_pos + gate.clk_coords)
+    return routes
 
-        routes[net_id] = points
 
-    return routes
+def get_pin_cells(routes: dict[int, list[Dim]], shape: tuple[int, ...]) -> np.ndarray:
+    # Flat cells of the distinct pins of every route
+    return np.array(
+        [
+            pin_cell
+            for points in routes.values()
+            for pin_cell in set(
+                get_flat_loc(point.to_dim3(), shape) for point in points
+            )
+        ],
+        dtype=np.int64,
+    )
+
+
+def get_pin_access_cells(pin_cells: list[int], shape: tuple[int, ...]) -> list[int]:
+    # Pins next to other pins can only be left through the layer above them, so
+    # that cell is kept for the nets of the pin as well
+    num_layers, size_x, size_y = shape
+
+    if num_layers == 1:
+        return pin_cells
 
+    return pin_cells + [pin_cell + size_x * size_y for pin_cell in pin_cells]
 
-def create_router_grid(dim: Dim, max_layers: int) -> np.ndarray[int]:
+
+def create_router_grid(dim: Dim, max_layers: int) -> np.ndarray:
     return np.full((max_layers, dim.x, dim.y), -1, dtype=np.int32)
 
 
-def create_pred_grid(
-    dim: Dim, max_layers: int, roots: list[Dim3]
-) -> np.ndarray[Pred | None]:
-    create_cell_vec = np.vectorize(lambda _: None)
-    pred_grid = create_cell_vec(np.full((dim.x, dim.y, max_layers), 0))
+class SearchBuffers:
+    # Pred and path cost of every router cell, only valid where the stamp of the
+    # cell matches the current generation so a reset does not touch the arrays
+    MAX_GENERATION = np.iinfo(np.int32).max
 
-    for root in roots:
-        pred_grid[root.x, root.y, root.z] = Pred.ROOT
+    def __init__(self, size: int) -> None:
+        self.preds = np.zeros(size, dtype=np.int8)
+        self.costs = np.zeros(size)
+        self.reached = np.zeros(size, dtype=np.int32)
+        self.visited = np.zeros(size, dtype=np.int32)
+        self.generation = 0
 
-    return pred_grid
+    def reset(self) -> None:
+        if self.generation == SearchBuffers.MAX_GENERATION:
+            self.reached.fill(0)
+            self.visited.fill(0)
+            self.generation = 0
 
+        self.generation += 1
 
-def get_neighbors(
-    cell: WavefrontCell,
-    router_grid: np.ndarray[int],
-    pred_grid: np.ndarray[Pred | None],
-    wavefront_locs: list[Dim3],
-) -> list[WavefrontCell]:
-    neighbors_preds = [pred for pred in Pred if pred != Pred.ROOT]
 
-    neighbors: list[WavefrontCell] = []
+class NegotiationState:
+    # Number of routes on every router cell and the history cost of cells that
+    # were overused in earlier iterations. A cell fits one route, except for pins
+    # that several nets connect to
+    def __init__(self, size: int, history_factor: float) -> None:
+        self.occupancy = np.zeros(size, dtype=np.int32)
+        self.capacity = np.ones(size, dtype=np.int32)
+        self.history = np.zeros(size)
+        self.history_factor = history_factor
+        self.present_factor = 0.0
 
-    for pred in neighbors_preds:
-        nloc = cell.loc - pred_to_dim3(pred)
+    def add_route(self, cells: np.ndarray) -> None:
+        self.occupancy[cells] += 1
 
-        if nloc.x < 0 or nloc.y < 0 or nloc.z < 0:
-            continue
+    def remove_route(self, cells: np.ndarray) -> None:
+        self.occupancy[cells] -= 1
 
-        if (
-            nloc.x >= router_grid.shape[1]
-            or nloc.y >= router_grid.shape[2]
-            or nloc.z >= router_grid.shape[0]
-        ):
-            continue
+    def set_pin_capacity(self, pin_cells: np.ndarray) -> None:
+        cells, counts = np.unique(pin_cells, return_counts=True)
+        self.capacity[cells] = counts
 
-        if router_grid[nloc.z, nloc.x, nloc.y] != -1:
-            continue
+    def get_overused(self) -> np.ndarray:
+        return self.occupancy > self.capacity
 
-        if pred_grid[nloc.x, nloc.y, nloc.z] is not None:
+    def update_history(self) -> None:
+        overuse = np.maximum(self.occupancy - self.capacity, 0)
+        self.history += self.history_factor * overuse
+
+
+@dataclass
+class NegotiationStats:
+    iteration: int
+    num_rerouted: int
+    num_overused: int
+    wire_length: int
+    wall_time: float
+
+
+def get_pred_steps(shape: tuple[int, ...]) -> list[tuple[int, int, int, int, int, int]]:
+    # Coordinate step back to the predecessor, its flat offset, the pred value and
+    # the cost of entering a cell from every direction
+    _, size_x, size_y = shape
+    steps: list[tuple[int, int, int, int, int, int]] = []
+
+    for pred in Pred:
+        if pred == Pred.ROOT:
             continue
 
-        if nloc in wavefront_locs:
+        step = pred_to_dim3(pred)
+        offset = step.z * size_x * size_y + step.x * size_y + step.y
+        steps.append((step.x, step.y, step.z, offset, pred.value, pred_to_cost(pred)))
+
+    return steps
+
+
+def get_flat_loc(loc: Dim3, shape: tuple[int, ...]) -> int:
+    _, size_x, size_y = shape
+    return (loc.z * size_x + loc.x) * size_y + loc.y
+
+
+def search_nearest_target(
+    router_grid: np.ndarray,
+    roots: list[int],
+    targets: set[int],
+    buffers: SearchBuffers,
+    negotiation: NegotiationState | None = None,
+    pin_mask: np.ndarray | None = None,
+    own_pins: set[int] | None = None,
+    history_cost: np.ndarray | None = None,
+    shared_ids: set[int] | None = None,
+) -> int | None:
+    # A* from every root to the closest target over flat indices of router_grid.
+    # Without negotiation occupied cells are blocked, with it every cell can be
+    # used at a cost that grows with the routes already on it. Cells in pin_mask
+    # are blocked too, except own_pins which may be shared with other nets.
+    # Routes in shared_ids are joined to this one through a pin so their cells can
+    # be used. history_cost makes free cells that were fought over more expensive
+    _, size_x, size_y = router_grid.shape
+    layer_size = size_x * size_y
+    steps = get_pred_steps(router_grid.shape)
+
+    buffers.reset()
+    generation = buffers.generation
+
+    occupied = router_grid.reshape(-1).data
+    preds = buffers.preds.data
+    # Cast through bytes so the view is typed as holding floats
+    costs = buffers.costs.data.cast("B").cast("d")
+    reached = buffers.reached.data
+    visited = buffers.visited.data
+    pins = pin_mask.data if pin_mask is not None else None
+    extra_costs = history_cost.data if history_cost is not None else None
+
+    if negotiation is not None:
+        occupancy = negotiation.occupancy.data
+        capacity = negotiation.capacity.data
+        history = negotiation.history.data
+        present_factor = negotiation.present_factor
+
+    target_locs = []
+
+    for target in targets:
+        z, rem = divmod(target, layer_size)
+        target_locs.append((*divmod(rem, size_y), z))
+
+    min_x, min_y, min_z = map(min, zip(*target_locs))
+    max_x, max_y, max_z = map(max, zip(*target_locs))
+
+    # Manhattan distance with vias to the nearest target, or to the bbox of the
+    # targets when there are too many of them to check each
+    def get_heuristic(x: int, y: int, z: int) -> int:
+        if len(target_locs) <= HEURISTIC_MAX_TARGETS:
+            return min(
+                abs(x - tx) + abs(y - ty) + VIA_COST * abs(z - tz)
+                for tx, ty, tz in target_locs
+            )
+
+        return (
+            max(min_x - x, 0, x - max_x)
+            + max(min_y - y, 0, y - max_y)
+            + VIA_COST * max(min_z - z, 0, z - max_z)
+        )
+
+    wavefront: list[tuple[float, int, int]] = []
+
+    for root in roots:
+        z, rem = divmod(root, layer_size)
+        x, y = divmod(rem, size_y)
+
+        preds[root] = Pred.ROOT.value
+        costs[root] = 0
+        reached[root] = generation
+        heuristic = get_heuristic(x, y, z)
+        wavefront.append((heuristic, heuristic, root))
+
+    heapq.heapify(wavefront)
+
+    while len(wavefront) != 0:
+        _, _, loc = heapq.heappop(wavefront)
+
+        if visited[loc] == generation:
             continue
 
-        neighbors.append(WavefrontCell(loc=nloc, cost=pred_to_cost(pred), pred=pred))
+        if loc in targets:
+            return loc
 
-    return neighbors
+        visited[loc] = generation
+        cost = costs[loc]
 
+        z, rem = divmod(loc, layer_size)
+        x, y = divmod(rem, size_y)
 
-def backtrace_inplace(
-    target: WavefrontCell,
-    router_grid: np.ndarray[int],
-    pred_grid: np.ndarray[Pred | None],
-    route_id: int,
-) -> list[Dim3]:
-    pred: Pred = target.pred
-    loc: Dim3 = target.loc
-    trace: list[Dim3] = [loc]
+        for step_x, step_y, step_z, offset, pred, step_cost in steps:
+            next_x, next_y, next_z = x - step_x, y - step_y, z - step_z
+
+            if (
+                next_x < 0
+                or next_y < 0
+                or next_z < 0
+                or next_x >= size_x
+                or next_y >= size_y
+                or next_z >= len(router_grid)
+            ):
+                continue
+
+            next_loc = loc - offset
+
+            if visited[next_loc] == generation:
+                continue
+
+            if negotiation is None:
+                owner = occupied[next_loc]
+
+                if owner != -1 or (pins is not None and pins[next_loc]):
+                    if (own_pins is None or next_loc not in own_pins) and (
+                        shared_ids is None or owner not in shared_ids
+                    ):
+                        continue
+
+                next_cost: float = cost + step_cost
+
+                if extra_costs is not None:
+                    next_cost += extra_costs[next_loc]
+            else:
+                overuse = max(occupancy[next_loc] + 1 - capacity[next_loc], 0)
+                next_cost = cost + (step_cost + history[next_loc]) * (
+                    1 + present_factor * overuse
+                )
 
-    router_grid[loc.z, loc.x, loc.y] = route_id
+            if reached[next_loc] == generation and costs[next_loc] <= next_cost:
+                continue
 
-    while pred != Pred.ROOT:
-        new_loc = loc + pred_to_dim3(pred)
+            preds[next_loc] = pred
+            costs[next_loc] = next_cost
+            reached[next_loc] = generation
 
-        pred = pred_grid[new_loc.x, new_loc.y, new_loc.z]
+            heuristic = get_heuristic(next_x, next_y, next_z)
+            heapq.heappush(wavefront, (next_cost + heuristic, heuristic, next_loc))
 
-        if pred != Pred.ROOT:
-            trace.append(new_loc)
+    return None
 
-        router_grid[new_loc.z, new_loc.x, new_loc.y] = route_id
-        loc = new_loc
+
+def backtrace(target: int, pred_grid: np.ndarray, shape: tuple[int, ...]) -> list[int]:
+    # Path from target back to a root, the root is the last cell
+    offsets = {pred: offset for _, _, _, offset, pred, _ in get_pred_steps(shape)}
+
+    loc = target
+    trace: list[int] = [loc]
+
+    while pred_grid[loc] != Pred.ROOT.value:
+        loc += offsets[int(pred_grid[loc])]
+        trace.append(loc)
 
     return trace
 
 
-def reset_wavefront_inplace(
-    wavefront: PriorityQueue[WavefrontCell],
-    traces: list[Dim3],
-) -> None:
-    wavefront.queue.clear()
+def search_route(
+    router_grid: np.ndarray,
+    points: list[Dim],
+    buffers: SearchBuffers,
+    negotiation: NegotiationState | None = None,
+    pin_mask: np.ndarray | None = None,
+    history_cost: np.ndarray | None = None,
+    shared_ids: set[int] | None = None,
+    ordered: bool = False,
+) -> list[int] | None:
+    # Grows a tree from the first pin, connecting the closest remaining pin to it
+    # every time or the pins in the given order. Returns the flat cells of the tree
+    pin_order = list(
+        dict.fromkeys(
+            get_flat_loc(point.to_dim3(), router_grid.shape) for point in points
+        )
+    )
+    start = pin_order[0]
+    targets = set(pin_order[1:])
+
+    traces: list[int] = [start]
+    own_pins = set(get_pin_access_cells([start, *targets], router_grid.shape))
+
+    while len(targets) != 0:
+        target = search_nearest_target(
+            router_grid,
+            traces,
+            {next(pin for pin in pin_order if pin in targets)} if ordered else targets,
+            buffers,
+            negotiation,
+            pin_mask,
+            own_pins,
+            history_cost,
+            shared_ids,
+        )
+
+        if target is None:
+            return None
 
-    for point in traces:
-        wavefront.put(WavefrontCell(loc=point, cost=0, pred=Pred.ROOT))
+        targets.remove(target)
+        traces.extend(backtrace(target, buffers.preds, router_grid.shape)[:-1])
 
+    return traces
 
-def dump_router_grid(router_grid: np.ndarray[int]) -> None:
+
+def search_route_window(
+    router_grid: np.ndarray,
+    points: list[Dim],
+    window: tuple[int, int, int, int],
+    buffers: SearchBuffers,
+    pin_mask: np.ndarray | None = None,
+    shared_ids: set[int] | None = None,
+    region: np.ndarray | None = None,
+    ordered: bool = False,
+) -> np.ndarray | None:
+    # Routes a net on a copy of the min_x, max_x, min_y, max_y window of the grid,
+    # columns outside region are blocked too. Returns flat cells of the full grid
+    min_x, max_x, min_y, max_y = window
+
+    window_grid = np.array(router_grid[:, min_x:max_x, min_y:max_y])
+    window_points = [Dim(point.x - min_x, point.y - min_y) for point in points]
+    window_pins = None
+
+    if pin_mask is not None:
+        pins = pin_mask.reshape(router_grid.shape)[:, min_x:max_x, min_y:max_y]
+        window_pins = np.array(pins).reshape(-1)
+
+    if region is not None:
+        window_grid[:, ~region] = BLOCKED_ID
+
+    cells = search_route(
+        window_grid,
+        window_points,
+        buffers,
+        pin_mask=window_pins,
+        shared_ids=shared_ids,
+        ordered=ordered,
+    )
+
+    if cells is None:
+        return None
+
+    z, x, y = np.unravel_index(np.array(cells, dtype=np.int64), window_grid.shape)
+    return np.ravel_multi_index((z, x + min_x, y + min_y), router_grid.shape)
+
+
+def dump_router_grid(router_grid: np.ndarray) -> None:
     for i in range(router_grid.shape[0]):
         np.savetxt(f"routes-layer{i}.txt", router_grid[i], fmt="%d")
 
 
-def create_route_inplace(
-    router_grid: np.ndarray[Pred | None],
+def rip_route_inplace(router_grid: np.ndarray, route_id: int) -> None:
+    router_grid[router_grid == route_id] = -1
+
+
+def find_blocking_routes(
+    router_grid: np.ndarray,
     route_id: int,
     points: list[Dim],
-    grid_dim: Dim,
-    max_layers: int,
-) -> bool:
-    start = points[0].to_dim3()
-    targets = list(map(lambda point: point.to_dim3(), points[1:]))
+    buffers: SearchBuffers,
+    pin_mask: np.ndarray,
+    blockage: NegotiationState,
+    history_step: float,
+    shared_ids: set[int],
+) -> set[int]:
+    # Cheapest tree of the net when routed cells can be crossed at a high cost,
+    # the routes it crosses are the ones in the way. Pins of other nets are never
+    # crossed since ripping their routes would not free them, routes in shared_ids
+    # are free to cross. The crossed cells get history_step more cost so the nets
+    # stop fighting over the same cells
+    occupied = router_grid.reshape(-1)
+    own_pins = get_pin_access_cells(
+        [get_flat_loc(point.to_dim3(), router_grid.shape) for point in points],
+        router_grid.shape,
+    )
 
-    traces: list[Dim3] = [start]
-    wavefront: PriorityQueue[WavefrontCell] = PriorityQueue()
+    blockage.occupancy[:] = occupied != -1
+    blockage.occupancy[pin_mask] = RIP_UP_PIN_OCCUPANCY
+    blockage.occupancy[own_pins] = 0
+    blockage.occupancy[np.isin(occupied, list(shared_ids))] = 0
+    blockage.present_factor = RIP_UP_COST
 
-    pred_grid = create_pred_grid(grid_dim, max_layers, traces)
-    wavefront.put(WavefrontCell(loc=start, cost=0, pred=Pred.ROOT))
+    cells = search_route(router_grid, points, buffers, blockage)
 
-    while True:
-        if wavefront.empty():
-            dump_router_grid(router_grid)
-            return False
+    if cells is None:
+        return set()
 
-        cell = wavefront.get()
+    owners = occupied[cells]
+    owners[np.isin(cells, own_pins) | np.isin(owners, list(shared_ids))] = -1
+    crossed = (owners != -1) & (owners != route_id)
 
-        if cell.loc in targets:
-            targets.remove(cell.loc)
+    blockage.history[np.array(cells)[crossed]] += history_step
 
-            traces.extend(backtrace_inplace(cell, router_grid, pred_grid, route_id))
+    return set(owners[crossed].tolist())
 
-            pred_grid = create_pred_grid(grid_dim, max_layers, traces)
-            reset_wavefront_inplace(wavefront, traces)
 
-            if len(targets) == 0:
-                return True
+def get_pin_mask(routes: dict[int, list[Dim]], shape: tuple[int, ...]) -> np.ndarray:
+    pin_mask = np.zeros(np.prod(shape), dtype=bool)
+    pin_mask[get_pin_access_cells(get_pin_cells(routes, shape).tolist(), shape)] = True
 
-        wavefront_locs = list(map(lambda cell: cell.loc, wavefront.queue))
+    return pin_mask
 
-        neighbors = get_neighbors(cell, router_grid, pred_grid, wavefront_locs)
 
-        for neighbor in neighbors:
-            wavefront.put(neighbor)
+def get_pin_sharers(
+    routes: dict[int, list[Dim]], shape: tuple[int, ...]
+) -> dict[int, set[int]]:
+    # Routes that share a pin with each route are connected to it anyway so they
+    # may share cells, ripping one of them must leave the shared cells to the others
+    pin_routes: dict[int, set[int]] = {}
 
-        pred_grid[cell.loc.x, cell.loc.y, cell.loc.z] = cell.pred
+    for route_id, points in routes.items():
+        for point in points:
+            pin_cell = get_flat_loc(point.to_dim3(), shape)
+            pin_routes.setdefault(pin_cell, set()).add(route_id)
 
+    pin_sharers: dict[int, set[int]] = {route_id: set() for route_id in routes}
 
-def rip_route_inplace(router_grid: np.ndarray[int], route_id: int) -> None:
-    router_grid[router_grid == route_id] = -1
+    for sharing_ids in pin_routes.values():
+        for route_id in sharing_ids:
+            pin_sharers[route_id] |= sharing_ids - {route_id}
+
+    return pin_sharers
+
+
+def route_with_rip_up(
+    router_grid: np.ndarray,
+    routes: dict[int, list[Dim]],
+    route_ids: list[int],
+    pin_mask: np.ndarray,
+    pin_sharers: dict[int, set[int]],
+    route_cells: dict[int, np.ndarray],
+) -> None:
+    # Routes route_ids into router_grid, routes already in route_cells may be
+    # ripped up and routed again to make room
+    buffers = SearchBuffers(router_grid.size)
+    blockage = NegotiationState(router_grid.size, 0.0)
+
+    # Nets come out by highest priority then in their original order, ripped nets
+    # gain priority so they are routed again before untouched ones
+    orders = {route_id: order for order, route_id in enumerate(routes.keys())}
+    priorities = {route_id: 0 for route_id in routes.keys()}
+    route_queue = [(0, orders[route_id], route_id) for route_id in route_ids]
+    heapq.heapify(route_queue)
+    num_rip_ups = 0
+
+    while len(route_queue) != 0:
+        _, _, route_id = heapq.heappop(route_queue)
+        points = routes[route_id]
+
+        cells = search_route(
+            router_grid,
+            points,
+            buffers,
+            pin_mask=pin_mask,
+            history_cost=blockage.history,
+            shared_ids=pin_sharers[route_id],
+            ordered=True,
+        )
+
+        if cells is not None:
+            route_cells[route_id] = np.array(cells, dtype=np.int64)
+            router_grid.reshape(-1)[route_cells[route_id]] = route_id
+            log.info(f"Created route {route_id}")
+            continue
+
+        # Nets that keep failing raise the history cost faster
+        blocking_ids = find_blocking_routes(
+            router_grid,
+            route_id,
+            points,
+            buffers,
+            pin_mask,
+            blockage,
+            RIP_UP_HISTORY_COST * (priorities[route_id] + 1),
+            pin_sharers[route_id],
+        )
+        num_rip_ups += 1
+
+        if len(blocking_ids) == 0 or num_rip_ups > RIP_UP_MAX_FACTOR * len(routes):
+            dump_router_grid(router_grid)
+            log.error(f"Unable to route {route_id}")
+            raise ValueError
+
+        log.info(f"Unable to route {route_id} ripping {sorted(blocking_ids)}")
+
+        for other_route_id in blocking_ids:
+            rip_route_inplace(router_grid, other_route_id)
+            del route_cells[other_route_id]
+            priorities[other_route_id] += 1
+
+            for sharer_id in pin_sharers[other_route_id] & route_cells.keys():
+                sharer_cells = route_cells[sharer_id]
+                router_grid.reshape(-1)[sharer_cells] = sharer_id
+
+            heapq.heappush(
+                route_queue,
+                (-priorities[other_route_id], orders[other_route_id], other_route_id),
+            )
+
+        # The failed net goes first to claim the cells that were freed for it
+        priorities[route_id] = max(priorities[other] for other in blocking_ids) + 1
+        heapq.heappush(route_queue, (-priorities[route_id], -1, route_id))
 
 
 def route(grid: GatesGrid, max_layers: int) -> None:
     router_grid = create_router_grid(grid.dim, max_layers)
+    routes = order_routes(construct_routes(grid))
+
+    log.info(f"Routing {len(routes)} routes")
+
+    route_with_rip_up(
+        router_grid,
+        routes,
+        list(routes.keys()),
+        get_pin_mask(routes, router_grid.shape),
+        get_pin_sharers(routes, router_grid.shape),
+        {},
+    )
+
+
+def negotiate_routes(
+    router_grid: np.ndarray,
+    routes: dict[int, list[Dim]],
+    negotiation: NegotiationState,
+    max_iterations: int,
+    ordered: bool = False,
+) -> tuple[dict[int, np.ndarray], list[NegotiationStats]]:
+    # PathFinder, every net is routed allowing cells to be shared. Shared cells
+    # get more expensive every iteration and only nets on them are rerouted
+    buffers = SearchBuffers(router_grid.size)
+    route_cells: dict[int, np.ndarray] = {}
+    reroute_ids = list(routes.keys())
+    stats: list[NegotiationStats] = []
+
+    for iteration in range(max_iterations):
+        start_time = time.perf_counter()
+
+        for route_id in reroute_ids:
+            if route_id in route_cells:
+                negotiation.remove_route(route_cells[route_id])
+
+            trace = search_route(
+                router_grid, routes[route_id], buffers, negotiation, ordered=ordered
+            )
+
+            if trace is None:
+                log.error(f"Unable to route {route_id}")
+                raise ValueError
+
+            route_cells[route_id] = np.array(trace, dtype=np.int64)
+            negotiation.add_route(route_cells[route_id])
+
+        overused = negotiation.get_overused()
+        stats.append(
+            NegotiationStats(
+                iteration=iteration,
+                num_rerouted=len(reroute_ids),
+                num_overused=int(overused.sum()),
+                wire_length=int(sum(len(cells) for cells in route_cells.values())),
+                wall_time=time.perf_counter() - start_time,
+            )
+        )
 
-    routes = construct_routes(grid)
-    route_queue: Queue[tuple[int, list[Dim]]] = Queue()
-    for route_id, points in routes.items():
-        route_queue.put((route_id, points))
+        log.info(
+            f"Negotiation iteration {iteration} rerouted={stats[-1].num_rerouted}"
+            + f" overused={stats[-1].num_overused}"
+            + f" wire_length={stats[-1].wire_length}"
+            + f" time={round(stats[-1].wall_time, 3)}s"
+        )
+
+        if stats[-1].num_overused == 0:
+            break
 
-    created_routes: set[int] = set()
+        negotiation.update_history()
+
+        if iteration == 0:
+            negotiation.present_factor = PRESENT_FACTOR_INIT
+        else:
+            negotiation.present_factor *= PRESENT_FACTOR_MULT
 
-    log.info(f"Routing {route_queue.qsize()} routes")
+        reroute_ids = [
+            route_id for route_id, cells in route_cells.items() if overused[cells].any()
+        ]
 
-    while route_queue.qsize() != 0:
-        route_id, points = route_queue.get()
-        route_created = create_route_inplace(
-            router_grid, route_id, points, grid.dim, max_layers
+    if stats[-1].num_overused != 0:
+        log.warn(
+            f"{stats[-1].num_overused} cells are still shared"
+            + f" after {max_iterations} iterations"
         )
 
-        if not route_created:
-            # route_id_to_rip = random.choice(list(created_routes))
-            # log.info(
-            #     f"Unable to route {route_id}, ripping random route {route_id_to_rip}"
-            # )
+    return route_cells, stats
 
-            # created_routes.remove(route_id_to_rip)
-            # rip_route_inplace(router_grid, route_id_to_rip)
-            # rip_route_inplace(router_grid, route_id)
 
-            # route_queue.put((route_id, points))
-            # route_queue.put((route_id_to_rip, routes[route_id_to_rip]))
-            # log.info(f"Route queue size is now {route_queue.qsize()}")
+def route_negotiated(
+    grid: GatesGrid,
+    max_layers: int,
+    max_iterations: int = NEGOTIATION_MAX_ITERATIONS,
+) -> tuple[np.ndarray, list[NegotiationStats]]:
+    # Nets that still share cells once negotiation gives up are ripped and routed
+    # again with rip-up, so the returned router grid is always legal
+    router_grid = create_router_grid(grid.dim, max_layers)
+    negotiation = NegotiationState(router_grid.size, HISTORY_FACTOR)
+    routes = construct_routes(grid)
 
-            log.info(f"Unable to route {route_id} ripping all routes")
+    # Nets sharing a pin each count once on it
+    negotiation.set_pin_capacity(get_pin_cells(routes, router_grid.shape))
+
+    log.info(f"Routing {len(routes)} routes with negotiated congestion")
+
+    route_cells, stats = negotiate_routes(
+        router_grid, routes, negotiation, max_iterations
+    )
+
+    pin_mask = get_pin_mask(routes, router_grid.shape)
+    pin_sharers = get_pin_sharers(routes, router_grid.shape)
+    overused = negotiation.get_overused()
+    failed_ids: list[int] = []
+
+    # Negotiation does not keep nets off the cells around the pins of other nets,
+    # the rip-up router needs them free to reach those pins
+    for route_id, cells in route_cells.items():
+        own_points = [
+            point
+            for other_id in {route_id} | pin_sharers[route_id]
+            for point in routes[other_id]
+        ]
+        own_pins = get_pin_access_cells(
+            [get_flat_loc(point.to_dim3(), router_grid.shape) for point in own_points],
+            router_grid.shape,
+        )
 
-            route_queue.put((route_id, points))
+        if overused[cells].any() or not np.isin(cells[pin_mask[cells]], own_pins).all():
+            failed_ids.append(route_id)
 
-            for other_route_id in created_routes:
-                route_queue.put((other_route_id, routes[other_route_id]))
+    for route_id in failed_ids:
+        del route_cells[route_id]
 
-            router_grid = create_router_grid(grid.dim, max_layers)
-            created_routes = set()
-        else:
-            log.info(f"Created route {route_id}")
-            created_routes.add(route_id)
+    for route_id, cells in route_cells.items():
+        router_grid.reshape(-1)[cells] = route_id
+
+    if len(failed_ids) != 0:
+        log.info(f"Routing {len(failed_ids)} routes left on cells of other routes")
+
+        route_with_rip_up(
+            router_grid, routes, failed_ids, pin_mask, pin_sharers, route_cells
+        )
+
+    return router_grid, stats
@@ -0,0 +1,139 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from roadblock.dim import Dim
+
+
+STEINER_MAX_PINS = 8
+
+
+@dataclass
+class SteinerTree:
+    # Pins come first in nodes followed by the steiner points, edges are the two
+    # pin segments in the order they are reached from the first pin
+    nodes: list[Dim]
+    edges: list[tuple[int, int]]
+    length: int
+
+
+def get_mst_edges(xs: np.ndarray, ys: np.ndarray) -> tuple[list[tuple[int, int]], int]:
+    # Prim on manhattan distances from node 0, edges are in the order they are
+    # added as parent, child
+    num_nodes = len(xs)
+    in_tree = np.zeros(num_nodes, dtype=bool)
+    dists = np.abs(xs - xs[0]) + np.abs(ys - ys[0])
+    parents = np.zeros(num_nodes, dtype=np.int64)
+
+    in_tree[0] = True
+    edges: list[tuple[int, int]] = []
+    length = 0
+
+    for _ in range(num_nodes - 1):
+        node = int(np.argmin(np.where(in_tree, np.iinfo(np.int64).max, dists)))
+        edges.append((int(parents[node]), node))
+        length += int(dists[node])
+        in_tree[node] = True
+
+        node_dists = np.abs(xs - xs[node]) + np.abs(ys - ys[node])
+        closer = node_dists < dists
+        dists[closer] = node_dists[closer]
+        parents[closer] = node
+
+    return edges, length
+
+
+def get_steiner_tree(points: list[Dim]) -> SteinerTree:
+    # Iterated 1-steiner, the point of the hanan grid that shortens the spanning
+    # tree the most is added until none does. Large nets keep their spanning tree
+    xs = np.array([point.x for point in points], dtype=np.int64)
+    ys = np.array([point.y for point in points], dtype=np.int64)
+    edges, length = get_mst_edges(xs, ys)
+
+    if len(points) <= 2 or len(points) > STEINER_MAX_PINS:
+        return SteinerTree(nodes=list(points), edges=edges, length=length)
+
+    hanan_xs, hanan_ys = np.meshgrid(np.unique(xs), np.unique(ys), indexing="ij")
+    candidates = set(zip(hanan_xs.reshape(-1).tolist(), hanan_ys.reshape(-1).tolist()))
+    candidates -= set(zip(xs.tolist(), ys.tolist()))
+
+    while len(candidates) != 0:
+        best: tuple[int, int] | None = None
+
+        for x, y in candidates:
+            _, new_length = get_mst_edges(np.append(xs, x), np.append(ys, y))
+
+            if new_length < length:
+                best, length = (x, y), new_length
+
+        if best is None:
+            break
+
+        candidates.remove(best)
+        xs, ys = np.append(xs, best[0]), np.append(ys, best[1])
+        edges, length = get_mst_edges(xs, ys)
+
+        # Steiner points left with two edges or less do not shorten the tree
+        degrees = np.bincount(np.array(edges).reshape(-1), minlength=len(xs))
+        keep = np.arange(len(xs)) < len(points)
+        keep |= degrees > 2
+
+        if not keep.all():
+            xs, ys = xs[keep], ys[keep]
+            edges, length = get_mst_edges(xs, ys)
+
+    nodes = [Dim(int(x), int(y)) for x, y in zip(xs, ys)]
+    return SteinerTree(nodes=nodes, edges=edges, length=length)
+
+
+def get_pin_order(tree: SteinerTree, num_pins: int) -> list[int]:
+    # Pins in the order a walk down the tree from the first pin reaches them, so
+    # every pin is next to the part of the net that is already routed
+    children: dict[int, list[int]] = {}
+
+    for parent, child in tree.edges:
+        children.setdefault(parent, []).append(child)
+
+    order: list[int] = []
+    stack = [0]
+
+    while len(stack) != 0:
+        node = stack.pop()
+
+        if node < num_pins:
+            order.append(node)
+
+        stack.extend(reversed(children.get(node, [])))
+
+    return order
+
+
+def get_route_order_key(
+    points: list[Dim], tree: SteinerTree, criticality: float
+) -> tuple[float, int, int, int]:
+    # Critical nets first, then nets with high fanout and large boxes since they
+    # have the hardest time getting around routes that are already in place
+    xs = [point.x for point in points]
+    ys = [point.y for point in points]
+    half_perim = max(xs) - min(xs) + max(ys) - min(ys)
+
+    return -criticality, -len(points), -half_perim, -tree.length
+
+
+def order_routes(
+    routes: dict[int, list[Dim]], criticality: dict[int, float] | None = None
+) -> dict[int, list[Dim]]:
+    # Routes sorted into routing order with the pins of every route in tree order
+    ordered: list[tuple[tuple[float, int, int, int], int, list[Dim]]] = []
+
+    for route_id, points in routes.items():
+        tree = get_steiner_tree(points)
+        pin_order = get_pin_order(tree, len(points))
+        key = get_route_order_key(
+            points, tree, 0.0 if criticality is None else criticality.get(route_id, 0.0)
+        )
+        ordered.append((key, route_id, [points[pin] for pin in pin_order]))
+
+    ordered.sort(key=lambda item: item[0])
+
+    return {route_id: points for _, route_id, points in ordered}
@@ -1,9 +1,19 @@
+import os
 import subprocess
 import json
+import hashlib
+from typing import Any, Iterator
 
+import numpy as np
+
+from roadblock.jsonstream import JsonStreamReader
 from roadblock.netlist import (
     yosys_to_minecraft_gates,
+    yosys_stream_to_minecraft_gates,
+    construct_gates_from_netlist,
     MinecraftGate,
+    GateType,
+    Netlist,
 )
 
 from roadblock import log
@@ -39,29 +49,164 @@ write_json {yosys_netlist_json_file_name}
     return yosys_script
 
 
+def iter_yosys_module(
+    reader: JsonStreamReader, module: str
+) -> Iterator[tuple[str, str, dict[str, Any]]]:
+    module_found = False
+
+    for key in reader.iter_object():
+        if key != "modules":
+            reader.skip_value()
+            continue
+
+        for module_name in reader.iter_object():
+            if module_name != module:
+                reader.skip_value(depth=2)
+                continue
+
+            module_found = True
+
+            for section in reader.iter_object():
+                if section not in ("ports", "cells"):
+                    reader.skip_value()
+                    continue
+
+                for name in reader.iter_object():
+                    yield section, name, reader.read_value()
+
+    if not module_found:
+        log.error(f"Module {module} not found in yosys netlist")
+        raise KeyError
+
+
+def read_yosys_netlist_json(
+    yosys_netlist_json_file_name: str, module: str, stream: bool
+) -> tuple[list[MinecraftGate], Netlist]:
+    if stream:
+        with open(yosys_netlist_json_file_name) as f:
+            reader = JsonStreamReader(f)
+            return yosys_stream_to_minecraft_gates(iter_yosys_module(reader, module))
+
+    with open(yosys_netlist_json_file_name) as f:
+        yosys_netlist = json.load(f)
+
+    return yosys_to_minecraft_gates(yosys_netlist, module)
+
+
+YOSYS_CACHE_DIR_NAME = ".roadblock-cache"
+
+# Bump on any change to the netlist conversion or the layout of cache entries
+YOSYS_CACHE_VERSION = 1
+
+
+def get_yosys_cache_key(
+    verilog_file: str, lib_file: str, yosys_script: str, module: str
+) -> str:
+    hasher = hashlib.sha256()
+    hasher.update(f"roadblock-yosys-cache-v{YOSYS_CACHE_VERSION}".encode())
+
+    for file_name in (verilog_file, lib_file):
+        with open(file_name, "rb") as f:
+            hasher.update(hashlib.sha256(f.read()).digest())
+
+    hasher.update(hashlib.sha256(yosys_script.encode()).digest())
+    hasher.update(hashlib.sha256(module.encode()).digest())
+
+    return hasher.hexdigest()
+
+
+def get_yosys_cache_file_name(verilog_file: str, cache_key: str) -> str:
+    cache_dir = os.path.join(os.path.dirname(verilog_file), YOSYS_CACHE_DIR_NAME)
+    return os.path.join(cache_dir, cache_key + ".npz")
+
+
+def save_yosys_cache(
+    cache_file_name: str, gates: list[MinecraftGate], netlist: Netlist
+) -> None:
+    os.makedirs(os.path.dirname(cache_file_name), exist_ok=True)
+
+    # Write to a temporary file first so a killed run never leaves a torn entry
+    temp_file_name = cache_file_name + ".tmp"
+
+    with open(temp_file_name, "wb") as f:
+        np.savez(
+            f,
+            gate_names=np.array([gate.name for gate in gates], dtype=str),
+            gate_types=np.array(
+                [gate.gate_type.value for gate in gates], dtype=np.int8
+            ),
+            net_ids=netlist.net_ids,
+            net_pin_offsets=netlist.net_pin_offsets,
+            pin_gate_ids=netlist.pin_gate_ids,
+            pin_roles=netlist.pin_roles,
+            gate_net_offsets=netlist.gate_net_offsets,
+            gate_net_indices=netlist.gate_net_indices,
+        )
+
+    os.replace(temp_file_name, cache_file_name)
+
+
+def load_yosys_cache(cache_file_name: str) -> tuple[list[MinecraftGate], Netlist]:
+    with np.load(cache_file_name, allow_pickle=False) as data:
+        netlist = Netlist(
+            net_ids=data["net_ids"],
+            net_pin_offsets=data["net_pin_offsets"],
+            pin_gate_ids=data["pin_gate_ids"],
+            pin_roles=data["pin_roles"],
+            gate_net_offsets=data["gate_net_offsets"],
+            gate_net_indices=data["gate_net_indices"],
+        )
+
+        gates = construct_gates_from_netlist(
+            data["gate_names"].tolist(),
+            [GateType(gate_type) for gate_type in data["gate_types"].tolist()],
+            netlist,
+        )
+
+    return gates, netlist
+
+
 def run_yosys_flow(
-    verilog_file: str, lib_file: str, module: str
-) -> tuple[list[MinecraftGate], dict[int, set[int]]]:
+    verilog_file: str,
+    lib_file: str,
+    module: str,
+    use_cache: bool = True,
+    stream: bool = False,
+) -> tuple[list[MinecraftGate], Netlist]:
     yosys_file_name = verilog_file + ".ys"
     yosys_netlist_json_file_name = verilog_file + ".json"
 
+    yosys_script = get_yosys_script(
+        verilog_file,
+        lib_file,
+        yosys_netlist_json_file_name,
+    )
+
+    cache_key = get_yosys_cache_key(verilog_file, lib_file, yosys_script, module)
+    cache_file_name = get_yosys_cache_file_name(verilog_file, cache_key)
+
+    if use_cache and os.path.exists(cache_file_name):
+        log.info(f"Loading cached synthesis result {cache_key[:12]}")
+        gates, netlist = load_yosys_cache(cache_file_name)
+        log.info(f"Result is {len(gates)} gates")
+
+        return gates, netlist
+
     log.info("Generating yosys script")
     with open(yosys_file_name, "w") as f:
-        f.write(
-            get_yosys_script(
-                verilog_file,
-                lib_file,
-                yosys_netlist_json_file_name,
-            )
-        )
+        f.write(yosys_script)
 
     log.info("Running yosys synthesis")
     subprocess.run(["yosys", yosys_file_name], check=True)
-    with open(yosys_netlist_json_file_name) as f:
-        yosys_netlist = json.load(f)
 
     log.info("Converting yosys netlist to minecraft netlist")
-    gates, netlist = yosys_to_minecraft_gates(yosys_netlist, module)
+    gates, netlist = read_yosys_netlist_json(
+        yosys_netlist_json_file_name, module, stream
+    )
     log.info(f"Result is {len(gates)} gates")
 
+    if use_cache:
+        log.info(f"Caching synthesis result {cache_key[:12]}")
+        save_yosys_cache(cache_file_name, gates, netlist)
+
     return gates, netlist
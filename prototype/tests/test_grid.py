@@ -0,0 +1,174 @@
+import random
+
+import numpy as np
+
+from roadblock.dim import Dim
+from roadblock.grid import (
+    CongestionParams,
+    FreePosIndex,
+    GatesGrid,
+    get_legal_anchor_mask,
+)
+from roadblock.netlist import yosys_to_minecraft_gates
+
+
+def get_free_pos_index(dim: Dim, free: list[Dim]) -> FreePosIndex:
+    occupied = np.ones((dim.x, dim.y), dtype=np.int32)
+
+    for pos in free:
+        occupied[pos.x, pos.y] = 0
+
+    return FreePosIndex(dim, Dim(1, 1), occupied)
+
+
+def get_dist(lhs: Dim, rhs: Dim) -> int:
+    return abs(lhs.x - rhs.x) + abs(lhs.y - rhs.y)
+
+
+def test_nearest_outside_first_window() -> None:
+    index = get_free_pos_index(Dim(20, 20), [Dim(12, 12), Dim(10, 13)])
+
+    assert index.nearest(Dim(10, 10)) == Dim(10, 13)
+
+
+def test_nearest_matches_brute_force() -> None:
+    rng = random.Random(0)
+    dim = Dim(24, 24)
+
+    for _ in range(200):
+        free = [
+            Dim(rng.randrange(1, dim.x - 2), rng.randrange(1, dim.y - 2))
+            for _ in range(rng.randrange(1, 6))
+        ]
+        center = Dim(rng.randrange(dim.x), rng.randrange(dim.y))
+
+        nearest = get_free_pos_index(dim, free).nearest(center)
+
+        assert nearest is not None
+        assert nearest in free
+        assert get_dist(nearest, center) == min(get_dist(pos, center) for pos in free)
+
+
+def make_yosys_data(num_cells: int, rng: random.Random) -> dict:
+    nets = [2, 3, 4, 5]
+    ports = {
+        f"in{i}": {"direction": "input", "bits": [net]} for i, net in enumerate(nets)
+    }
+    cells = {}
+
+    for i in range(num_cells):
+        cell_type = rng.choice(["NOT", "NOR", "BUFF"])
+        connections = {"A": [rng.choice(nets)], "Y": [len(nets) + 2]}
+
+        if cell_type == "NOR":
+            connections["B"] = [rng.choice(nets)]
+
+        cells[f"$abc$cell{i}"] = {"type": cell_type, "connections": connections}
+        nets.append(len(nets) + 2)
+
+    for i in range(4):
+        ports[f"out{i}"] = {"direction": "output", "bits": [rng.choice(nets[4:])]}
+
+    return {"modules": {"m": {"ports": ports, "cells": cells}}}
+
+
+def make_grid(congestion: CongestionParams | None, seed: int) -> GatesGrid:
+    rng = random.Random(seed)
+    random.seed(seed)
+    np.random.seed(seed)
+
+    gates, netlist = yosys_to_minecraft_gates(make_yosys_data(60, rng), "m")
+
+    return GatesGrid(Dim(24, 24), gates, netlist, congestion=congestion)
+
+
+def assert_grid_consistent(grid: GatesGrid) -> None:
+    # A grid built from scratch on the same placement has clean costs and indices
+    clean_grid = GatesGrid(
+        grid.dim,
+        grid.gates,
+        grid.netlist,
+        placement=grid.placement,
+        congestion=grid.congestion,
+    )
+    assert abs(grid.cost - clean_grid.cost) < 1e-6 * max(abs(clean_grid.cost), 1)
+
+    occupied = grid._grid != -1
+
+    for (dim_x, dim_y), index in grid._free_pos_indices.items():
+        legal = get_legal_anchor_mask(occupied, Dim(dim_x, dim_y))
+        xs, ys = np.indices(legal.shape)
+
+        assert len(index) == int(legal.sum())
+        assert (
+            index.contains_batch(xs.reshape(-1), ys.reshape(-1)) == legal.reshape(-1)
+        ).all()
+
+
+CONGESTION_CASES = [None, CongestionParams(weight=1.0, bin_size=4, capacity=0.5)]
+
+
+def test_mutate_and_undo_keep_cost_clean() -> None:
+    for congestion in CONGESTION_CASES:
+        grid = make_grid(congestion, 1)
+
+        for step in range(300):
+            move = grid.mutate(window=None if step % 2 == 0 else 3)
+
+            if random.random() < 0.5:
+                grid.undo_mutate(*move)
+
+            if step % 10 == 0:
+                assert_grid_consistent(grid)
+
+        assert_grid_consistent(grid)
+
+
+def test_batch_moves_keep_cost_clean() -> None:
+    for congestion in CONGESTION_CASES:
+        grid = make_grid(congestion, 2)
+
+        for step in range(100):
+            moves = grid.propose_moves(8, window=None if step % 2 == 0 else 3)
+            accepted = np.random.random(moves.num_moves) < 0.5
+
+            old_cost = grid.cost
+            delta_cost = grid.get_moves_delta_cost(moves)
+            grid.apply_moves(moves, accepted)
+
+            if congestion is None:
+                assert abs(grid.cost - old_cost - delta_cost[accepted].sum()) < 1e-6
+
+            if step % 5 == 0:
+                assert_grid_consistent(grid)
+
+        assert_grid_consistent(grid)
+
+
+def test_move_group_keeps_cost_clean() -> None:
+    for congestion in CONGESTION_CASES:
+        grid = make_grid(congestion, 3)
+        rng = random.Random(3)
+
+        # Gates of one footprint can take each other's positions
+        gate_ids = np.array(
+            [
+                gate_id
+                for gate_id, gate in enumerate(grid.gates)
+                if not gate.is_port and gate.dim == Dim(1, 1)
+            ]
+        )
+
+        for _ in range(50):
+            group = np.array(rng.sample(gate_ids.tolist(), 4))
+            pos_x, pos_y = grid.get_gate_positions(group)
+            order = np.array([*rng.sample(range(3), 3), 3])
+            to_x, to_y = pos_x[order], pos_y[order]
+
+            # The last gate of the group leaves for a free anchor
+            free_pos = grid._free_pos_indices[(1, 1)].sample()
+            assert free_pos is not None
+            to_x[3], to_y[3] = free_pos.x, free_pos.y
+
+            grid.move_group(group, to_x, to_y)
+            assert_grid_consistent(grid)
@@ -0,0 +1,77 @@
+import random
+import time
+
+from roadblock.netlist import construct_nor_inputs_rename_map
+
+
+def make_nor_data(pairs: list[tuple[int, int]]) -> dict:
+    cells = {
+        f"nor{i}": {"type": "NOR", "connections": {"A": [lhs], "B": [rhs], "Y": [-1]}}
+        for i, (lhs, rhs) in enumerate(pairs)
+    }
+
+    return {"modules": {"m": {"cells": cells}}}
+
+
+def get_groups_brute_force(pairs: list[tuple[int, int]]) -> dict[int, int]:
+    # Flood fill every net over the pairs, the group is named by its smallest net
+    neighbours: dict[int, set[int]] = {}
+
+    for lhs, rhs in pairs:
+        neighbours.setdefault(lhs, set()).add(rhs)
+        neighbours.setdefault(rhs, set()).add(lhs)
+
+    rename_map: dict[int, int] = {}
+
+    for net_id in neighbours:
+        if net_id in rename_map:
+            continue
+
+        group = {net_id}
+        stack = [net_id]
+
+        while len(stack) != 0:
+            for other_id in neighbours[stack.pop()] - group:
+                group.add(other_id)
+                stack.append(other_id)
+
+        for other_id in group:
+            rename_map[other_id] = min(group)
+
+    return rename_map
+
+
+def time_nor_chain(num_cells: int) -> float:
+    data = make_nor_data([(i, i + 1) for i in range(num_cells)])
+
+    start_time = time.perf_counter()
+    rename_map = construct_nor_inputs_rename_map(data, "m")
+    wall_time = time.perf_counter() - start_time
+
+    assert set(rename_map.values()) == {0}
+    assert len(rename_map) == num_cells + 1
+
+    return wall_time
+
+
+def test_nor_groups_match_brute_force() -> None:
+    rng = random.Random(0)
+
+    for _ in range(200):
+        num_nets = rng.randint(2, 30)
+        pairs = [
+            (rng.randrange(num_nets), rng.randrange(num_nets))
+            for _ in range(rng.randint(1, 40))
+        ]
+
+        rename_map = construct_nor_inputs_rename_map(make_nor_data(pairs), "m")
+
+        assert rename_map == get_groups_brute_force(pairs)
+
+
+def test_nor_chain_scales_linearly() -> None:
+    # A quadratic merge would take 16 times longer on a chain 4 times as long
+    small_time = min(time_nor_chain(100_000) for _ in range(3))
+    large_time = min(time_nor_chain(400_000) for _ in range(3))
+
+    assert large_time < 8 * small_time
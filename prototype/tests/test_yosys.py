@@ -0,0 +1,114 @@
+import json
+import random
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from roadblock.jsonstream import JsonStreamReader
+from roadblock import yosys
+from roadblock.yosys import get_yosys_cache_key, read_yosys_netlist_json
+
+
+def make_yosys_module(num_cells: int, rng: random.Random) -> dict:
+    nets = [2, 3]
+    ports = {
+        "a": {"direction": "input", "bits": [2]},
+        'b\u00e9 "q"': {"direction": "input", "bits": [3]},
+    }
+    cells = {}
+
+    for i in range(num_cells):
+        cell_type = rng.choice(["NOT", "NOR", "BUFF"])
+        connections = {"A": [rng.choice(nets)], "Y": [len(nets) + 2]}
+
+        if cell_type == "NOR":
+            connections["B"] = [rng.choice(nets)]
+
+        cells[f"$abc$123${cell_type}{i}"] = {
+            "hide_name": 1,
+            "type": cell_type,
+            "parameters": {},
+            "attributes": {"src": f"test.v:{i}.5-{i}.37", "keep": "00000001"},
+            "port_directions": {"A": "input", "Y": "output"},
+            "connections": connections,
+        }
+        nets.append(len(nets) + 2)
+
+    ports["y"] = {"direction": "output", "bits": [nets[-1]]}
+
+    return {
+        "attributes": {"top": "00000000000000000000000000000001", "src": "test.v"},
+        "ports": ports,
+        "cells": cells,
+        "netnames": {"a": {"hide_name": 0, "bits": [2], "attributes": {}}},
+    }
+
+
+def make_yosys_data(rng: random.Random) -> dict:
+    # Another module before the one read has to be skipped over
+    return {
+        "creator": "Yosys 0.9 (git sha1 1979e0b)",
+        "modules": {
+            "other": {
+                "attributes": {"blackbox": 1, "scale": -1.5e-3, "flag": None},
+                "ports": {"x": {"direction": "input", "bits": ["0", "x", 12345]}},
+                "cells": {},
+                "netnames": {"x": {"hide_name": False, "bits": [12345]}},
+            },
+            "m": make_yosys_module(40, rng),
+        },
+    }
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 64])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_stream_matches_json_load(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    chunk_size: int,
+    indent: int | None,
+) -> None:
+    # Small chunks split keys, strings, escapes and numbers across chunk boundaries
+    json_file_name = str(tmp_path / "netlist.json")
+
+    with open(json_file_name, "w") as f:
+        json.dump(make_yosys_data(random.Random(0)), f, indent=indent)
+
+    monkeypatch.setattr(JsonStreamReader, "CHUNK_SIZE", chunk_size)
+
+    gates, netlist = read_yosys_netlist_json(json_file_name, "m", stream=False)
+    stream_gates, stream_netlist = read_yosys_netlist_json(
+        json_file_name, "m", stream=True
+    )
+
+    assert stream_gates == gates
+
+    for field in netlist.__dataclass_fields__:
+        assert np.array_equal(getattr(stream_netlist, field), getattr(netlist, field))
+
+
+def test_stream_missing_module(tmp_path: Path) -> None:
+    json_file_name = str(tmp_path / "netlist.json")
+
+    with open(json_file_name, "w") as f:
+        json.dump(make_yosys_data(random.Random(0)), f)
+
+    with pytest.raises(KeyError):
+        read_yosys_netlist_json(json_file_name, "missing", stream=True)
+
+
+def test_cache_key_depends_on_version(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    verilog_file_name = str(tmp_path / "test.v")
+    lib_file_name = str(tmp_path / "cells.lib")
+
+    for file_name in (verilog_file_name, lib_file_name):
+        with open(file_name, "w") as f:
+            f.write(file_name)
+
+    key = get_yosys_cache_key(verilog_file_name, lib_file_name, "script", "m")
+    monkeypatch.setattr(yosys, "YOSYS_CACHE_VERSION", yosys.YOSYS_CACHE_VERSION + 1)
+
+    assert get_yosys_cache_key(verilog_file_name, lib_file_name, "script", "m") != key